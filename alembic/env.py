@@ -15,6 +15,7 @@ sys.path.append(str(Path(__file__).resolve().parents[1]))
 from app.core.database import Base
 from app.core.config import settings
 import app.models # Garante que os modelos sejam registrados no Base.metadata
+from app.jobs.ledger_partitions import is_partition_name
 # --- FIM DO BLOCO ADICIONADO ---
 
 config = context.config
@@ -31,6 +32,13 @@ target_metadata = Base.metadata
 # --- FIM DA LINHA CRÍTICA ---
 
 
+def include_name(name, type_, parent_names):
+    # As partições mensais do ledger são criadas pelo job de manutenção, não pelas migrações
+    if type_ == "table":
+        return not is_partition_name(name)
+    return True
+
+
 def run_migrations_offline() -> None:
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
@@ -38,6 +46,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_name=include_name,
     )
 
     with context.begin_transaction():
@@ -53,7 +62,7 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata, include_name=include_name
         )
 
         with context.begin_transaction():
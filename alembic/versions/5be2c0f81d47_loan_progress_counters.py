@@ -0,0 +1,48 @@
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '5be2c0f81d47'
+down_revision: Union[str, Sequence[str], None] = 'a41f0d7c93b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Contadores de progresso do empréstimo (parcelas pagas, saldo devedor, próxima parcela)."""
+
+    op.add_column('loans', sa.Column('installments_paid', sa.Integer(), server_default=sa.text('0'), nullable=False))
+    op.add_column('loans', sa.Column('outstanding_balance', sa.Numeric(precision=15, scale=2), nullable=True))
+    op.add_column('loans', sa.Column('next_installment_number', sa.Integer(), nullable=True))
+    op.add_column('loans', sa.Column('next_due_date', sa.Date(), nullable=True))
+
+    # Preenche os contadores a partir das parcelas existentes
+    op.execute("UPDATE loans SET outstanding_balance = amount")
+    op.execute("""
+        UPDATE loans l
+        SET installments_paid = s.paid,
+            outstanding_balance = s.outstanding,
+            next_installment_number = s.next_number,
+            next_due_date = s.next_due_date
+        FROM (
+            SELECT loan_id,
+                   COUNT(*) FILTER (WHERE status = 'PAID') AS paid,
+                   COALESCE(SUM(principal_amount) FILTER (WHERE status <> 'PAID'), 0) AS outstanding,
+                   MIN(installment_number) FILTER (WHERE status <> 'PAID') AS next_number,
+                   MIN(due_date) FILTER (WHERE status <> 'PAID') AS next_due_date
+            FROM installments
+            GROUP BY loan_id
+        ) s
+        WHERE s.loan_id = l.id
+    """)
+    op.alter_column('loans', 'outstanding_balance', nullable=False)
+
+
+def downgrade() -> None:
+    """Remove os contadores de progresso."""
+
+    op.drop_column('loans', 'next_due_date')
+    op.drop_column('loans', 'next_installment_number')
+    op.drop_column('loans', 'outstanding_balance')
+    op.drop_column('loans', 'installments_paid')
@@ -0,0 +1,26 @@
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '62abe2364365'
+down_revision: Union[str, Sequence[str], None] = 'c9dd812a42c1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Tabela de versão do livro de ofertas (linha única)."""
+
+    op.create_table('offer_book_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), server_default=sa.text('0'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("INSERT INTO offer_book_version (id, version) VALUES (1, 0)")
+
+
+def downgrade() -> None:
+    """Remove a tabela de versão do livro de ofertas."""
+
+    op.drop_table('offer_book_version')
@@ -0,0 +1,29 @@
+from typing import Sequence, Union
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '8c3f61e2b9a4'
+down_revision: Union[str, Sequence[str], None] = 'd07e3a9c5f12'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Índices da listagem de empréstimos (mutuário/credor + id) e das parcelas por empréstimo."""
+
+    with op.get_context().autocommit_block():
+        op.create_index('ix_loans_borrower_id_id', 'loans', ['borrower_id', 'id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_loans_lender_id_id', 'loans', ['lender_id', 'id'], unique=False, postgresql_concurrently=True)
+        op.create_index(
+            'ix_installments_loan_id_installment_number', 'installments', ['loan_id', 'installment_number'],
+            unique=False, postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    """Remove os índices da listagem de empréstimos."""
+
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_installments_loan_id_installment_number', table_name='installments', postgresql_concurrently=True)
+        op.drop_index('ix_loans_lender_id_id', table_name='loans', postgresql_concurrently=True)
+        op.drop_index('ix_loans_borrower_id_id', table_name='loans', postgresql_concurrently=True)
@@ -0,0 +1,41 @@
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41f0d7c93b2'
+down_revision: Union[str, Sequence[str], None] = '62abe2364365'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+AMORTIZATION_SYSTEM = postgresql.ENUM('SIMPLE', 'PRICE', 'SAC', name='amortizationsystem', create_type=False)
+
+
+def upgrade() -> None:
+    """Sistema de amortização do empréstimo e decomposição principal/juros das parcelas."""
+
+    AMORTIZATION_SYSTEM.create(op.get_bind(), checkfirst=True)
+    op.add_column('loans', sa.Column('amortization_system', AMORTIZATION_SYSTEM, server_default='SIMPLE', nullable=False))
+
+    op.add_column('installments', sa.Column('principal_amount', sa.Numeric(precision=15, scale=2), nullable=True))
+    op.add_column('installments', sa.Column('interest_amount', sa.Numeric(precision=15, scale=2), nullable=True))
+    # Parcelas existentes seguem o cronograma de juros simples: principal dividido igualmente entre as parcelas
+    op.execute("""
+        UPDATE installments i
+        SET principal_amount = ROUND(l.amount / l.term_months, 2),
+            interest_amount = i.amount - ROUND(l.amount / l.term_months, 2)
+        FROM loans l
+        WHERE l.id = i.loan_id
+    """)
+    op.alter_column('installments', 'principal_amount', nullable=False)
+    op.alter_column('installments', 'interest_amount', nullable=False)
+
+
+def downgrade() -> None:
+    """Remove as colunas de amortização."""
+
+    op.drop_column('installments', 'interest_amount')
+    op.drop_column('installments', 'principal_amount')
+    op.drop_column('loans', 'amortization_system')
+    AMORTIZATION_SYSTEM.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,46 @@
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8c5e2f91b06'
+down_revision: Union[str, Sequence[str], None] = 'f3b8d6a1c4e7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Execuções e divergências da conciliação saldo x ledger (app/jobs/reconcile_ledger.py)."""
+
+    op.create_table('ledger_reconciliations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.Enum('RUNNING', 'DONE', 'FAILED', name='reconciliationstatus'), nullable=False),
+    sa.Column('full', sa.Boolean(), nullable=False),
+    sa.Column('since', sa.DateTime(), nullable=True),
+    sa.Column('checkpoint', sa.DateTime(), nullable=False),
+    sa.Column('ranges_total', sa.Integer(), nullable=False),
+    sa.Column('ranges_done', sa.Integer(), nullable=False),
+    sa.Column('accounts_checked', sa.BigInteger(), nullable=False),
+    sa.Column('mismatches', sa.Integer(), nullable=False),
+    sa.Column('report_path', sa.String(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('ledger_reconciliation_mismatches',
+    sa.Column('reconciliation_id', sa.Integer(), nullable=False),
+    sa.Column('account_id', sa.Integer(), nullable=False),
+    sa.Column('balance', sa.Numeric(precision=15, scale=2), nullable=False),
+    sa.Column('ledger_balance', sa.Numeric(precision=15, scale=2), nullable=False),
+    sa.ForeignKeyConstraint(['account_id'], ['accounts.id'], ),
+    sa.ForeignKeyConstraint(['reconciliation_id'], ['ledger_reconciliations.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('reconciliation_id', 'account_id')
+    )
+
+
+def downgrade() -> None:
+    """Remove as tabelas da conciliação."""
+
+    op.drop_table('ledger_reconciliation_mismatches')
+    op.drop_table('ledger_reconciliations')
+    op.execute("DROP TYPE reconciliationstatus")
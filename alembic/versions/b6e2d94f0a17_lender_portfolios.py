@@ -0,0 +1,74 @@
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6e2d94f0a17'
+down_revision: Union[str, Sequence[str], None] = '8c3f61e2b9a4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Agregados da carteira dos credores e fluxo de caixa esperado por mês."""
+
+    op.create_table('lender_portfolios',
+    sa.Column('lender_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.Column('loans_count', sa.Integer(), nullable=False),
+    sa.Column('principal_lent', sa.Numeric(precision=15, scale=2), nullable=False),
+    sa.Column('outstanding_principal', sa.Numeric(precision=15, scale=2), nullable=False),
+    sa.Column('amount_received', sa.Numeric(precision=15, scale=2), nullable=False),
+    sa.Column('interest_earned', sa.Numeric(precision=15, scale=2), nullable=False),
+    sa.Column('overdue_installments', sa.Integer(), nullable=False),
+    sa.Column('overdue_amount', sa.Numeric(precision=15, scale=2), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['lender_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('lender_id')
+    )
+    op.create_table('lender_cashflows',
+    sa.Column('lender_id', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('expected_amount', sa.Numeric(precision=15, scale=2), nullable=False),
+    sa.Column('expected_principal', sa.Numeric(precision=15, scale=2), nullable=False),
+    sa.Column('expected_interest', sa.Numeric(precision=15, scale=2), nullable=False),
+    sa.ForeignKeyConstraint(['lender_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('lender_id', 'month')
+    )
+
+    # Preenche os agregados a partir dos empréstimos existentes (mesmo cálculo de app/jobs/rebuild_portfolios.py)
+    op.execute("""
+        INSERT INTO lender_portfolios (
+            lender_id, version, loans_count, principal_lent, outstanding_principal, amount_received,
+            interest_earned, overdue_installments, overdue_amount
+        )
+        SELECT l.lender_id, 1, COUNT(*), SUM(l.amount), SUM(l.outstanding_balance),
+               COALESCE(SUM(s.received), 0), COALESCE(SUM(s.interest), 0),
+               COALESCE(SUM(s.overdue_installments), 0), COALESCE(SUM(s.overdue_amount), 0)
+        FROM loans l
+        LEFT JOIN (
+            SELECT loan_id,
+                   SUM(valor_pago) FILTER (WHERE status = 'PAID') AS received,
+                   SUM(valor_pago - principal_amount) FILTER (WHERE status = 'PAID') AS interest,
+                   COUNT(*) FILTER (WHERE status = 'OVERDUE') AS overdue_installments,
+                   SUM(amount) FILTER (WHERE status = 'OVERDUE') AS overdue_amount
+            FROM installments
+            GROUP BY loan_id
+        ) s ON s.loan_id = l.id
+        GROUP BY l.lender_id
+    """)
+    op.execute("""
+        INSERT INTO lender_cashflows (lender_id, month, expected_amount, expected_principal, expected_interest)
+        SELECT l.lender_id, date_trunc('month', i.due_date)::date, SUM(i.amount), SUM(i.principal_amount), SUM(i.interest_amount)
+        FROM installments i
+        JOIN loans l ON l.id = i.loan_id
+        WHERE i.status IS DISTINCT FROM 'PAID'
+        GROUP BY 1, 2
+    """)
+
+
+def downgrade() -> None:
+    """Remove as tabelas de agregados das carteiras."""
+
+    op.drop_table('lender_cashflows')
+    op.drop_table('lender_portfolios')
@@ -0,0 +1,34 @@
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2e7a4b8d915'
+down_revision: Union[str, Sequence[str], None] = 'a8c5e2f91b06'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Outbox dos eventos enviados aos clientes por SSE/WebSocket (app/core/events.py)."""
+
+    op.create_table('outbox_events',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('type', sa.String(), nullable=False),
+    sa.Column('payload', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outbox_events_user_id_id', 'outbox_events', ['user_id', 'id'], unique=False)
+    op.create_index(op.f('ix_outbox_events_created_at'), 'outbox_events', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Remove o outbox de eventos."""
+
+    op.drop_index(op.f('ix_outbox_events_created_at'), table_name='outbox_events')
+    op.drop_index('ix_outbox_events_user_id_id', table_name='outbox_events')
+    op.drop_table('outbox_events')
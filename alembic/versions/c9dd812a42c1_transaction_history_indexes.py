@@ -0,0 +1,31 @@
+from typing import Sequence, Union
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9dd812a42c1'
+down_revision: Union[str, Sequence[str], None] = '3527449eba98'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Índices compostos (conta, timestamp_utc) para a paginação keyset do histórico."""
+
+    # CONCURRENTLY evita bloquear escritas no ledger durante a criação (exige rodar fora de transação)
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_transactions_origin_account_id_timestamp_utc', 'transactions',
+            ['origin_account_id', 'timestamp_utc'], unique=False, postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_transactions_destination_account_id_timestamp_utc', 'transactions',
+            ['destination_account_id', 'timestamp_utc'], unique=False, postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    """Remove os índices compostos do histórico."""
+
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_transactions_destination_account_id_timestamp_utc', table_name='transactions', postgresql_concurrently=True)
+        op.drop_index('ix_transactions_origin_account_id_timestamp_utc', table_name='transactions', postgresql_concurrently=True)
@@ -0,0 +1,39 @@
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'd07e3a9c5f12'
+down_revision: Union[str, Sequence[str], None] = '5be2c0f81d47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Marcas d'água dos jobs e índices parciais da varredura de inadimplência."""
+
+    op.create_table('job_watermarks',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('watermark_date', sa.Date(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_installments_pending_due_date', 'installments', ['due_date'], unique=False,
+            postgresql_where=sa.text("status = 'PENDING'"), postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_loans_active_next_due_date', 'loans', ['next_due_date'], unique=False,
+            postgresql_where=sa.text("status = 'ACTIVE'"), postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    """Remove os índices parciais e as marcas d'água."""
+
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_loans_active_next_due_date', table_name='loans', postgresql_concurrently=True)
+        op.drop_index('ix_installments_pending_due_date', table_name='installments', postgresql_concurrently=True)
+    op.drop_table('job_watermarks')
@@ -0,0 +1,35 @@
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5f1a3c7e926'
+down_revision: Union[str, Sequence[str], None] = 'c2e7a4b8d915'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Feed das ofertas novas compatíveis com as buscas de crédito ATIVAS."""
+
+    op.create_table('credit_search_matches',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('search_id', sa.Integer(), nullable=False),
+    sa.Column('offer_id', sa.Integer(), nullable=False),
+    sa.Column('borrower_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['borrower_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['offer_id'], ['credit_offers.id'], ),
+    sa.ForeignKeyConstraint(['search_id'], ['credit_searches.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_credit_search_matches_search_id_offer_id', 'credit_search_matches', ['search_id', 'offer_id'], unique=True)
+    op.create_index('ix_credit_search_matches_borrower_id_id', 'credit_search_matches', ['borrower_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Remove o feed de ofertas das buscas."""
+
+    op.drop_index('ix_credit_search_matches_borrower_id_id', table_name='credit_search_matches')
+    op.drop_index('ix_credit_search_matches_search_id_offer_id', table_name='credit_search_matches')
+    op.drop_table('credit_search_matches')
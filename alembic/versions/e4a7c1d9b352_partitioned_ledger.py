@@ -0,0 +1,123 @@
+from datetime import date, datetime
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4a7c1d9b352'
+down_revision: Union[str, Sequence[str], None] = 'b6e2d94f0a17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Meses criados à frente do mês corrente (depois, app/jobs/ledger_partitions.py ensure)
+MONTHS_AHEAD = 3
+COLUMNS = "id, timestamp_utc, type, value, origin_account_id, destination_account_id, reference_entity_id"
+INDEXES = [
+    ("ix_transactions_id", "id"),
+    ("ix_transactions_reference_entity_id", "reference_entity_id"),
+    ("ix_transactions_origin_account_id_timestamp_utc", "origin_account_id, timestamp_utc"),
+    ("ix_transactions_destination_account_id_timestamp_utc", "destination_account_id, timestamp_utc"),
+]
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def upgrade() -> None:
+    """
+    Ledger particionado por mês de timestamp_utc (RANGE), com id BIGINT e chave primária (id, timestamp_utc).
+    Cria uma partição por mês com dados até MONTHS_AHEAD meses à frente, mais a partição DEFAULT (rede
+    de segurança para meses ainda não criados), e copia as linhas da tabela atual. A cópia reescreve o
+    ledger uma única vez: em bases grandes, rode numa janela de manutenção.
+    """
+
+    op.execute("ALTER TABLE transactions RENAME TO transactions_unpartitioned")
+    op.execute("ALTER TABLE transactions_unpartitioned RENAME CONSTRAINT transactions_pkey TO transactions_unpartitioned_pkey")
+    op.execute("ALTER TABLE transactions_unpartitioned RENAME CONSTRAINT transactions_origin_account_id_fkey TO transactions_unpartitioned_origin_account_id_fkey")
+    op.execute("ALTER TABLE transactions_unpartitioned RENAME CONSTRAINT transactions_destination_account_id_fkey TO transactions_unpartitioned_destination_account_id_fkey")
+    for name, _ in INDEXES:
+        op.execute(f"ALTER INDEX {name} RENAME TO {name.replace('ix_transactions_', 'ix_transactions_unpartitioned_')}")
+
+    op.execute("""
+        CREATE TABLE transactions (
+            id BIGINT NOT NULL DEFAULT nextval('transactions_id_seq'),
+            timestamp_utc TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(),
+            type transactiontype NOT NULL,
+            value NUMERIC(15, 2) NOT NULL,
+            origin_account_id INTEGER REFERENCES accounts (id),
+            destination_account_id INTEGER REFERENCES accounts (id),
+            reference_entity_id VARCHAR,
+            CONSTRAINT transactions_pkey PRIMARY KEY (id, timestamp_utc)
+        ) PARTITION BY RANGE (timestamp_utc)
+    """)
+    # A sequência passa a pertencer à nova tabela (senão seria removida junto com a antiga)
+    op.execute("ALTER SEQUENCE transactions_id_seq AS BIGINT OWNED BY transactions.id")
+    for name, columns in INDEXES:
+        op.execute(f"CREATE INDEX {name} ON transactions ({columns})")
+    op.execute("CREATE TABLE transactions_default PARTITION OF transactions DEFAULT")
+
+    bind = op.get_bind()
+    oldest = bind.execute(sa.text("SELECT min(timestamp_utc) FROM transactions_unpartitioned")).scalar()
+    current = date.today().replace(day=1)
+    month = min(oldest.date().replace(day=1), current) if oldest else current
+    while month <= _add_months(current, MONTHS_AHEAD):
+        following = _add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE transactions_p{month:%Y_%m} PARTITION OF transactions "
+            f"FOR VALUES FROM ('{datetime.combine(month, datetime.min.time())}') "
+            f"TO ('{datetime.combine(following, datetime.min.time())}')"
+        )
+        month = following
+
+    op.execute(f"INSERT INTO transactions ({COLUMNS}) SELECT {COLUMNS} FROM transactions_unpartitioned")
+    op.execute("DROP TABLE transactions_unpartitioned")
+
+    op.create_table('transaction_archives',
+    sa.Column('partition_name', sa.String(), nullable=False),
+    sa.Column('range_start', sa.DateTime(), nullable=False),
+    sa.Column('range_end', sa.DateTime(), nullable=False),
+    sa.Column('row_count', sa.BigInteger(), nullable=False),
+    sa.Column('file_path', sa.String(), nullable=True),
+    sa.Column('sha256', sa.String(), nullable=True),
+    sa.Column('detached_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.Column('exported_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('partition_name')
+    )
+    op.create_table('account_archived_balances',
+    sa.Column('account_id', sa.Integer(), nullable=False),
+    sa.Column('net_amount', sa.Numeric(precision=15, scale=2), nullable=False),
+    sa.ForeignKeyConstraint(['account_id'], ['accounts.id'], ),
+    sa.PrimaryKeyConstraint('account_id')
+    )
+
+
+def downgrade() -> None:
+    """Volta o ledger para uma tabela única (as linhas de partições já arquivadas não são restauradas)."""
+
+    op.drop_table('account_archived_balances')
+    op.drop_table('transaction_archives')
+
+    op.execute("""
+        CREATE TABLE transactions_unpartitioned (
+            id INTEGER NOT NULL,
+            timestamp_utc TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(),
+            type transactiontype NOT NULL,
+            value NUMERIC(15, 2) NOT NULL,
+            origin_account_id INTEGER REFERENCES accounts (id),
+            destination_account_id INTEGER REFERENCES accounts (id),
+            reference_entity_id VARCHAR,
+            PRIMARY KEY (id)
+        )
+    """)
+    op.execute(f"INSERT INTO transactions_unpartitioned ({COLUMNS}) SELECT {COLUMNS} FROM transactions")
+    op.execute("ALTER SEQUENCE transactions_id_seq AS INTEGER OWNED BY transactions_unpartitioned.id")
+    op.execute("ALTER TABLE transactions_unpartitioned ALTER COLUMN id SET DEFAULT nextval('transactions_id_seq')")
+    op.execute("DROP TABLE transactions")
+    op.execute("ALTER TABLE transactions_unpartitioned RENAME TO transactions")
+    op.execute("ALTER TABLE transactions RENAME CONSTRAINT transactions_unpartitioned_pkey TO transactions_pkey")
+    op.execute("ALTER TABLE transactions RENAME CONSTRAINT transactions_unpartitioned_origin_account_id_fkey TO transactions_origin_account_id_fkey")
+    op.execute("ALTER TABLE transactions RENAME CONSTRAINT transactions_unpartitioned_destination_account_id_fkey TO transactions_destination_account_id_fkey")
+    for name, columns in INDEXES:
+        op.execute(f"CREATE INDEX {name} ON transactions ({columns})")
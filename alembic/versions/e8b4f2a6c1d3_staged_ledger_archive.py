@@ -0,0 +1,22 @@
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8b4f2a6c1d3'
+down_revision: Union[str, Sequence[str], None] = 'd5f1a3c7e926'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """transaction_archives passa a registrar a partição antes do DETACH (detached_at nulo até lá)."""
+
+    op.alter_column('transaction_archives', 'detached_at', existing_type=sa.DateTime(), server_default=None, nullable=True)
+
+
+def downgrade() -> None:
+    """Volta a exigir detached_at (partições ainda anexadas recebem o instante atual)."""
+
+    op.execute("UPDATE transaction_archives SET detached_at = now() WHERE detached_at IS NULL")
+    op.alter_column('transaction_archives', 'detached_at', existing_type=sa.DateTime(), server_default=sa.text('now()'), nullable=False)
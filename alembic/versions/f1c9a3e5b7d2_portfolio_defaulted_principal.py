@@ -0,0 +1,36 @@
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1c9a3e5b7d2'
+down_revision: Union[str, Sequence[str], None] = 'e8b4f2a6c1d3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Principal em aberto dos empréstimos em DEFAULT separado de outstanding_principal nas carteiras."""
+
+    op.add_column('lender_portfolios', sa.Column('defaulted_principal', sa.Numeric(precision=15, scale=2), server_default='0', nullable=False))
+    op.alter_column('lender_portfolios', 'defaulted_principal', server_default=None)
+    # Empréstimos que já estão em DEFAULT saem do principal em aberto (e as carteiras mudam de versão)
+    op.execute("""
+        UPDATE lender_portfolios p
+        SET outstanding_principal = p.outstanding_principal - d.principal,
+            defaulted_principal = d.principal,
+            version = p.version + 1,
+            updated_at = now()
+        FROM (
+            SELECT lender_id, sum(outstanding_balance) AS principal FROM loans
+            WHERE status = 'DEFAULT' GROUP BY lender_id
+        ) d
+        WHERE p.lender_id = d.lender_id
+    """)
+
+
+def downgrade() -> None:
+    """Devolve o principal dos empréstimos em DEFAULT a outstanding_principal."""
+
+    op.execute("UPDATE lender_portfolios SET outstanding_principal = outstanding_principal + defaulted_principal")
+    op.drop_column('lender_portfolios', 'defaulted_principal')
@@ -0,0 +1,30 @@
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b8d6a1c4e7'
+down_revision: Union[str, Sequence[str], None] = 'e4a7c1d9b352'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Fechamentos diários de saldo por conta (preenchidos por app/jobs/balance_snapshots.py)."""
+
+    op.create_table('account_balance_snapshots',
+    sa.Column('account_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('credit_total', sa.Numeric(precision=15, scale=2), nullable=False),
+    sa.Column('debit_total', sa.Numeric(precision=15, scale=2), nullable=False),
+    sa.Column('closing_balance', sa.Numeric(precision=15, scale=2), nullable=False),
+    sa.ForeignKeyConstraint(['account_id'], ['accounts.id'], ),
+    sa.PrimaryKeyConstraint('account_id', 'day')
+    )
+
+
+def downgrade() -> None:
+    """Remove os fechamentos diários (e a marca d'água do job)."""
+
+    op.drop_table('account_balance_snapshots')
+    op.execute("DELETE FROM job_watermarks WHERE name = 'balance_snapshots'")
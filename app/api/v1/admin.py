@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from ... import models, schemas
-from ...core import database, security
+from ...core import database, security, ledger
 
 router = APIRouter()
 
@@ -14,14 +14,13 @@ def set_user_balance(
     if current_user.id != 1:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
 
-    target_account = db.query(models.Account).filter(models.Account.owner_id == request.user_id).first()
-    
-    if not target_account:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Target user account not found")
-
     try:
-        target_account.balance = request.new_balance
+        # UPDATE ... RETURNING com a diferença registrada no ledger (DEPOSITO/SAQUE) no mesmo comando
+        ledger.set_balance(db, request.user_id, request.new_balance, reference_entity_id=f"admin:{current_user.id}")
         db.commit()
+    except ledger.AccountNotFound:
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Target user account not found")
     except Exception:
         db.rollback()
         raise HTTPException(status_code=500, detail="Could not update balance")
@@ -45,6 +44,7 @@ def updateUserKYCStatus(
     try:
         target_user.kyc_status = request.new_status
         db.commit()
+        security.invalidate_user(target_user.email)
         db.refresh(target_user)
     except Exception:
         db.rollback()
@@ -40,6 +40,7 @@ def register_user(user_in: schemas.UserCreate, db: Session = Depends(database.ge
         db.add(new_account)
         
         db.commit() 
+        security.invalidate_user(new_user.email)
     except Exception as e:
         db.rollback()
         # Imprime o erro detalhado para ajudar no debugging se for outro problema
@@ -57,10 +58,27 @@ def register_user(user_in: schemas.UserCreate, db: Session = Depends(database.ge
 )
 def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
     user = db.query(models.User).filter(models.User.email == form_data.username).first()
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password", 
         )
-    access_token = security.create_access_token(data={"sub": user.email})
+    verified, new_hash = security.verify_and_update_password(form_data.password, user.hashed_password)
+    if not verified:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect email or password", 
+        )
+
+    # Rehash transparente quando o custo do bcrypt configurado mudou
+    if new_hash:
+        try:
+            user.hashed_password = new_hash
+            db.commit()
+            security.invalidate_user(user.email)
+        except Exception as e:
+            db.rollback()
+            print(f"Erro ao atualizar hash de senha: {e}")
+
+    access_token = security.create_access_token(data=security.principal_claims(user))
     return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
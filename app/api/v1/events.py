@@ -0,0 +1,85 @@
+# app/api/v1/events.py
+
+import asyncio
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, WebSocket, status
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from ...core import events, security
+from ...core.config import settings
+
+router = APIRouter()
+
+# Espera sugerida ao EventSource antes de reconectar (ms)
+SSE_RETRY_MILLISECONDS = 3000
+
+def _resume_id(value: Optional[str]) -> Optional[int]:
+    return int(value) if value is not None and value.strip().isdigit() else None
+
+async def _open(token: Optional[str], last_event_id: Optional[int]) -> events.EventStream:
+    # Autenticação e leitura da retomada consultam o banco: fora do event loop
+    principal = await run_in_threadpool(security.principal_from_token, token)
+    return await run_in_threadpool(events.dispatcher.connect, principal.id, asyncio.get_running_loop(), last_event_id)
+
+async def _sse(stream: events.EventStream):
+    try:
+        yield f"retry: {SSE_RETRY_MILLISECONDS}\n\n"
+        async for event in events.iterate(stream, settings.EVENTS_HEARTBEAT_SECONDS):
+            yield ": ping\n\n" if event is None else event.sse()
+    finally:
+        events.dispatcher.disconnect(stream)
+
+@router.get(
+    "/stream",
+    response_class=StreamingResponse,
+    summary="Eventos em Tempo Real (SSE)",
+    description="Stream text/event-stream com os eventos do usuário autenticado: saldo atualizado (balance.updated), empréstimo contratado (loan.created), parcela paga (loan.installment_paid), mudança no livro de ofertas (offers.updated) e oferta nova compatível com uma busca ATIVA (search.matched, também no feed /marketplace/searches/matches). Cada evento do usuário tem um id; ao reconectar, o cabeçalho Last-Event-ID (ou 'last_event_id') retoma a partir dele. O evento 'resync' indica que o estado deve ser recarregado pelas rotas REST."
+)
+async def stream_events(
+    access_token: Optional[str] = Query(None, description="Token de acesso, para clientes (EventSource) que não enviam o cabeçalho Authorization."),
+    last_event_id: Optional[int] = Query(None, description="Último id de evento recebido."),
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+    token: Optional[str] = Depends(security.optional_oauth2_scheme),
+):
+    resume_from = _resume_id(last_event_id_header)
+    stream = await _open(token or access_token, last_event_id if resume_from is None else resume_from)
+    return StreamingResponse(
+        _sse(stream),
+        media_type="text/event-stream",
+        # Sem cache e sem buffer em proxies (nginx), para que cada evento chegue assim que é enviado
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def _send_events(websocket: WebSocket, stream: events.EventStream):
+    async for event in events.iterate(stream, settings.EVENTS_HEARTBEAT_SECONDS):
+        await websocket.send_json({"type": "ping"} if event is None else event.message())
+
+async def _wait_disconnect(websocket: WebSocket):
+    # Mensagens do cliente são ignoradas; só o fechamento interessa
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+
+@router.websocket("/ws")
+async def websocket_events(
+    websocket: WebSocket,
+    access_token: Optional[str] = Query(None),
+    last_event_id: Optional[int] = Query(None),
+):
+    """Mesmos eventos de /stream, como mensagens JSON {"id", "type", "data"}."""
+    try:
+        stream = await _open(access_token, last_event_id)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    try:
+        await websocket.accept()
+        sender = asyncio.ensure_future(_send_events(websocket, stream))
+        receiver = asyncio.ensure_future(_wait_disconnect(websocket))
+        done, pending = await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        if sender in done and sender.exception() is None:
+            # Eventos acumulados demais: o cliente reconecta com o último id recebido
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+    finally:
+        events.dispatcher.disconnect(stream)
@@ -0,0 +1,85 @@
+# app/api/v1/internal.py
+
+import secrets
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
+from ...core import database, events, metrics, security
+from ...core.config import settings
+from ...core.offers_cache import offers_cache
+from ...core.principal_cache import principal_cache
+from ...jobs import reconcile_ledger
+
+# Estado interno do worker (pool, caches, conciliação): só para o administrador
+router = APIRouter(dependencies=[Depends(security.get_admin_principal)])
+
+def require_scrape_token(authorization: Optional[str] = Header(None)):
+    # Sem METRICS_SCRAPE_TOKEN o router só é montado em development (ver main.py)
+    if not settings.METRICS_SCRAPE_TOKEN:
+        return
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(token.encode(), settings.METRICS_SCRAPE_TOKEN.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid scrape token.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+# /metrics fica na raiz, caminho padrão de coleta do Prometheus
+metrics_router = APIRouter(dependencies=[Depends(require_scrape_token)])
+
+@router.get(
+    "/pool",
+    summary="Estatísticas do Pool de Conexões",
+    description="Retorna, por engine, o uso do pool de conexões deste worker: conexões em uso, overflow, timeouts e tempo de espera no checkout."
+)
+def get_pool_stats():
+    return {name: stats.snapshot() for name, stats in database.pool_stats.items()}
+
+@router.get(
+    "/replicas",
+    summary="Estado das Réplicas de Leitura",
+    description="Retorna, por réplica, se ela está recebendo leituras, o atraso de replicação medido e o último erro da verificação de saúde deste worker."
+)
+def get_replica_status():
+    return {replica.name: replica.snapshot() for replica in database.replicas.replicas}
+
+@router.get(
+    "/principal-cache",
+    summary="Estatísticas do Cache de Usuários",
+    description="Retorna acertos, faltas, evicções e invalidações do cache de usuários autenticados deste worker."
+)
+def get_principal_cache_stats():
+    return principal_cache.stats()
+
+@router.get(
+    "/offers-cache",
+    summary="Estatísticas do Cache de Ofertas",
+    description="Retorna a versão do livro de ofertas em cache neste worker, o número de ofertas e os acertos na camada local e na compartilhada."
+)
+def get_offers_cache_stats():
+    return offers_cache.stats()
+
+@router.get(
+    "/reconciliation",
+    summary="Progresso da Conciliação Saldo x Ledger",
+    description="Retorna a execução mais recente da conciliação (app/jobs/reconcile_ledger.py): estado, faixas de contas verificadas, contas por segundo, divergências encontradas e o caminho do relatório."
+)
+def get_reconciliation_status():
+    with database.engine.connect() as conn:
+        return reconcile_ledger.status(conn)
+
+@router.get(
+    "/events",
+    summary="Estado da Entrega de Eventos",
+    description="Retorna, para este worker, se o LISTEN do canal de eventos está ativo, usuários e conexões SSE/WebSocket abertas, notificações recebidas, consultas periódicas ao outbox e eventos entregues."
+)
+def get_event_dispatcher_stats():
+    return events.dispatcher.stats()
+
+@metrics_router.get(
+    "/metrics",
+    summary="Métricas (Prometheus)",
+    description="Métricas deste worker no formato texto do Prometheus: latência por rota e status, requisições em andamento, pool de conexões e contadores de negócio."
+)
+def get_metrics():
+    return Response(metrics.registry.expose(), media_type=metrics.CONTENT_TYPE)
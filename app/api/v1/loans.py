@@ -1,14 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response, status
+from sqlalchemy.orm import Session, selectinload
 from datetime import date
-from dateutil.relativedelta import relativedelta
 from decimal import Decimal
-from typing import List
-from sqlalchemy import or_ 
+from typing import List, Optional, Union
+from sqlalchemy import and_, select, union, update
 from sqlalchemy.sql import func 
 
 from ... import models, schemas
-from ...core import database, security
+from ...core import database, security, matching, offer_book, ledger, amortization, pagination, responses, portfolio, simulation, metrics, events
+from ...core.config import settings
 
 router = APIRouter()
 
@@ -41,20 +41,21 @@ def accept_offer(
         if borrower.id == offer.lender_id:
              raise HTTPException(status_code=400, detail="Cannot accept your own offer")
 
-        # 3. Busca e Bloqueio das Contas
-        lender_account = db.query(models.Account).filter(models.Account.owner_id == offer.lender_id).with_for_update().first()
+        # 3. Bloqueio das Contas (um único SELECT, em ordem de id)
+        accounts = ledger.lock_accounts(db, (offer.lender_id, borrower.id))
+        lender_account, borrower_account = accounts[offer.lender_id], accounts[borrower.id]
         if lender_account.balance < request.amount:
             raise HTTPException(status_code=400, detail="Lender has insufficient funds")
         
-        borrower_account = db.query(models.Account).filter(models.Account.owner_id == borrower.id).with_for_update().first()
-        
-        # 4. Atualiza o Status da Oferta
+        # 4. Atualiza o Status da Oferta (a versão do livro de ofertas só é incrementada no fim, passo 9)
         offer.status = models.OfferStatus.COMMITTED
         
         # 5. Cria o Novo Empréstimo
         new_loan = models.Loan(
             borrower_id=borrower.id, lender_id=offer.lender_id, credit_offer_id=offer.id,
             amount=request.amount, interest_rate=offer.interest_rate, term_months=offer.term_months,
+            amortization_system=request.amortization_system,
+            outstanding_balance=request.amount, installments_paid=0,
             # Novos campos
             search_id_fk=None, # Não recebemos search_id aqui, mas o campo está mapeado
             data_contrato=date.today()
@@ -62,40 +63,44 @@ def accept_offer(
         db.add(new_loan)
         db.flush()
 
-        # 6. Calcula e Cria as Parcelas (Installments)
-        term_factor = Decimal(new_loan.term_months) / Decimal(12)
-        total_interest = new_loan.amount * new_loan.interest_rate * term_factor
-        total_repayment = new_loan.amount + total_interest
-        installment_amount = total_repayment / Decimal(new_loan.term_months) 
-
-        for i in range(1, new_loan.term_months + 1):
-            due_date = date.today() + relativedelta(months=i)
-            installment = models.Installment(
-                loan_id=new_loan.id, installment_number=i, due_date=due_date, 
-                amount=installment_amount
-                # valor_pago/data_pagamento usam defaults no modelo
-            )
-            db.add(installment)
-            
-        # 7. Atualiza os Saldos das Contas (Saída do Credor, Entrada do Mutuário)
-        lender_account.balance -= request.amount
-        borrower_account.balance += request.amount
+        # 6. Calcula o cronograma completo e grava as Parcelas (Installments) em um único INSERT em lote
+        schedule = amortization.build_schedule(
+            new_loan.amount, new_loan.interest_rate, new_loan.term_months,
+            new_loan.amortization_system, new_loan.data_contrato
+        )
+        amortization.insert_installments(db, new_loan.id, schedule)
+        portfolio.record_loan(db, new_loan.lender_id, new_loan.amount, schedule)
+        new_loan.next_installment_number = 1
+        new_loan.next_due_date = schedule.due_dates[0].item()
 
-        # 8. Cria Registros de Transação (Ledger)
+        # 7. Saída do Credor, Entrada do Mutuário e Registros de Transação (Ledger) em um único comando
         loan_reference = str(new_loan.id)
-        db.add(models.Transaction(
-            type=models.TransactionType.EMPRESTIMO_CONCEDIDO, value=request.amount,
-            origin_account_id=lender_account.id, destination_account_id=borrower_account.id,
-            reference_entity_id=loan_reference
-        ))
-        db.add(models.Transaction(
-            type=models.TransactionType.P2P_CREDITO, value=request.amount,
-            origin_account_id=lender_account.id, destination_account_id=borrower_account.id,
-            reference_entity_id=loan_reference
-        ))
+        ledger.move_funds(db, lender_account.id, borrower_account.id, request.amount, [
+            ledger.Entry(models.TransactionType.EMPRESTIMO_CONCEDIDO, loan_reference),
+            ledger.Entry(models.TransactionType.P2P_CREDITO, loan_reference),
+        ])
+
+        # 8. Eventos para as duas partes
+        loan_event = {"loan_id": new_loan.id, "amount": new_loan.amount}
+        events.publish(db, [
+            (borrower.id, events.LOAN_CREATED, {**loan_event, "role": "borrower"}),
+            (offer.lender_id, events.LOAN_CREATED, {**loan_event, "role": "lender"}),
+        ])
+        events.publish_balances(db, (offer.lender_id, borrower.id), reason="loan_disbursement")
+
+        # 9. Versão do livro de ofertas e o evento de quem o acompanha por último: o lock da linha global
+        # da versão fica retido só até o commit logo abaixo
+        offer_version = offer_book.bump_version(db)
+        events.publish(db, [(None, events.OFFERS_UPDATED, {"version": offer_version, "offer_id": offer.id, "status": offer.status})])
 
         db.commit()
 
+    except ledger.AccountNotFound:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Account not found")
+    except ledger.InsufficientFunds:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Lender has insufficient funds")
     except HTTPException:
         db.rollback()
         raise
@@ -103,31 +108,209 @@ def accept_offer(
         db.rollback()
         print(f"ERRO CRÍTICO NO ACEITAR OFERTA: {e}") 
         raise HTTPException(status_code=500, detail="Loan acceptance failed due to an unexpected server error.")
+
+    # A oferta deixou de estar ATIVA: remove do índice de matching deste worker
+    matching.offer_index.remove(offer_id, offer_version)
+    metrics.loans_accepted.inc()
+    metrics.record_movement("loan_disbursement", request.amount)
     
     db.refresh(new_loan)
     return new_loan
 
+@router.post(
+    "/loan/simulate",
+    response_model=schemas.LoanSimulationOut,
+    summary="Simular Empréstimo",
+    description="Calcula o cronograma de parcelas (juros simples, Price ou SAC) para os parâmetros informados, sem gravar nada no banco."
+)
+def simulate_loan(request: schemas.LoanSimulationRequest):
+    try:
+        schedule = amortization.build_schedule(
+            request.amount, request.interest_rate, request.term_months,
+            request.amortization_system, request.start_date
+        )
+    except amortization.ScheduleOverflow:
+        raise HTTPException(status_code=422, detail="Loan parameters are out of range for the schedule calculation.")
+    return schemas.LoanSimulationOut(
+        amount=request.amount, interest_rate=request.interest_rate, term_months=request.term_months,
+        amortization_system=request.amortization_system, total_amount=schedule.total_amount,
+        total_interest=schedule.total_interest, installments=schedule.rows(),
+    )
+
 @router.get(
     "/loan/my-loans", 
-    response_model=List[schemas.LoanOut],
+    response_model=Union[List[schemas.LoanOut], List[schemas.LoanSummaryOut]],
     summary="Listar Meus Empréstimos",
-    description="Retorna todos os contratos de empréstimo onde o usuário autenticado é o Mutuário (Borrower) ou o Credor (Lender)."
+    description="Retorna os contratos de empréstimo onde o usuário autenticado é o Mutuário (Borrower) ou o Credor (Lender), em ordem de id e em páginas de tamanho fixo. O cursor da próxima página é devolvido no cabeçalho X-Next-Cursor e deve ser enviado no parâmetro 'after'. Com view=summary são devolvidos apenas os cabeçalhos e os contadores de progresso, sem as parcelas."
 )
 def get_my_loans(
-    current_user: models.User = Depends(security.get_current_user),
-    db: Session = Depends(database.get_db)
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    after: Optional[str] = Query(None, description="Cursor devolvido em X-Next-Cursor pela página anterior."),
+    view: str = Query("full", pattern="^(full|summary)$"),
+    current_user: schemas.Principal = Depends(security.get_current_principal),
+    db: Session = Depends(database.get_read_db)
 ):
     user_id = current_user.id
-    
-    loans = db.query(models.Loan).filter(
-        or_(
-            models.Loan.borrower_id == user_id,
-            models.Loan.lender_id == user_id
+
+    filters = []
+    if after:
+        (after_id,) = pagination.decode_cursor(after, 1)
+        try:
+            filters.append(models.Loan.id > int(after_id))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
+
+    # Keyset em id: cada lado (mutuário/credor) é servido pelo seu índice composto e limitado à página
+    def branch(column):
+        return select(models.Loan.id).where(column == user_id, *filters).order_by(models.Loan.id).limit(limit + 1)
+
+    page = union(branch(models.Loan.borrower_id), branch(models.Loan.lender_id)).subquery()
+    page_ids = select(page.c.id).order_by(page.c.id).limit(limit + 1)
+
+    if view == "summary":
+        overdue = (
+            select(func.count())
+            .where(
+                models.Installment.loan_id == models.Loan.id,
+                models.Installment.status == models.InstallmentStatus.OVERDUE,
+            )
+            .scalar_subquery()
         )
-    ).all()
-    
+        loans = db.execute(
+            select(
+                models.Loan.id, models.Loan.borrower_id, models.Loan.lender_id, models.Loan.amount,
+                models.Loan.interest_rate, models.Loan.term_months, models.Loan.status,
+                models.Loan.amortization_system, models.Loan.data_contrato, models.Loan.installments_paid,
+                overdue.label("overdue_installments"), models.Loan.outstanding_balance,
+                models.Loan.next_installment_number, models.Loan.next_due_date,
+            )
+            .where(models.Loan.id.in_(page_ids))
+            .order_by(models.Loan.id)
+        ).all()
+        if not settings.FAST_LIST_SERIALIZATION:
+            loans = [schemas.LoanSummaryOut.from_orm(loan) for loan in loans]
+    elif settings.FAST_LIST_SERIALIZATION:
+        loans = db.execute(
+            select(*(models.Loan.__table__.c[field] for field in responses.schema_fields(schemas.LoanOut) if field != "installments"))
+            .where(models.Loan.id.in_(page_ids))
+            .order_by(models.Loan.id)
+        ).all()
+    else:
+        # selectinload: as parcelas da página inteira vêm em uma única consulta adicional
+        loans = db.scalars(
+            select(models.Loan)
+            .where(models.Loan.id.in_(page_ids))
+            .order_by(models.Loan.id)
+            .options(selectinload(models.Loan.installments))
+        ).all()
+
+    if len(loans) > limit:
+        loans = loans[:limit]
+        pagination.set_next_cursor(response, pagination.encode_cursor(loans[-1].id))
+
+    if settings.FAST_LIST_SERIALIZATION:
+        if view == "summary":
+            return responses.list_response(responses.as_dicts(loans, responses.schema_fields(schemas.LoanSummaryOut)), response)
+        return responses.list_response(_loans_with_installments(db, loans), response)
     return loans
 
+def _loans_with_installments(db: Session, loans) -> List[dict]:
+    # Mesmo formato de LoanOut: as parcelas da página inteira vêm em uma única consulta, agrupadas por empréstimo
+    loan_fields = [field for field in responses.schema_fields(schemas.LoanOut) if field != "installments"]
+    installment_fields = responses.schema_fields(schemas.InstallmentOut)
+    items = {}
+    for loan in loans:
+        items[loan.id] = {field: getattr(loan, field) for field in loan_fields}
+        items[loan.id]["installments"] = []
+    if items:
+        installments = models.Installment.__table__.c
+        rows = db.execute(
+            select(installments.loan_id, *(installments[field] for field in installment_fields))
+            .where(installments.loan_id.in_(list(items)))
+            .order_by(installments.loan_id, installments.installment_number)
+        ).all()
+        for row in rows:
+            items[row.loan_id]["installments"].append({field: getattr(row, field) for field in installment_fields})
+    return list(items.values())
+
+@router.get(
+    "/loan/portfolio",
+    response_model=schemas.LenderPortfolioOut,
+    summary="Carteira do Credor",
+    description="Retorna os totais da carteira do usuário autenticado como Credor (principal emprestado e em aberto, valores recebidos, juros ganhos, parcelas em atraso) e o fluxo de caixa esperado por mês. Os agregados são mantidos a cada empréstimo e pagamento, então o custo não depende do número de empréstimos."
+)
+def get_lender_portfolio(
+    current_user: schemas.Principal = Depends(security.get_current_principal),
+    db: Session = Depends(database.get_db)
+):
+    portfolios, cashflows = models.LenderPortfolio.__table__, models.LenderCashflow.__table__
+    totals = db.execute(select(portfolios).where(portfolios.c.lender_id == current_user.id)).first()
+    if totals is None:
+        # Usuário que ainda não emprestou: carteira vazia
+        return schemas.LenderPortfolioOut(
+            lender_id=current_user.id, version=0, loans_count=0, principal_lent=0, outstanding_principal=0,
+            defaulted_principal=0, amount_received=0, interest_earned=0, overdue_installments=0, overdue_amount=0, cashflow=[],
+        )
+    cashflow = db.execute(
+        select(cashflows.c.month, cashflows.c.expected_amount, cashflows.c.expected_principal, cashflows.c.expected_interest)
+        .where(cashflows.c.lender_id == current_user.id, cashflows.c.expected_amount > 0)
+        .order_by(cashflows.c.month)
+    ).all()
+    return schemas.LenderPortfolioOut(
+        **{field: getattr(totals, field) for field in schemas.LenderPortfolioOut.__fields__ if field != "cashflow"},
+        cashflow=[schemas.PortfolioCashflowOut.from_orm(row) for row in cashflow],
+    )
+
+@router.post(
+    "/loan/portfolio/simulate",
+    response_model=schemas.PortfolioSimulationOut,
+    summary="Simular Carteira do Credor",
+    description="Projeta o fluxo de caixa das parcelas em aberto da carteira do usuário autenticado como Credor, com a TIR contratada e a esperada, e simula cenários de default (Monte Carlo, com risco derivado do score de crédito de cada mutuário). O resultado fica em cache até a próxima alteração da carteira."
+)
+def simulate_lender_portfolio(
+    request: Optional[schemas.PortfolioSimulationRequest] = Body(None),
+    current_user: schemas.Principal = Depends(security.get_current_principal),
+    db: Session = Depends(database.get_db)
+):
+    request = request or schemas.PortfolioSimulationRequest()
+    if request.paths > settings.PORTFOLIO_SIMULATION_MAX_PATHS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.PORTFOLIO_SIMULATION_MAX_PATHS} paths per simulation.")
+
+    portfolios = models.LenderPortfolio.__table__
+    version = db.execute(select(portfolios.c.version).where(portfolios.c.lender_id == current_user.id)).scalar() or 0
+    # A carteira (e portanto o resultado) só muda quando a versão muda; o mês corrente entra na chave
+    # porque define o mês 0 do fluxo
+    today = date.today()
+    key = (current_user.id, version, today.replace(day=1), request.paths, request.recovery_rate, request.seed)
+    cached = simulation.simulation_cache.get(key)
+    if cached is not None:
+        return cached
+
+    book = simulation.load_book(db, current_user.id, today)
+    seed = request.seed if request.seed is not None else [current_user.id, version]
+    result = simulation.run(simulation.simulate, book, request.paths, float(request.recovery_rate), seed)
+
+    out = schemas.PortfolioSimulationOut(
+        lender_id=current_user.id, version=version, paths=request.paths, recovery_rate=request.recovery_rate,
+        loans=book.loans,
+        outstanding_principal=simulation.money(result.exposure),
+        scheduled_amount=simulation.money(result.scheduled_total),
+        expected_amount=simulation.money(result.expected_by_month.sum()),
+        expected_loss=simulation.money(result.expected_loss),
+        scheduled_irr=result.scheduled_irr,
+        expected_irr=result.expected_irr,
+        cashflow=[
+            schemas.SimulatedCashflowMonth(
+                month=month, scheduled_amount=simulation.money(scheduled), expected_amount=simulation.money(expected),
+            )
+            for month, scheduled, expected in result.cashflow()
+        ],
+        returns=schemas.SimulatedReturns(**result.return_stats()),
+    )
+    simulation.simulation_cache.put(key, out)
+    return out
+
 @router.get(
     "/loan/{loan_id}/installments", 
     response_model=List[schemas.InstallmentOut],
@@ -136,8 +319,8 @@ def get_my_loans(
 )
 def get_loan_installments(
     loan_id: int,
-    current_user: models.User = Depends(security.get_current_user),
-    db: Session = Depends(database.get_db)
+    current_user: schemas.Principal = Depends(security.get_current_principal),
+    db: Session = Depends(database.get_read_db)
 ):
     # 1. Verifica se o usuário tem acesso ao empréstimo
     loan = db.query(models.Loan).filter(models.Loan.id == loan_id).first()
@@ -160,74 +343,141 @@ def get_loan_installments(
 
 @router.post(
     "/loan/{loan_id}/pay-installment", 
+    response_model=schemas.InstallmentPaymentOut,
     status_code=status.HTTP_200_OK,
     summary="Processar Pagamento de Parcela",
-    description="Permite que o Mutuário pague a próxima parcela PENDENTE de um empréstimo específico. Realiza o débito na conta do Mutuário e o crédito na conta do Credor."
+    description="Permite que o Mutuário pague a próxima parcela em aberto de um empréstimo específico, várias parcelas de uma vez ('count') ou a quitação antecipada do saldo devedor ('prepay_full'). Realiza o débito na conta do Mutuário e o crédito na conta do Credor."
 )
 def pay_installment(
     loan_id: int,
+    payment: Optional[schemas.InstallmentPaymentRequest] = Body(None),
     current_user: models.User = Depends(security.get_current_user),
     db: Session = Depends(database.get_db)
 ):
-    # 1. Recupera o empréstimo
-    loan = db.query(models.Loan).filter(models.Loan.id == loan_id).first()
-    if not loan:
-        raise HTTPException(status_code=404, detail="Loan not found.")
-        
-    # 2. Valida Autorização (Apenas o Mutuário pode pagar)
-    if loan.borrower_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Only the borrower is authorized to pay this loan installment.")
-
-    # 3. Identifica a próxima parcela PENDENTE (ordenada pelo número da parcela)
-    next_installment = db.query(models.Installment).filter(
-        models.Installment.loan_id == loan_id,
-        models.Installment.status == models.InstallmentStatus.PENDING
-    ).order_by(models.Installment.installment_number).first()
-    
-    if not next_installment:
-        raise HTTPException(status_code=400, detail="No pending installments found, or loan is fully paid.")
+    payment = payment or schemas.InstallmentPaymentRequest()
+    loan_t, installment_t = models.Loan.__table__, models.Installment.__table__
 
     # Início do Bloco Transacional para Débito/Crédito
     try:
-        # 4. Bloqueia e verifica a conta do Mutuário
-        borrower_account = db.query(models.Account).filter(models.Account.owner_id == loan.borrower_id).with_for_update().first()
-        lender_account = db.query(models.Account).filter(models.Account.owner_id == loan.lender_id).with_for_update().first()
+        # 1. Bloqueia o empréstimo e lê as próximas parcelas em aberto em um único comando.
+        #    Uma parcela a mais é lida para atualizar next_installment_number/next_due_date.
+        query = (
+            select(
+                loan_t.c.borrower_id, loan_t.c.lender_id, loan_t.c.status, loan_t.c.next_installment_number,
+                loan_t.c.outstanding_balance, installment_t.c.id.label("installment_id"),
+                installment_t.c.installment_number, installment_t.c.due_date, installment_t.c.amount,
+                installment_t.c.principal_amount,
+            )
+            .select_from(loan_t.outerjoin(installment_t, and_(
+                installment_t.c.loan_id == loan_t.c.id,
+                installment_t.c.installment_number >= loan_t.c.next_installment_number,
+            )))
+            .where(loan_t.c.id == loan_id)
+            .order_by(installment_t.c.installment_number)
+            .with_for_update(of=loan_t)
+        )
+        if not payment.prepay_full:
+            query = query.limit(payment.count + 1)
+        rows = db.execute(query).all()
 
-        payment_amount = next_installment.amount
-        
-        if borrower_account.balance < payment_amount:
-            raise HTTPException(status_code=400, detail=f"Insufficient funds. Required: R$ {payment_amount}")
+        if not rows:
+            raise HTTPException(status_code=404, detail="Loan not found.")
+        loan = rows[0]
 
-        # 5. Executa a Transação (Débito e Crédito)
-        borrower_account.balance -= payment_amount
-        lender_account.balance += payment_amount
+        # 2. Valida Autorização (Apenas o Mutuário pode pagar)
+        if loan.borrower_id != current_user.id:
+            raise HTTPException(status_code=403, detail="Only the borrower is authorized to pay this loan installment.")
 
-        # 6. Atualiza o Status da Parcela (Utilizando novos campos)
-        next_installment.status = models.InstallmentStatus.PAID
-        next_installment.valor_pago = payment_amount
-        next_installment.data_pagamento = func.now() # Utiliza func.now() para definir a data/hora atual
+        # 3. Identifica as parcelas a pagar (a partir do contador next_installment_number)
+        pending = [row for row in rows if row.installment_id is not None]
+        if loan.next_installment_number is None or not pending:
+            raise HTTPException(status_code=400, detail="No pending installments found, or loan is fully paid.")
+        if payment.prepay_full:
+            to_pay, next_installment = pending, None
+        else:
+            if len(pending) < payment.count:
+                raise HTTPException(status_code=400, detail=f"Only {len(pending)} pending installments remain.")
+            to_pay = pending[:payment.count]
+            next_installment = pending[payment.count] if len(pending) > payment.count else None
 
-        # 7. Cria Registro de Transação (Ledger)
-        installment_reference = str(next_installment.id)
-        
-        db.add(models.Transaction(
-            type=models.TransactionType.PAGAMENTO_PARCELA, value=payment_amount,
-            origin_account_id=borrower_account.id, destination_account_id=lender_account.id,
-            reference_entity_id=installment_reference
-        ))
-
-        # 8. Verifica se o empréstimo foi totalmente pago
-        # Contamos as parcelas PENDENTES. Se a contagem for 0, o empréstimo está PAGO.
-        remaining_installments = db.query(models.Installment).filter(
-            models.Installment.loan_id == loan_id,
-            models.Installment.status == models.InstallmentStatus.PENDING
-        ).count()
-        
-        if remaining_installments == 0:
-            loan.status = models.LoanStatus.PAID
+        # Na quitação antecipada cada parcela é paga pelo seu principal (juros futuros não são cobrados)
+        amounts = [row.principal_amount if payment.prepay_full else row.amount for row in to_pay]
+        payment_amount = sum(amounts, Decimal(0))
+
+        # 4. Bloqueia as contas do Mutuário e do Credor (em ordem de id)
+        accounts = ledger.lock_accounts(db, (loan.borrower_id, loan.lender_id))
+        borrower_account, lender_account = accounts[loan.borrower_id], accounts[loan.lender_id]
+
+        # 5. Executa a Transação (Débito condicional, Crédito e um Registro no Ledger por parcela)
+        ledger.move_funds_batch(
+            db, borrower_account.id, [(lender_account.id, amount) for amount in amounts],
+            ledger.Entry(models.TransactionType.PAGAMENTO_PARCELA),
+            references=[str(row.installment_id) for row in to_pay],
+        )
+
+        # 6. Atualiza as Parcelas, os contadores do Empréstimo e a carteira do Credor em um único comando
+        fully_paid = next_installment is None
+        outstanding_balance = Decimal(0) if fully_paid else loan.outstanding_balance - sum(
+            (row.principal_amount for row in to_pay), Decimal(0)
+        )
+        # As parcelas são bloqueadas antes de ler o status anterior: a varredura de inadimplência pode
+        # tê-las marcado em ATRASO depois da leitura inicial (e pula as que estão bloqueadas)
+        locked_installments = (
+            select(installment_t.c.id, installment_t.c.status)
+            .where(installment_t.c.id.in_([row.installment_id for row in to_pay]))
+            .with_for_update()
+            .cte("locked_installments")
+        )
+        paid_installments = (
+            update(installment_t)
+            .where(installment_t.c.id == locked_installments.c.id)
+            .values(
+                status=models.InstallmentStatus.PAID,
+                valor_pago=installment_t.c.principal_amount if payment.prepay_full else installment_t.c.amount,
+                data_pagamento=func.now(),
+            )
+            .returning(
+                installment_t.c.id, installment_t.c.due_date, installment_t.c.amount,
+                installment_t.c.principal_amount, installment_t.c.interest_amount, installment_t.c.valor_pago,
+                locked_installments.c.status.label("previous_status"),
+            )
+            .cte("paid_installments")
+        )
+        db.execute(
+            update(loan_t)
+            .where(loan_t.c.id == loan_id)
+            .values(
+                installments_paid=loan_t.c.installments_paid + len(to_pay),
+                outstanding_balance=outstanding_balance,
+                next_installment_number=None if fully_paid else next_installment.installment_number,
+                next_due_date=None if fully_paid else next_installment.due_date,
+                status=models.LoanStatus.PAID if fully_paid else loan_t.c.status,
+            )
+            .add_cte(paid_installments, *portfolio.payment_updates(
+                loan.lender_id, paid_installments, defaulted=loan.status == models.LoanStatus.DEFAULT,
+            ))
+        )
+
+        # 7. Eventos para o Mutuário e o Credor
+        payment_event = {
+            "loan_id": loan_id, "installments": [row.installment_number for row in to_pay], "amount": payment_amount,
+            "outstanding_balance": outstanding_balance,
+            "status": models.LoanStatus.PAID if fully_paid else loan.status,
+        }
+        events.publish(db, [
+            (loan.borrower_id, events.INSTALLMENT_PAID, payment_event),
+            (loan.lender_id, events.INSTALLMENT_PAID, payment_event),
+        ])
+        events.publish_balances(db, (loan.borrower_id, loan.lender_id), reason="installment_payment")
 
         db.commit()
 
+    except ledger.AccountNotFound:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Account not found")
+    except ledger.InsufficientFunds:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Insufficient funds. Required: R$ {payment_amount}")
     except HTTPException:
         db.rollback()
         raise
@@ -235,5 +485,18 @@ def pay_installment(
         db.rollback()
         print(f"ERRO CRÍTICO NO PAGAMENTO DE PARCELA: {e}")
         raise HTTPException(status_code=500, detail="Payment failed due to an unexpected server error.")
-    
-    return {"message": f"Installment {next_installment.installment_number} paid successfully."}
\ No newline at end of file
+
+    numbers = [row.installment_number for row in to_pay]
+    metrics.installments_paid.inc(amount=len(numbers))
+    metrics.record_movement("installment_payment", payment_amount)
+    if payment.prepay_full:
+        message = f"Loan prepaid successfully ({len(numbers)} installments)."
+    elif len(numbers) == 1:
+        message = f"Installment {numbers[0]} paid successfully."
+    else:
+        message = f"Installments {numbers[0]}-{numbers[-1]} paid successfully."
+    return schemas.InstallmentPaymentOut(
+        message=message, installments_paid=numbers, amount_paid=payment_amount,
+        outstanding_balance=outstanding_balance,
+        loan_status=models.LoanStatus.PAID if fully_paid else loan.status,
+    )
@@ -1,11 +1,12 @@
 # app/api/v1/marketplace.py (ADICIONADO ENDPOINT /matches/{search_id})
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
 from sqlalchemy.orm import Session
-from typing import List, Union # Adicionado Union
+from typing import List, Optional, Union # Adicionado Union
 from ... import models, schemas
-from ...core import database, security
-from sqlalchemy import or_ # Importado 'or_' para filtros complexos
+from ...core import database, security, matching, offer_book, offers_cache, pagination, responses, events
+from ...core.config import settings
+from sqlalchemy import or_, select # Importado 'or_' para filtros complexos
 
 router = APIRouter()
 
@@ -27,12 +28,20 @@ def create_credit_offer(
     try:
         new_offer = models.CreditOffer(**offer_in.dict(), lender_id=current_user.id)
         db.add(new_offer)
+        offer_version = offer_book.bump_version(db)
+        db.flush()
+        events.publish(db, [(None, events.OFFERS_UPDATED, {"version": offer_version, "offer_id": new_offer.id, "status": new_offer.status})])
+        # Buscas ATIVAS atendidas pela oferta: feed e evento para os mutuários, na mesma transação
+        matching.notify_subscriptions(db, new_offer)
         db.commit()
         db.refresh(new_offer)
     except Exception as e:
         db.rollback()
         print(f"Erro ao criar oferta: {e}")
         raise HTTPException(status_code=500, detail="Could not create credit offer.")
+
+    # Publica a oferta no índice de matching deste worker (os demais sincronizam pela versão)
+    matching.offer_index.add(new_offer, offer_version)
         
     return new_offer
 
@@ -43,13 +52,34 @@ def create_credit_offer(
     description="Retorna todas as ofertas de crédito ATIVAS no marketplace para as quais o usuário não é o Credor. (Filtros de score e setor não implementados nesta versão)."
 )
 def get_eligible_offers(
-    current_user: models.User = Depends(security.get_current_user),
-    db: Session = Depends(database.get_db)
+    if_none_match: Optional[str] = Header(None),
+    current_user: schemas.Principal = Depends(security.get_current_principal),
+    db: Session = Depends(database.get_read_db)
 ):
-    offers = db.query(models.CreditOffer).filter(
+    if settings.OFFERS_CACHE_ENABLED:
+        # Lista compartilhada das ofertas ATIVAS da versão atual do livro; as do próprio usuário saem na
+        # montagem do corpo. Um cliente que já tem esta versão recebe 304 sem corpo.
+        version = offer_book.current_version(db)
+        etag = offers_cache.etag(version, current_user.id)
+        if responses.etag_matches(if_none_match, etag):
+            return responses.not_modified(etag)
+        offers = offers_cache.offers_cache.get(db, version)
+        return Response(
+            offers.render(exclude_lender_id=current_user.id), media_type="application/json",
+            headers={"ETag": etag, "Cache-Control": "private, no-cache"},
+        )
+
+    filters = (
         models.CreditOffer.status == models.OfferStatus.ACTIVE,
         models.CreditOffer.lender_id != current_user.id
-    ).all()
+    )
+    if settings.FAST_LIST_SERIALIZATION:
+        fields = responses.schema_fields(schemas.CreditOfferOut)
+        columns = models.CreditOffer.__table__.c
+        offers = db.execute(select(*(columns[field] for field in fields)).where(*filters)).all()
+        return responses.list_response(responses.as_dicts(offers, fields))
+
+    offers = db.query(models.CreditOffer).filter(*filters).all()
     return offers
 
 @router.post(
@@ -69,6 +99,8 @@ def create_credit_search(
         raise HTTPException(status_code=403, detail="User must be KYC verified to create a search for credit.")
 
     try:
+        # A busca passa a valer como assinatura: ofertas criadas depois do commit a encontram
+        offer_book.share_lock(db)
         new_search = models.CreditSearch(**search_in.dict(), borrower_id=current_user.id)
         db.add(new_search)
         db.commit()
@@ -80,6 +112,45 @@ def create_credit_search(
         
     return new_search
 
+@router.get(
+    "/searches/matches",
+    response_model=List[schemas.SearchMatchOut],
+    summary="Feed de Ofertas Novas para as Buscas",
+    description="Retorna, em ordem de chegada, as ofertas criadas depois das buscas ATIVAS do usuário autenticado e compatíveis com elas (valor, taxa, prazo e score). Cada oferta nova também é enviada como evento search.matched em /api/v1/events. O cursor da próxima página é devolvido no cabeçalho X-Next-Cursor e deve ser enviado no parâmetro 'after'."
+)
+def get_search_matches_feed(
+    response: Response,
+    search_id: Optional[int] = Query(None, description="Restringe o feed a uma busca."),
+    limit: int = Query(50, ge=1, le=200),
+    after: Optional[str] = Query(None, description="Cursor devolvido em X-Next-Cursor pela página anterior."),
+    current_user: schemas.Principal = Depends(security.get_current_principal),
+    db: Session = Depends(database.get_read_db)
+):
+    filters = [models.CreditSearchMatch.borrower_id == current_user.id]
+    if search_id is not None:
+        filters.append(models.CreditSearchMatch.search_id == search_id)
+    if after:
+        (after_id,) = pagination.decode_cursor(after, 1)
+        try:
+            filters.append(models.CreditSearchMatch.id > int(after_id))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
+
+    rows = db.execute(
+        select(models.CreditSearchMatch, models.CreditOffer)
+        .join(models.CreditOffer, models.CreditOffer.id == models.CreditSearchMatch.offer_id)
+        .where(*filters)
+        .order_by(models.CreditSearchMatch.id)
+        .limit(limit + 1)
+    ).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        pagination.set_next_cursor(response, pagination.encode_cursor(rows[-1][0].id))
+    return [
+        schemas.SearchMatchOut(id=match.id, search_id=match.search_id, matched_at=match.created_at, offer=offer)
+        for match, offer in rows
+    ]
+
 # NOVO ENDPOINT ADICIONADO ABAIXO: Listar Ofertas Compatíveis com a Busca
 @router.get(
     "/matches/{search_id}",
@@ -89,17 +160,22 @@ def create_credit_search(
 )
 def get_matching_offers(
     search_id: int,
-    current_user: models.User = Depends(security.get_current_user),
-    db: Session = Depends(database.get_db)
+    limit: int = Query(20, ge=1, le=100, description="Quantidade máxima de ofertas, das menores para as maiores taxas."),
+    current_user: schemas.Principal = Depends(security.get_current_principal),
+    db: Session = Depends(database.get_read_db)
 ):
     # 1. Recupera a busca do usuário (apenas se ele for o criador ou se for um Admin)
-    credit_search = db.query(models.CreditSearch).filter(
+    # O score do mutuário vem na mesma consulta (join), sem uma ida extra ao banco.
+    row = db.query(models.CreditSearch, models.User.score_credito).join(
+        models.User, models.User.id == models.CreditSearch.borrower_id
+    ).filter(
         models.CreditSearch.id == search_id,
         or_(models.CreditSearch.borrower_id == current_user.id, current_user.id == 1) # Permite que o criador ou admin consulte
     ).first()
 
-    if not credit_search:
+    if not row:
         raise HTTPException(status_code=404, detail="Credit search not found or unauthorized.")
+    credit_search, borrower_score = row
     
     # 2. Busca ofertas que dão MATCH nos critérios da busca
     # Critérios de Match (baseados na lógica inversa da oferta):
@@ -107,22 +183,24 @@ def get_matching_offers(
     # b) Valor Máximo da Oferta >= Valor Desejado na Busca
     # c) Juros da Oferta <= Juros Máximo Aceito na Busca
     # d) Prazo da Oferta <= Prazo Desejado na Busca (o mutuário prefere pagar mais rápido)
-    # e) Score Mínimo Exigido na Oferta <= Score do Usuário (Assumindo que o score do usuário está no objeto current_user, embora o campo não esteja no schema.UserOut, vamos recuperá-lo do modelo User completo.)
-    
-    # Buscamos o score do usuário (borrower)
-    borrower_score = db.query(models.User.score_credito).filter(models.User.id == credit_search.borrower_id).scalar()
+    # e) Score Mínimo Exigido na Oferta <= Score do Usuário
     if borrower_score is None:
          # Este caso não deveria ocorrer se o registro de usuário estiver completo
          raise HTTPException(status_code=400, detail="Borrower credit score not available.")
 
+    # O match é resolvido no índice em memória das ofertas ATIVAS (core/matching.py), sem varrer credit_offers.
+    # O resultado é ordenado pela menor taxa de juros e limitado a 'limit' ofertas.
+    matching.offer_index.ensure_fresh(db)
+    offers = matching.offer_index.match(
+        desired_amount=credit_search.desired_amount,
+        max_interest_rate=credit_search.max_interest_rate,
+        max_term_months=credit_search.desired_term_months,
+        credit_score=borrower_score,
+        exclude_lender_id=current_user.id, # Credor não pode ver suas próprias ofertas
+        limit=limit,
+    )
 
-    offers = db.query(models.CreditOffer).filter(
-        models.CreditOffer.status == models.OfferStatus.ACTIVE,
-        models.CreditOffer.lender_id != current_user.id, # Credor não pode ver suas próprias ofertas
-        models.CreditOffer.max_amount >= credit_search.desired_amount,
-        models.CreditOffer.interest_rate <= credit_search.max_interest_rate,
-        models.CreditOffer.term_months <= credit_search.desired_term_months,
-        models.CreditOffer.min_credit_score <= borrower_score
-    ).all()
-    
+    if settings.FAST_LIST_SERIALIZATION:
+        # IndexedOffer já tem exatamente os campos de CreditOfferOut
+        return responses.list_response(responses.as_dicts(offers, responses.schema_fields(schemas.CreditOfferOut)))
     return offers
\ No newline at end of file
@@ -42,6 +42,7 @@ def start_kyc_process(
         if current_user.kyc_status != models.KYCStatus.PENDING:
             current_user.kyc_status = models.KYCStatus.PENDING
             db.commit()
+            security.invalidate_user(current_user.email)
             db.refresh(current_user)
         
         # Simulação de integração externa:
@@ -1,88 +1,351 @@
 # app/api/v1/wallet.py
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List 
+import csv
+import io
+import json
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session, aliased
+from typing import List, Optional, Union
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
 from ... import models, schemas
-from ...core import database, security
-from sqlalchemy import or_
+from ...core import database, security, pagination, ledger, responses, metrics, events
+from ...core.config import settings
+from sqlalchemy import select, tuple_, union, union_all
 
 router = APIRouter()
 
+# O saldo é relido logo depois de transferências: réplicas só com atraso de replicação pequeno
+BALANCE_MAX_LAG_SECONDS = 1.0
+
 @router.get(
     "/balance", 
-    response_model=schemas.AccountOut,
+    response_model=Union[schemas.AccountOut, schemas.BalanceAsOfOut],
     summary="Obter Saldo da Carteira",
-    description="Retorna o saldo disponível e o status da conta do usuário autenticado."
+    description="Retorna o saldo disponível e o status da conta do usuário autenticado. Com 'as_of', retorna o saldo ao fim do dia informado, calculado a partir do fechamento diário mais próximo e das transações posteriores a ele. Datas anteriores ao corte das partições arquivadas do ledger, sem fechamento que as cubra, retornam 409."
 )
-def get_balance(current_user: models.User = Depends(security.get_current_user), db: Session = Depends(database.get_db)):
+def get_balance(
+    as_of: Optional[date] = Query(None, description="Data (AAAA-MM-DD) do saldo histórico, ao fim do dia."),
+    current_user: schemas.Principal = Depends(security.get_current_principal),
+    db: Session = Depends(database.ReadSession(max_lag_seconds=BALANCE_MAX_LAG_SECONDS))
+):
     account = db.query(models.Account).filter(models.Account.owner_id == current_user.id).first()
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
-    return account
+    if as_of is None:
+        return account
+    try:
+        position = ledger.balance_as_of(db, account.id, as_of)
+    except ledger.ArchivedHistory as e:
+        raise HTTPException(status_code=409, detail=_archived_detail(e))
+    return schemas.BalanceAsOfOut(as_of=as_of, balance=position.balance, snapshot_date=position.snapshot_day)
+
+def _archived_detail(error: ledger.ArchivedHistory) -> str:
+    return f"Ledger history before {error.cutoff.isoformat()} is archived; use a date on or after it."
+
+def _opening_balance(db: Session, account_id: int, start_date: Optional[date]) -> Decimal:
+    # Saldo ao fim da véspera do período, a partir dos fechamentos diários; sem período, só o efeito
+    # das partições do ledger já arquivadas (que não aparecem no extrato)
+    if start_date:
+        return ledger.balance_as_of(db, account_id, start_date - timedelta(days=1)).balance
+    return Decimal("0.00") + db.execute(select(ledger.archived_balance(account_id))).scalar()
+
+def _transaction_filters(start_date: Optional[date], end_date: Optional[date], types: Optional[List[models.TransactionType]]):
+    # Filtros comuns de período (datas inclusivas) e tipo de transação
+    filters = []
+    if start_date:
+        filters.append(models.Transaction.timestamp_utc >= datetime.combine(start_date, time.min))
+    if end_date:
+        filters.append(models.Transaction.timestamp_utc < datetime.combine(end_date + timedelta(days=1), time.min))
+    if types:
+        filters.append(models.Transaction.type.in_(types))
+    return filters
 
 @router.get(
     "/transaction/history",
     response_model=List[schemas.TransactionOut],
     summary="Histórico de Transações",
-    description="Lista todas as transações (débito e crédito) associadas à carteira do usuário autenticado."
+    description="Lista as transações (débito e crédito) da carteira do usuário autenticado, da mais recente para a mais antiga, em páginas de tamanho fixo. O cursor da próxima página é devolvido no cabeçalho X-Next-Cursor e deve ser enviado no parâmetro 'before'."
 )
 def get_transaction_history(
-    current_user: models.User = Depends(security.get_current_user), 
-    db: Session = Depends(database.get_db)
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = Query(None, description="Cursor devolvido em X-Next-Cursor pela página anterior."),
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    types: Optional[List[models.TransactionType]] = Query(None, alias="type"),
+    current_user: schemas.Principal = Depends(security.get_current_principal), 
+    db: Session = Depends(database.get_read_db)
 ):
     account = db.query(models.Account).filter(models.Account.owner_id == current_user.id).first()
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
-        
-    # Busca transações onde a carteira é origem OU destino
-    transactions = db.query(models.Transaction).filter(
-        or_(
-            models.Transaction.origin_account_id == account.id, 
-            models.Transaction.destination_account_id == account.id
-        )
-    ).order_by(models.Transaction.timestamp_utc.desc()).all()
-    
+
+    filters = _transaction_filters(start_date, end_date, types)
+    order = (models.Transaction.timestamp_utc.desc(), models.Transaction.id.desc())
+
+    if before:
+        before_ts, before_id = pagination.decode_cursor(before, 2)
+        try:
+            before_ts, before_id = datetime.fromisoformat(before_ts), int(before_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
+        filters.append(tuple_(models.Transaction.timestamp_utc, models.Transaction.id) < tuple_(before_ts, before_id))
+        # Redundante com a comparação de tuplas, mas é o que permite ao planejador descartar as
+        # partições mensais posteriores ao cursor
+        filters.append(models.Transaction.timestamp_utc <= before_ts)
+
+    # Keyset em (timestamp_utc, id): cada lado (origem/destino) é servido pelo seu índice composto e
+    # limitado à página, então o custo não depende do tamanho do histórico da conta.
+    # UNION (e não UNION ALL) remove a linha duplicada quando origem e destino são a mesma conta.
+    def branch(column):
+        return select(models.Transaction).where(column == account.id, *filters).order_by(*order).limit(limit + 1)
+
+    page = union(
+        branch(models.Transaction.origin_account_id),
+        branch(models.Transaction.destination_account_id),
+    ).subquery()
+    page_order = (page.c.timestamp_utc.desc(), page.c.id.desc())
+    if settings.FAST_LIST_SERIALIZATION:
+        fields = responses.schema_fields(schemas.TransactionOut)
+        transactions = db.execute(
+            select(*(page.c[field] for field in fields)).order_by(*page_order).limit(limit + 1)
+        ).all()
+    else:
+        tx = aliased(models.Transaction, page)
+        transactions = db.scalars(select(tx).order_by(*page_order).limit(limit + 1)).all()
+
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        last = transactions[-1]
+        pagination.set_next_cursor(response, pagination.encode_cursor(last.timestamp_utc, last.id))
+
+    if settings.FAST_LIST_SERIALIZATION:
+        return responses.list_response(responses.as_dicts(transactions, fields), response)
     return transactions
 
 
+STATEMENT_FIELDS = [
+    "id", "timestamp_utc", "type", "value", "amount", "balance",
+    "origin_account_id", "destination_account_id", "reference_entity_id",
+]
+STATEMENT_BATCH_SIZE = 1000
+
+def _statement_rows(
+    account_id: int, opening_balance: Decimal, start_date: Optional[date], end_date: Optional[date],
+    types: Optional[List[models.TransactionType]],
+):
+    """
+    Gera as linhas do extrato em ordem cronológica com saldo corrente.
+    Usa uma sessão própria com cursor do lado do servidor (yield_per), então a memória do worker
+    não depende do tamanho do extrato.
+    """
+    db = database.SessionLocal()
+    try:
+        balance = opening_balance
+        # O saldo corrente considera todos os movimentos do período; o filtro de tipo só decide o que é emitido
+        tx = models.Transaction
+        filters = _transaction_filters(start_date, end_date, None) + [ledger.unarchived(tx.timestamp_utc)]
+        columns = (tx.id, tx.timestamp_utc, tx.type, tx.value, tx.origin_account_id, tx.destination_account_id, tx.reference_entity_id)
+        # UNION ALL de dois ramos ordenados por índice; o segundo exclui as linhas já vistas no primeiro (origem = destino)
+        rows = union_all(
+            select(*columns).where(tx.origin_account_id == account_id, *filters),
+            select(*columns).where(
+                tx.destination_account_id == account_id,
+                tx.origin_account_id.is_distinct_from(account_id),
+                *filters,
+            ),
+        ).subquery()
+        statement = select(rows).order_by(rows.c.timestamp_utc, rows.c.id).execution_options(yield_per=STATEMENT_BATCH_SIZE)
+
+        for row in db.execute(statement):
+            amount = ledger.row_signed_amount(row, account_id)
+            balance += amount
+            if types and row.type not in types:
+                continue
+            yield {
+                "id": row.id,
+                "timestamp_utc": row.timestamp_utc,
+                "type": row.type.value,
+                "value": row.value,
+                "amount": amount,
+                "balance": balance,
+                "origin_account_id": row.origin_account_id,
+                "destination_account_id": row.destination_account_id,
+                "reference_entity_id": row.reference_entity_id,
+            }
+    finally:
+        db.close()
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else str(value)
+
+def _ndjson_stream(rows):
+    for row in rows:
+        yield json.dumps(row, default=_json_default) + "\n"
+
+def _csv_stream(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=STATEMENT_FIELDS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        # Esvazia o buffer a cada linha para não acumular o extrato em memória
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+@router.get(
+    "/statement/export",
+    summary="Exportar Extrato da Conta",
+    description="Exporta o extrato completo da carteira do usuário autenticado em NDJSON ou CSV, em ordem cronológica e com o saldo corrente em cada linha. A resposta é transmitida em streaming, sem carregar o extrato em memória. Um período que começa antes do corte das partições arquivadas, sem fechamento diário que cubra o saldo de abertura, retorna 409."
+)
+def export_statement(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    types: Optional[List[models.TransactionType]] = Query(None, alias="type"),
+    current_user: schemas.Principal = Depends(security.get_current_principal),
+    db: Session = Depends(database.get_db)
+):
+    account = db.query(models.Account).filter(models.Account.owner_id == current_user.id).first()
+    if not account:
+        raise HTTPException(status_code=404, detail="Account not found")
+    account_id = account.id
+    # O saldo de abertura é calculado antes do streaming, para que um período arquivado vire um 409
+    try:
+        opening_balance = _opening_balance(db, account_id, start_date)
+    except ledger.ArchivedHistory as e:
+        raise HTTPException(status_code=409, detail=_archived_detail(e))
+    # Devolve a conexão da requisição ao pool: o streaming usa a sua própria sessão
+    db.close()
+
+    rows = _statement_rows(account_id, opening_balance, start_date, end_date, types)
+    if format == "csv":
+        body, media_type = _csv_stream(rows), "text/csv"
+    else:
+        body, media_type = _ndjson_stream(rows), "application/x-ndjson"
+
+    filename = f"statement-{account_id}.{format}"
+    return StreamingResponse(body, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
 @router.post("/transfer", status_code=status.HTTP_204_NO_CONTENT)
 def p2p_transfer(transfer_data: schemas.TransferRequest, current_user: models.User = Depends(security.get_current_user), db: Session = Depends(database.get_db)):
     if transfer_data.amount <= 0:
         raise HTTPException(status_code=400, detail="Transfer amount must be positive")
 
     try:
-        # Bloqueia as contas para transação atômica
-        source_account = db.query(models.Account).filter(models.Account.owner_id == current_user.id).with_for_update().first()
-        
-        if source_account.balance < transfer_data.amount:
-            raise HTTPException(status_code=400, detail="Insufficient funds")
-
-        destination_account = db.query(models.Account).filter(models.Account.owner_id == transfer_data.destination_user_id).with_for_update().first()
-        if not destination_account:
-            raise HTTPException(status_code=404, detail="Destination user not found")
-
-        # 1. Atualização de Saldos
-        source_account.balance -= transfer_data.amount
-        destination_account.balance += transfer_data.amount
-        
-        # 2. Criação do Registro de Transação (Ledger)
+        # Bloqueia as duas contas (em ordem de id) e move o saldo com um único comando condicional.
         # Registramos APENAS o evento de débito P2P, e o histórico usa a coluna de destino para inferir o crédito.
-        tx_debit = models.Transaction(
-            type=models.TransactionType.P2P_DEBITO,
-            value=transfer_data.amount,
-            origin_account_id=source_account.id,
-            destination_account_id=destination_account.id
+        ledger.transfer(
+            db, current_user.id, transfer_data.destination_user_id, transfer_data.amount,
+            [ledger.Entry(models.TransactionType.P2P_DEBITO)],
         )
-        db.add(tx_debit)
-        
+        events.publish_balances(db, (current_user.id, transfer_data.destination_user_id), reason="transfer")
         db.commit()
-    except HTTPException:
+    except ledger.AccountNotFound as e:
         db.rollback()
-        raise
+        detail = "Destination user not found" if e.owner_id == transfer_data.destination_user_id else "Account not found"
+        raise HTTPException(status_code=404, detail=detail)
+    except ledger.InsufficientFunds:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Insufficient funds")
     except Exception as e:
         db.rollback()
         print(f"Erro na transferência P2P: {e}")
         raise HTTPException(status_code=500, detail="Transfer failed")
-        
-    return
\ No newline at end of file
+
+    metrics.transfers.inc("single")
+    metrics.record_movement("transfer", transfer_data.amount)
+    return
+
+@router.post(
+    "/transfer/batch",
+    response_model=schemas.BatchTransferResult,
+    summary="Transferência P2P em Lote",
+    description="Executa várias transferências P2P a partir da carteira do usuário autenticado com um único bloqueio da conta de origem e um único commit. No modo ALL_OR_NOTHING qualquer item inválido rejeita o lote (HTTP 400, com o resultado por item); no modo BEST_EFFORT apenas os itens válidos são executados."
+)
+def p2p_transfer_batch(
+    batch: schemas.BatchTransferRequest,
+    current_user: schemas.Principal = Depends(security.get_current_principal),
+    db: Session = Depends(database.get_db)
+):
+    if len(batch.items) > settings.TRANSFER_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds the maximum of {settings.TRANSFER_BATCH_MAX_ITEMS} items")
+
+    best_effort = batch.mode == "BEST_EFFORT"
+    failures = {}
+    credits = []
+
+    try:
+        # Origem e destinos bloqueados em um único SELECT, em ordem de id
+        destination_ids = {item.destination_user_id for item in batch.items}
+        accounts = ledger.lock_accounts(db, destination_ids | {current_user.id}, missing_ok=True)
+        source_account = accounts.get(current_user.id)
+        if source_account is None:
+            raise HTTPException(status_code=404, detail="Account not found")
+
+        # Os itens são avaliados na ordem recebida contra o saldo ainda disponível
+        available = source_account.balance
+        for index, item in enumerate(batch.items):
+            if item.destination_user_id == current_user.id:
+                failures[index] = "Cannot transfer to yourself"
+            elif item.destination_user_id not in accounts:
+                failures[index] = "Destination user not found"
+            elif item.amount > available:
+                failures[index] = "Insufficient funds"
+            else:
+                available -= item.amount
+                credits.append(index)
+
+        rejected = bool(failures) and not best_effort
+        if credits and not rejected:
+            # Débito único na origem, créditos agregados por destino e uma linha P2P_DEBITO por item
+            ledger.move_funds_batch(
+                db, source_account.id,
+                [(accounts[batch.items[i].destination_user_id].id, batch.items[i].amount) for i in credits],
+                ledger.Entry(models.TransactionType.P2P_DEBITO),
+            )
+            events.publish_balances(
+                db, {current_user.id} | {batch.items[i].destination_user_id for i in credits}, reason="transfer",
+            )
+            db.commit()
+        else:
+            db.rollback()
+    except HTTPException:
+        db.rollback()
+        raise
+    except ledger.InsufficientFunds:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+    except Exception as e:
+        db.rollback()
+        print(f"Erro na transferência P2P em lote: {e}")
+        raise HTTPException(status_code=500, detail="Batch transfer failed")
+
+    committed = bool(credits) and not rejected
+    result = schemas.BatchTransferResult(
+        mode=batch.mode,
+        committed=committed,
+        transferred_count=len(credits) if committed else 0,
+        transferred_amount=sum((batch.items[i].amount for i in credits), Decimal(0)) if committed else Decimal(0),
+        items=[
+            schemas.BatchTransferItemResult(
+                index=index, destination_user_id=item.destination_user_id, amount=item.amount,
+                status="FAILED" if index in failures else ("OK" if committed else "SKIPPED"),
+                detail=failures.get(index),
+            )
+            for index, item in enumerate(batch.items)
+        ],
+    )
+    if rejected:
+        raise HTTPException(status_code=400, detail=jsonable_encoder(result))
+    if committed:
+        metrics.transfers.inc("batch", amount=result.transferred_count)
+        metrics.record_movement("transfer", result.transferred_amount)
+    return result
@@ -0,0 +1,161 @@
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, List
+import numpy as np
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from .. import models
+
+# Todo o cálculo é feito em centavos inteiros (int64). As taxas são anuais, como CreditOffer.interest_rate,
+# e a taxa mensal é a anual / 12 (mesma convenção do cronograma de juros simples original).
+# Arredondamentos deixam um resíduo de centavos que é sempre absorvido pela última parcela, de modo que
+# a soma do principal das parcelas é exatamente o valor emprestado.
+
+class ScheduleOverflow(ValueError):
+    """Parâmetros fora do que o cronograma em centavos int64 (e as taxas em float) consegue representar."""
+
+
+def to_cents(value: Decimal) -> int:
+    return int((Decimal(value) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def from_cents(cents: int) -> Decimal:
+    return Decimal(int(cents)).scaleb(-2)
+
+# Limite dos valores em centavos: acima dele a conversão para int64 daria lixo em vez de erro
+_MAX_CENTS = float(np.iinfo(np.int64).max)
+
+def _round_half_up(values) -> np.ndarray:
+    rounded = np.floor(np.asarray(values, dtype=np.float64) + 0.5)
+    if not np.all(np.abs(rounded) < _MAX_CENTS):
+        raise OverflowError("schedule value out of int64 range")
+    return rounded.astype(np.int64)
+
+def _split(total: int, parts: int) -> np.ndarray:
+    # Divide 'total' centavos em partes iguais; o resto da divisão vai para a última
+    values = np.full(parts, total // parts, dtype=np.int64)
+    values[-1] += total - values.sum()
+    return values
+
+def due_dates(start: date, term_months: int) -> np.ndarray:
+    """Vencimentos mensais a partir de 'start' (mesmo dia do mês, limitado ao último dia, como relativedelta)."""
+    months = np.datetime64(start, "M") + np.arange(1, term_months + 1)
+    first_day = months.astype("datetime64[D]")
+    days_in_month = ((months + 1).astype("datetime64[D]") - first_day).astype(np.int64)
+    return first_day + (np.minimum(start.day, days_in_month) - 1)
+
+
+@dataclass(frozen=True)
+class Schedule:
+    system: models.AmortizationSystem
+    principal: int
+    due_dates: np.ndarray
+    # Valores em centavos, um por parcela
+    amounts: np.ndarray
+    principal_parts: np.ndarray
+    interest_parts: np.ndarray
+    # Saldo devedor após o pagamento de cada parcela
+    balances: np.ndarray
+
+    def __len__(self):
+        return len(self.amounts)
+
+    @property
+    def total_amount(self) -> Decimal:
+        return from_cents(self.amounts.sum())
+
+    @property
+    def total_interest(self) -> Decimal:
+        return from_cents(self.interest_parts.sum())
+
+    def rows(self) -> List[Dict]:
+        """Parcelas como dicionários (valores em Decimal), na ordem do cronograma."""
+        return [
+            {
+                "installment_number": number,
+                "due_date": due_date,
+                "amount": from_cents(amount),
+                "principal_amount": from_cents(principal),
+                "interest_amount": from_cents(interest),
+                "balance": from_cents(balance),
+            }
+            for number, due_date, amount, principal, interest, balance in zip(
+                range(1, len(self) + 1), self.due_dates.tolist(), self.amounts.tolist(),
+                self.principal_parts.tolist(), self.interest_parts.tolist(), self.balances.tolist(),
+            )
+        ]
+
+
+def build_schedule(
+    amount: Decimal, annual_rate: Decimal, term_months: int,
+    system: models.AmortizationSystem = models.AmortizationSystem.SIMPLE, start_date: date = None,
+) -> Schedule:
+    """
+    Monta o cronograma completo de um empréstimo:
+    - SIMPLE: juros simples sobre o valor total (amount * taxa * prazo / 12), divididos igualmente, com
+      o principal também em partes iguais;
+    - PRICE (tabela francesa): parcelas constantes, juros sobre o saldo devedor;
+    - SAC: amortização constante, juros sobre o saldo devedor (parcelas decrescentes).
+    """
+    if term_months < 1:
+        raise ValueError("term_months must be positive")
+    start_date = start_date or date.today()
+    try:
+        # Overflow (em float ou na conversão para int64) vira ScheduleOverflow em vez de um erro genérico
+        with np.errstate(over="raise", invalid="raise"):
+            return _build_schedule(amount, annual_rate, term_months, system, start_date)
+    except (OverflowError, FloatingPointError) as error:
+        raise ScheduleOverflow(str(error)) from error
+
+def _build_schedule(
+    amount: Decimal, annual_rate: Decimal, term_months: int, system: models.AmortizationSystem, start_date: date,
+) -> Schedule:
+    principal = to_cents(amount)
+    monthly_rate = float(annual_rate) / 12
+
+    if system == models.AmortizationSystem.SIMPLE:
+        total_interest = to_cents(Decimal(amount) * Decimal(annual_rate) * Decimal(term_months) / Decimal(12))
+        principal_parts = _split(principal, term_months)
+        interest_parts = _split(total_interest, term_months)
+    elif system == models.AmortizationSystem.SAC or monthly_rate == 0:
+        principal_parts = _split(principal, term_months)
+        opening = principal - np.concatenate(([0], np.cumsum(principal_parts)[:-1]))
+        interest_parts = _round_half_up(opening * monthly_rate)
+    elif system == models.AmortizationSystem.PRICE:
+        factor = (1 + monthly_rate) ** term_months
+        payment = _round_half_up(principal * monthly_rate * factor / (factor - 1))
+        # Saldo devedor antes de cada parcela pela forma fechada (sem laço sobre as parcelas)
+        growth = (1 + monthly_rate) ** np.arange(term_months)
+        opening = principal * growth - payment * (growth - 1) / monthly_rate
+        interest_parts = _round_half_up(opening * monthly_rate)
+        principal_parts = payment - interest_parts
+        principal_parts[-1] = principal - principal_parts[:-1].sum()
+    else:
+        raise ValueError(f"Unsupported amortization system: {system}")
+
+    return Schedule(
+        system=system,
+        principal=principal,
+        due_dates=due_dates(start_date, term_months),
+        amounts=principal_parts + interest_parts,
+        principal_parts=principal_parts,
+        interest_parts=interest_parts,
+        balances=principal - np.cumsum(principal_parts),
+    )
+
+def insert_installments(db: Session, loan_id: int, schedule: Schedule):
+    """Grava todas as parcelas do cronograma com um único INSERT em lote (executemany)."""
+    db.execute(
+        insert(models.Installment),
+        [
+            {
+                "loan_id": loan_id,
+                "installment_number": row["installment_number"],
+                "due_date": row["due_date"],
+                "amount": row["amount"],
+                "principal_amount": row["principal_amount"],
+                "interest_amount": row["interest_amount"],
+            }
+            for row in schedule.rows()
+        ],
+    )
@@ -0,0 +1,93 @@
+import asyncio
+import inspect
+from fastapi import APIRouter, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.params import Depends
+from fastapi.routing import APIRoute
+from . import database, security
+
+# Dependências síncronas e as suas equivalentes no modo assíncrono
+ASYNC_DEPENDENCIES = {
+    database.get_db: database.get_async_db,
+    security.get_current_user: security.get_current_user_async,
+    security.get_current_principal: security.get_current_principal_async,
+}
+
+def _materialize(route: APIRoute, result):
+    # A validação do response_model acontece aqui, ainda dentro do greenlet da sessão assíncrona,
+    # para que relacionamentos lazy (ex.: Loan.installments) possam ser carregados.
+    if route.response_field is None or isinstance(result, Response):
+        return result
+    value, errors = route.response_field.validate(result, {}, loc=("response",))
+    return result if errors else value
+
+def _asyncify_endpoint(route: APIRoute):
+    original = route.endpoint
+    signature = inspect.signature(original)
+    session_param = None
+    parameters = []
+    for param in signature.parameters.values():
+        default = param.default
+        if isinstance(default, Depends) and isinstance(default.dependency, database.ReadSession):
+            # Sessão de leitura (réplica ou primário): mesma escolha de réplica, com AsyncSession
+            session_param = param.name
+            param = param.replace(default=Depends(default.dependency.asynchronous, use_cache=default.use_cache))
+        elif isinstance(default, Depends) and default.dependency in ASYNC_DEPENDENCIES:
+            if default.dependency is database.get_db:
+                session_param = param.name
+            param = param.replace(default=Depends(ASYNC_DEPENDENCIES[default.dependency], use_cache=default.use_cache))
+        parameters.append(param)
+
+    async def endpoint(**kwargs):
+        if session_param is None:
+            return await run_in_threadpool(original, **kwargs)
+        db = kwargs[session_param]
+
+        def call(sync_db):
+            # Executa o corpo original (mesmos locks, mesmas regras de ledger) sobre a sessão síncrona
+            # que o AsyncSession expõe; o I/O passa pelo asyncpg sem ocupar o thread pool.
+            return _materialize(route, original(**{**kwargs, session_param: sync_db}))
+
+        return await db.run_sync(call)
+
+    endpoint.__signature__ = signature.replace(parameters=parameters)
+    endpoint.__name__ = original.__name__
+    endpoint.__doc__ = original.__doc__
+    return endpoint
+
+def asyncify_router(router: APIRouter) -> APIRouter:
+    """
+    Reconstrói um router síncrono para o modo assíncrono (settings.DB_ASYNC_MODE): cada endpoint vira
+    'async def', recebe um AsyncSession no lugar do Session e resolve o usuário com get_current_user_async.
+    Endpoints que já são assíncronos são mantidos como estão.
+    """
+    async_router = APIRouter()
+    for route in router.routes:
+        if not isinstance(route, APIRoute) or asyncio.iscoroutinefunction(route.endpoint):
+            async_router.routes.append(route)
+            continue
+        async_router.add_api_route(
+            route.path,
+            _asyncify_endpoint(route),
+            methods=list(route.methods),
+            response_model=route.response_model,
+            status_code=route.status_code,
+            tags=route.tags,
+            dependencies=route.dependencies,
+            summary=route.summary,
+            description=route.description,
+            response_description=route.response_description,
+            responses=route.responses,
+            deprecated=route.deprecated,
+            operation_id=route.operation_id,
+            response_model_include=route.response_model_include,
+            response_model_exclude=route.response_model_exclude,
+            response_model_by_alias=route.response_model_by_alias,
+            response_model_exclude_unset=route.response_model_exclude_unset,
+            response_model_exclude_defaults=route.response_model_exclude_defaults,
+            response_model_exclude_none=route.response_model_exclude_none,
+            include_in_schema=route.include_in_schema,
+            response_class=route.response_class,
+            name=route.name,
+        )
+    return async_router
@@ -1,8 +1,142 @@
-from sqlalchemy import create_engine
+import itertools
+import threading
+import time
+from typing import List, Optional
+from sqlalchemy import create_engine, event, exc, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from .config import settings
+from . import profiling
 
-engine = create_engine(settings.DATABASE_URL)
+
+class PoolStats:
+    """
+    Métricas de um pool de conexões: tempo de espera no checkout, conexões em uso e uso de overflow.
+    Expostas em /internal/pool para dimensionar o pool por worker.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.pool = None
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkins = 0
+        self.connections_created = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.checked_out_peak = 0
+        self.overflow_peak = 0
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def attach(self, pool):
+        self.pool = pool
+        event.listen(pool, "connect", self._on_connect)
+        event.listen(pool, "checkout", self._on_checkout)
+        event.listen(pool, "checkin", self._on_checkin)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connections_created += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out_peak = max(self.checked_out_peak, self.pool.checkedout())
+            self.overflow_peak = max(self.overflow_peak, self.pool.overflow())
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checkins += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "pool_size": self.pool.size(),
+                "max_overflow": settings.DB_MAX_OVERFLOW,
+                "checked_out": self.pool.checkedout(),
+                "checked_in": self.pool.checkedin(),
+                # overflow() é negativo enquanto o pool base ainda não foi totalmente aberto
+                "overflow": max(self.pool.overflow(), 0),
+                "checked_out_peak": self.checked_out_peak,
+                "overflow_peak": max(self.overflow_peak, 0),
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "connections_created": self.connections_created,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 6) if self.checkouts else 0.0,
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+            }
+
+
+# Estatísticas de todos os pools do processo, por nome do engine
+pool_stats = {}
+
+def _instrumented(pool_class):
+    # O QueuePool não tem evento "antes do checkout": a espera é medida em volta de _do_get
+    class InstrumentedPool(pool_class):
+        stats: PoolStats = None
+
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            except exc.TimeoutError:
+                self.stats.record_timeout()
+                raise
+            finally:
+                self.stats.record_wait(time.perf_counter() - start)
+
+        def recreate(self):
+            # engine.dispose() recria o pool: as estatísticas seguem para o novo pool
+            pool = super().recreate()
+            pool.stats = self.stats
+            self.stats.pool = pool
+            return pool
+
+    InstrumentedPool.__name__ = f"Instrumented{pool_class.__name__}"
+    return InstrumentedPool
+
+InstrumentedQueuePool = _instrumented(QueuePool)
+InstrumentedAsyncQueuePool = _instrumented(AsyncAdaptedQueuePool)
+
+def _pool_options(poolclass):
+    return dict(
+        poolclass=poolclass,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+
+def _instrument(name: str, sync_engine):
+    stats = PoolStats(name)
+    sync_engine.pool.stats = stats
+    stats.attach(sync_engine.pool)
+    pool_stats[name] = stats
+    # Contagem e tempo das consultas por requisição, consultas lentas e N+1
+    profiling.attach(sync_engine)
+
+def _connect_args(async_driver: bool = False):
+    if not settings.DB_STATEMENT_TIMEOUT_MS:
+        return {}
+    if async_driver:
+        return {"server_settings": {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)}}
+    return {"options": f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"}
+
+engine = create_engine(settings.DATABASE_URL, connect_args=_connect_args(), **_pool_options(InstrumentedQueuePool))
+_instrument("primary", engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -11,4 +145,166 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def _to_async_url(url: str) -> str:
+    return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+def _async_database_url():
+    if settings.ASYNC_DATABASE_URL:
+        return settings.ASYNC_DATABASE_URL
+    return _to_async_url(settings.DATABASE_URL)
+
+# O engine assíncrono só é criado no modo assíncrono (o driver asyncpg é importado na criação)
+async_engine = None
+AsyncSessionLocal = None
+if settings.DB_ASYNC_MODE:
+    async_engine = create_async_engine(
+        _async_database_url(), connect_args=_connect_args(async_driver=True), **_pool_options(InstrumentedAsyncQueuePool)
+    )
+    _instrument("async", async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autocommit=False, autoflush=False)
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# Réplicas de leitura (settings.DATABASE_REPLICA_URLS). Rotas somente leitura optam por uma sessão de
+# réplica com Depends(database.get_read_db) ou Depends(database.ReadSession(max_lag_seconds=...)); rotas
+# que movimentam dinheiro continuam em get_db (primário). Uma thread verifica periodicamente a saúde e o
+# atraso de replicação de cada réplica; sem réplica disponível dentro do atraso aceito pela rota, a
+# sessão é aberta no primário.
+
+# Atraso de replicação em segundos: zero quando tudo o que foi recebido já foi aplicado (inclusive com o
+# primário ocioso) e NULL quando não há como medir (a réplica fica indisponível)
+REPLICATION_LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class Replica:
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.engine = create_engine(url, connect_args=_connect_args(), **_pool_options(InstrumentedQueuePool))
+        _instrument(name, self.engine)
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        event.listen(self.engine, "handle_error", self._on_error)
+        self.async_engine = None
+        self.AsyncSessionLocal = None
+        if settings.DB_ASYNC_MODE:
+            self.async_engine = create_async_engine(
+                _to_async_url(url), connect_args=_connect_args(async_driver=True),
+                **_pool_options(InstrumentedAsyncQueuePool),
+            )
+            _instrument(f"{name}-async", self.async_engine.sync_engine)
+            event.listen(self.async_engine.sync_engine, "handle_error", self._on_error)
+            self.AsyncSessionLocal = async_sessionmaker(self.async_engine, autocommit=False, autoflush=False)
+        # Sem verificação ainda, a réplica não recebe leituras
+        self.healthy = False
+        self.lag_seconds: Optional[float] = None
+        self.checked_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def _on_error(self, context):
+        # Conexão perdida no meio de uma requisição: as próximas leituras vão para outra réplica ou para
+        # o primário até a próxima verificação bem-sucedida
+        if context.is_disconnect:
+            self.healthy = False
+            self.last_error = str(context.original_exception)
+
+    def check(self):
+        try:
+            with self.engine.connect() as conn:
+                lag = conn.execute(REPLICATION_LAG_SQL).scalar()
+        except Exception as e:
+            self.healthy, self.lag_seconds, self.last_error = False, None, str(e)
+        else:
+            self.lag_seconds = None if lag is None else float(lag)
+            self.healthy, self.last_error = self.lag_seconds is not None, None
+        self.checked_at = time.monotonic()
+
+    def available(self, max_lag_seconds: float) -> bool:
+        return self.healthy and self.lag_seconds is not None and self.lag_seconds <= max_lag_seconds
+
+    def snapshot(self) -> dict:
+        return {
+            "healthy": self.healthy,
+            "lag_seconds": self.lag_seconds,
+            "checked_seconds_ago": None if self.checked_at is None else round(time.monotonic() - self.checked_at, 3),
+            "last_error": self.last_error,
+        }
+
+
+class ReplicaSet:
+    """Réplicas de leitura com rodízio (round-robin) e verificação periódica em uma thread daemon."""
+
+    def __init__(self, urls: List[str], check_interval: float):
+        self.replicas = [Replica(f"replica-{i}", url) for i, url in enumerate(urls, 1)]
+        self.check_interval = check_interval
+        self._counter = itertools.count()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def choose(self, max_lag_seconds: float) -> Optional[Replica]:
+        candidates = [replica for replica in self.replicas if replica.available(max_lag_seconds)]
+        if not candidates:
+            return None
+        return candidates[next(self._counter) % len(candidates)]
+
+    def check(self):
+        for replica in self.replicas:
+            replica.check()
+
+    def start(self):
+        if not self.replicas or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="replica-health", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.check()
+            self._stop.wait(self.check_interval)
+
+
+replicas = ReplicaSet(settings.DATABASE_REPLICA_URLS, settings.DB_REPLICA_CHECK_INTERVAL_SECONDS)
+
+
+class ReadSession:
+    """
+    Dependência de sessão somente leitura: abre a sessão em uma réplica com atraso de replicação de no
+    máximo 'max_lag_seconds' (padrão: settings.DB_REPLICA_MAX_LAG_SECONDS) ou, sem nenhuma, no primário.
+    """
+
+    def __init__(self, max_lag_seconds: Optional[float] = None):
+        self.max_lag_seconds = max_lag_seconds
+
+    def _replica(self) -> Optional[Replica]:
+        max_lag = settings.DB_REPLICA_MAX_LAG_SECONDS if self.max_lag_seconds is None else self.max_lag_seconds
+        return replicas.choose(max_lag)
+
+    def __call__(self):
+        replica = self._replica()
+        db = (replica.SessionLocal if replica else SessionLocal)()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def asynchronous(self):
+        # Equivalente no modo assíncrono (async_bridge troca uma pela outra)
+        replica = self._replica()
+        async with (replica.AsyncSessionLocal if replica else AsyncSessionLocal)() as db:
+            yield db
+
+
+get_read_db = ReadSession()
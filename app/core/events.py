@@ -0,0 +1,418 @@
+import asyncio
+import json
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from select import select as wait_readable
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import BigInteger, Integer, and_, column, delete, func, insert, literal, select, union_all, values
+from sqlalchemy.orm import Session
+from .. import models
+from . import metrics, offer_book
+from .config import settings
+from .database import engine
+
+# Eventos em tempo real para os clientes (GET /api/v1/events/stream por SSE, /api/v1/events/ws por
+# WebSocket), no lugar da consulta periódica a /wallet/balance, /loan/my-loans e /marketplace/offers.
+#
+# - Publicação: as rotas gravam os eventos em outbox_events na mesma transação da operação (publish)
+#   e avisam os workers com pg_notify, entregue pelo Postgres só no commit.
+# - Ordem: os eventos de um usuário só são gravados com a conta dele bloqueada (ledger.lock_accounts),
+#   então os ids de cada usuário crescem na ordem dos commits e o último id recebido basta para retomar
+#   (Last-Event-ID). Os eventos gerais (user_id nulo: ofertas) são gravados depois de
+#   offer_book.bump_version, que serializa as alterações do livro; eles não são retomados: a cada
+#   conexão o cliente recebe a versão atual do livro de ofertas. search.matched (ofertas novas para as
+#   buscas ATIVAS, matching.notify_subscriptions) também é gravado assim, com os mutuários em
+#   "recipients", e entregue só a eles; o feed durável fica em /marketplace/searches/matches.
+# - Entrega: cada worker mantém as conexões dos seus clientes e uma thread (EventDispatcher) que
+#   escuta o canal com LISTEN e, a cada aviso, lê do outbox os eventos novos dos usuários avisados. A
+#   cada EVENTS_POLL_INTERVAL_SECONDS o outbox é lido para todos os conectados (avisos perdidos, LISTEN
+#   indisponível, ex.: PgBouncer em modo transação).
+# - Um cliente lento que acumula EVENTS_QUEUE_SIZE eventos é desconectado e retoma do último id.
+
+CHANNEL = "outbox_events"
+# Payload do NOTIFY: ids dos usuários separados por vírgula; "*" = eventos gerais ou usuários demais
+ALL_USERS = "*"
+NOTIFY_PAYLOAD_LIMIT = 7000
+
+BALANCE_UPDATED = "balance.updated"
+LOAN_CREATED = "loan.created"
+INSTALLMENT_PAID = "loan.installment_paid"
+OFFERS_UPDATED = "offers.updated"
+SEARCH_MATCHED = "search.matched"
+# Eventos gerais endereçados: {user_id: ids das buscas} (os demais dados vão para todos os destinatários)
+RECIPIENTS = "recipients"
+# Sem eventos suficientes para retomar (retenção ou limite de reenvio): o cliente recarrega o estado
+RESYNC = "resync"
+
+
+@dataclass(frozen=True)
+class Event:
+    # id do outbox; None para eventos gerados na conexão (versão das ofertas, resync)
+    id: Optional[int]
+    user_id: Optional[int]
+    type: str
+    data: dict
+
+    @property
+    def resumable(self) -> bool:
+        # Só os eventos do usuário entram no Last-Event-ID
+        return self.id is not None and self.user_id is not None
+
+    def sse(self) -> str:
+        lines = [f"id: {self.id}"] if self.resumable else []
+        lines.append(f"event: {self.type}")
+        lines.append(f"data: {json.dumps(self.data, separators=(',', ':'))}")
+        return "\n".join(lines) + "\n\n"
+
+    def message(self) -> dict:
+        return {"id": self.id if self.resumable else None, "type": self.type, "data": self.data}
+
+
+# --- Publicação (dentro da transação da operação) -------------------------------------------
+
+def _notify(db: Session, user_ids: Iterable[Optional[int]]):
+    targets = sorted({ALL_USERS if user_id is None else str(user_id) for user_id in user_ids})
+    payload = ",".join(targets)
+    if ALL_USERS in targets or len(payload) > NOTIFY_PAYLOAD_LIMIT:
+        payload = ALL_USERS
+    db.execute(select(func.pg_notify(CHANNEL, payload)))
+
+def publish(db: Session, events: Sequence[Tuple[Optional[int], str, dict]]):
+    """Grava (user_id, tipo, dados) no outbox na transação corrente; user_id None = todos os usuários."""
+    if not events:
+        return
+    db.execute(insert(models.OutboxEvent.__table__), [
+        {"user_id": user_id, "type": event_type, "payload": jsonable_encoder(data)}
+        for user_id, event_type, data in events
+    ])
+    _notify(db, (user_id for user_id, _, _ in events))
+
+def publish_balances(db: Session, owner_ids: Iterable[int], reason: str):
+    """Evento balance.updated com o saldo já atualizado na transação, para cada dono de conta."""
+    owner_ids = sorted(set(owner_ids))
+    if not owner_ids:
+        return
+    account, outbox = models.Account.__table__, models.OutboxEvent.__table__
+    db.execute(insert(outbox).from_select(
+        ["user_id", "type", "payload"],
+        select(
+            account.c.owner_id, literal(BALANCE_UPDATED),
+            func.jsonb_build_object("balance", account.c.balance, "reason", reason),
+        ).where(account.c.owner_id.in_(owner_ids)).order_by(account.c.owner_id),
+    ))
+    _notify(db, owner_ids)
+
+
+# --- Entrega (por worker) --------------------------------------------------------------------
+
+def _event(row) -> Event:
+    return Event(row.id, row.user_id, row.type, row.payload)
+
+
+class Subscriber:
+    """Uma conexão SSE/WebSocket: fila no event loop da conexão, alimentada pela thread do dispatcher."""
+
+    def __init__(self, user_id: int, loop: asyncio.AbstractEventLoop):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(settings.EVENTS_QUEUE_SIZE)
+        self.overflowed = False
+
+    def push(self, event: Event):
+        # Executado no event loop da conexão (call_soon_threadsafe)
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            metrics.events_dropped_connections.inc()
+
+
+@dataclass
+class EventStream:
+    subscriber: Subscriber
+    # Eventos a enviar antes dos novos: retomada a partir do Last-Event-ID e a versão das ofertas
+    backlog: List[Event]
+
+
+class _UserChannel:
+    def __init__(self, cursor: int):
+        # Último id do usuário já entregue às conexões deste worker
+        self.cursor = cursor
+        self.subscribers: Set[Subscriber] = set()
+
+
+class EventDispatcher:
+    def __init__(self, poll_interval: float):
+        self.poll_interval = poll_interval
+        self._users: Dict[int, _UserChannel] = {}
+        self._broadcast_cursor: Optional[int] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.listening = False
+        self.notifications = 0
+        self.polls = 0
+        self.delivered = 0
+
+    # Conexões (chamadas no thread pool: consultam o banco)
+
+    def connect(self, user_id: int, loop: asyncio.AbstractEventLoop, last_event_id: Optional[int] = None) -> EventStream:
+        """
+        Registra uma conexão do usuário. Os eventos com id até o cursor do usuário neste worker vêm do
+        outbox (retomada); os seguintes chegam pela fila, sem lacuna nem repetição.
+        """
+        outbox = models.OutboxEvent.__table__
+        subscriber = Subscriber(user_id, loop)
+        with engine.connect() as conn:
+            with self._lock:
+                channel = self._users.get(user_id)
+                follows_broadcasts = self._broadcast_cursor is not None
+            latest = None
+            if channel is None:
+                latest = conn.execute(select(func.max(outbox.c.id)).where(outbox.c.user_id == user_id)).scalar()
+            latest_broadcast = None
+            if not follows_broadcasts:
+                # Eventos gerais acompanhados a partir daqui; a versão das ofertas é lida depois
+                latest_broadcast = conn.execute(select(func.max(outbox.c.id)).where(outbox.c.user_id.is_(None))).scalar()
+            with self._lock:
+                channel = self._users.setdefault(user_id, channel or _UserChannel(latest or 0))
+                channel.subscribers.add(subscriber)
+                cursor = channel.cursor
+                if self._broadcast_cursor is None:
+                    self._broadcast_cursor = latest_broadcast or 0
+            metrics.event_stream_connections.inc()
+
+            backlog = []
+            if last_event_id is not None and last_event_id < cursor:
+                rows = conn.execute(
+                    select(outbox)
+                    .where(outbox.c.user_id == user_id, outbox.c.id > last_event_id, outbox.c.id <= cursor)
+                    .order_by(outbox.c.id)
+                    .limit(settings.EVENTS_REPLAY_LIMIT + 1)
+                ).all()
+                oldest = conn.execute(select(func.min(outbox.c.id))).scalar()
+                if len(rows) > settings.EVENTS_REPLAY_LIMIT or (oldest is not None and last_event_id + 1 < oldest):
+                    # Eventos já removidos pela retenção ou retomada longa demais
+                    backlog.append(Event(None, user_id, RESYNC, {}))
+                else:
+                    backlog.extend(_event(row) for row in rows)
+            version = conn.execute(
+                select(models.OfferBookVersion.version).where(models.OfferBookVersion.id == offer_book.OFFER_BOOK_ROW_ID)
+            ).scalar()
+            if version is not None:
+                backlog.append(Event(None, None, OFFERS_UPDATED, {"version": version}))
+        return EventStream(subscriber, backlog)
+
+    def disconnect(self, stream: EventStream):
+        subscriber = stream.subscriber
+        with self._lock:
+            channel = self._users.get(subscriber.user_id)
+            if channel is None or subscriber not in channel.subscribers:
+                return
+            channel.subscribers.discard(subscriber)
+            if not channel.subscribers:
+                del self._users[subscriber.user_id]
+            if not self._users:
+                # Sem conexões, os eventos gerais deixam de ser acompanhados
+                self._broadcast_cursor = None
+        metrics.event_stream_connections.dec()
+
+    # Thread de entrega
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="events-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _listen(self):
+        # Conexão dedicada, fora do pool: o LISTEN vale enquanto a sessão estiver aberta
+        connection = engine.raw_connection()
+        connection.detach()
+        try:
+            dbapi_connection = connection.dbapi_connection
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+        except Exception:
+            connection.close()
+            raise
+        return connection
+
+    def _wait(self, listener) -> Optional[Set[int]]:
+        """Usuários avisados por NOTIFY; None quando é hora de consultar todos (ou em eventos gerais)."""
+        dbapi_connection = listener.dbapi_connection
+        if not wait_readable([dbapi_connection], [], [], self.poll_interval)[0]:
+            return None
+        dbapi_connection.poll()
+        targets: Set[int] = set()
+        while dbapi_connection.notifies:
+            notification = dbapi_connection.notifies.pop(0)
+            self.notifications += 1
+            for target in notification.payload.split(","):
+                if target == ALL_USERS:
+                    return None
+                if target:
+                    targets.add(int(target))
+        return targets
+
+    def _run(self):
+        listener = None
+        listen_failed = False
+        last_poll = last_cleanup = 0.0
+        while not self._stop.is_set():
+            if listener is None:
+                try:
+                    listener = self._listen()
+                    self.listening, listen_failed = True, False
+                except Exception as e:
+                    if not listen_failed:
+                        print(f"LISTEN indisponível, eventos por consulta periódica: {e}")
+                    listen_failed = True
+            if listener is None:
+                self._stop.wait(self.poll_interval)
+                targets = None
+            else:
+                try:
+                    targets = self._wait(listener)
+                except Exception as e:
+                    print(f"Conexão do LISTEN perdida: {e}")
+                    listener.close()
+                    listener, self.listening = None, False
+                    targets = None
+            if time.monotonic() - last_poll >= self.poll_interval:
+                targets = None
+            if targets is None:
+                last_poll = time.monotonic()
+                self.polls += 1
+            try:
+                self._dispatch(targets)
+                if time.monotonic() - last_cleanup >= 3600:
+                    last_cleanup = time.monotonic()
+                    self._cleanup()
+            except Exception as e:
+                print(f"Erro na entrega de eventos: {e}")
+        if listener is not None:
+            listener.close()
+            self.listening = False
+
+    def _dispatch(self, targets: Optional[Set[int]]):
+        """Lê do outbox os eventos novos de 'targets' (None: todos os conectados e os gerais) e os entrega."""
+        outbox = models.OutboxEvent.__table__
+        with self._lock:
+            if not self._users:
+                return
+            cursors = [
+                (user_id, channel.cursor) for user_id, channel in self._users.items()
+                if targets is None or user_id in targets
+            ]
+            broadcast_cursor = self._broadcast_cursor if targets is None else None
+
+        with engine.connect() as conn:
+            queries = []
+            if cursors:
+                after = values(
+                    column("user_id", Integer), column("after_id", BigInteger), name="cursors"
+                ).data(cursors)
+                queries.append(select(outbox).join(after, and_(outbox.c.user_id == after.c.user_id, outbox.c.id > after.c.after_id)))
+            if broadcast_cursor is not None:
+                queries.append(select(outbox).where(outbox.c.user_id.is_(None), outbox.c.id > broadcast_cursor))
+            if not queries:
+                return
+            rows = union_all(*queries).subquery()
+            events = [_event(row) for row in conn.execute(select(rows).order_by(rows.c.id)).all()]
+        if not events:
+            return
+
+        deliveries = []
+        with self._lock:
+            for event in events:
+                if event.user_id is None:
+                    if self._broadcast_cursor is None or event.id <= self._broadcast_cursor:
+                        continue
+                    self._broadcast_cursor = event.id
+                    if RECIPIENTS in event.data:
+                        deliveries.extend(self._addressed(event))
+                        continue
+                    subscribers = [s for channel in self._users.values() for s in channel.subscribers]
+                else:
+                    channel = self._users.get(event.user_id)
+                    if channel is None or event.id <= channel.cursor:
+                        continue
+                    channel.cursor = event.id
+                    subscribers = list(channel.subscribers)
+                deliveries.extend((subscriber, event) for subscriber in subscribers)
+        for subscriber, event in deliveries:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.push, event)
+            except RuntimeError:
+                # Event loop já encerrado (worker desligando)
+                pass
+        self.delivered += len(deliveries)
+
+    def _addressed(self, event: Event) -> List[Tuple[Subscriber, Event]]:
+        # Chamado com o lock: um evento por destinatário conectado, sem id (não entra na retomada)
+        common = {key: value for key, value in event.data.items() if key != RECIPIENTS}
+        deliveries = []
+        for user_id, search_ids in event.data[RECIPIENTS].items():
+            channel = self._users.get(int(user_id))
+            if channel is None:
+                continue
+            personal = Event(None, int(user_id), event.type, {**common, "search_ids": search_ids})
+            deliveries.extend((subscriber, personal) for subscriber in channel.subscribers)
+        return deliveries
+
+    def _cleanup(self):
+        outbox = models.OutboxEvent.__table__
+        with engine.begin() as conn:
+            conn.execute(delete(outbox).where(
+                outbox.c.created_at < func.localtimestamp() - timedelta(hours=settings.EVENTS_RETENTION_HOURS)
+            ))
+
+    def stats(self) -> dict:
+        with self._lock:
+            users = len(self._users)
+            connections = sum(len(channel.subscribers) for channel in self._users.values())
+        return {
+            "listening": self.listening,
+            "users": users,
+            "connections": connections,
+            "notifications": self.notifications,
+            "polls": self.polls,
+            "delivered": self.delivered,
+        }
+
+
+async def iterate(stream: EventStream, heartbeat: Optional[float] = None):
+    """
+    Eventos de uma conexão: o backlog e depois os novos, na ordem. Com 'heartbeat', produz None a cada
+    'heartbeat' segundos sem eventos (keep-alive). Termina se a conexão acumulou eventos demais.
+    """
+    for event in stream.backlog:
+        yield event
+    subscriber = stream.subscriber
+    while not subscriber.overflowed:
+        try:
+            event = await asyncio.wait_for(subscriber.queue.get(), heartbeat)
+        except asyncio.TimeoutError:
+            yield None
+            continue
+        if subscriber.overflowed:
+            break
+        metrics.events_delivered.inc()
+        yield event
+
+
+dispatcher = EventDispatcher(poll_interval=settings.EVENTS_POLL_INTERVAL_SECONDS)
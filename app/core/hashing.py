@@ -0,0 +1,81 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+from passlib.context import CryptContext
+from sqlalchemy.util.concurrency import await_only, in_greenlet
+from .config import settings
+
+# Este módulo também é importado pelos processos do pool: não deve depender de banco nem de modelos.
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+def verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    # Devolve um novo hash quando o atual usa um custo (rounds) diferente do configurado
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+class HashingPoolFull(Exception):
+    pass
+
+
+class HashingPool:
+    """
+    Pool de processos dedicado ao bcrypt, para que picos de login não ocupem o thread pool das
+    demais rotas. A fila é limitada: com todos os slots ocupados, submit falha imediatamente.
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self._slots = threading.BoundedSemaphore(self.capacity) if workers > 0 else None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def limit_threads(self, max_threads: int):
+        """
+        Modo síncrono: cada requisição admitida espera o hash ocupando um thread do thread pool do
+        Starlette, então a admissão (processos + fila) fica limitada a 'max_threads'. Chamar antes das
+        primeiras requisições.
+        """
+        if self._slots is not None and max_threads < self.capacity:
+            self.capacity = max(max_threads, 1)
+            self._slots = threading.BoundedSemaphore(self.capacity)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: os processos não herdam threads nem conexões do worker da API
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def run(self, fn, *args):
+        if self._slots is None:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HashingPoolFull()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        if in_greenlet():
+            # Modo assíncrono (AsyncSession.run_sync): aguarda sem bloquear o event loop
+            return await_only(asyncio.wrap_future(future))
+        return future.result()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+hashing_pool = HashingPool(workers=settings.PASSWORD_HASH_WORKERS, queue_size=settings.PASSWORD_HASH_QUEUE_SIZE)
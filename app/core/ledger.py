@@ -0,0 +1,370 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+from sqlalchemy import Integer, case, cast, column, exists, func, insert, literal, select, true, union_all, update, values
+from sqlalchemy.orm import Session
+from .. import models
+
+# Convenções do ledger (ver wallet.p2p_transfer e loans.accept_offer):
+# - Cada linha move 'value' da conta de origem para a conta de destino.
+# - P2P_DEBITO é a única linha de uma transferência: o crédito no destino é inferido pela coluna de destino.
+# - accept_offer grava EMPRESTIMO_CONCEDIDO e P2P_CREDITO para o MESMO movimento; o P2P_CREDITO é um
+#   espelho e não altera saldo, senão o desembolso seria contado em dobro.
+MIRROR_TRANSACTION_TYPES = (models.TransactionType.P2P_CREDITO,)
+
+def signed_amount(account_id):
+    """
+    Expressão SQL com o efeito de cada linha do ledger no saldo da conta informada
+    (positivo para crédito, negativo para débito, zero para espelhos).
+    """
+    tx = models.Transaction
+    return case(
+        (tx.type.in_(MIRROR_TRANSACTION_TYPES), literal(0)),
+        ((tx.origin_account_id == account_id) & (tx.destination_account_id == account_id), literal(0)),
+        (tx.destination_account_id == account_id, tx.value),
+        (tx.origin_account_id == account_id, -tx.value),
+        else_=literal(0),
+    )
+
+def row_signed_amount(row, account_id):
+    """Mesma regra de signed_amount, aplicada a uma linha já carregada."""
+    if row.type in MIRROR_TRANSACTION_TYPES:
+        return Decimal("0.00")
+    if row.origin_account_id == account_id and row.destination_account_id == account_id:
+        return Decimal("0.00")
+    if row.destination_account_id == account_id:
+        return row.value
+    if row.origin_account_id == account_id:
+        return -row.value
+    return Decimal("0.00")
+
+def balance_effects(tx, *where):
+    """
+    Subconsulta (account_id, timestamp_utc, amount) com o efeito de cada linha de 'tx' (o ledger ou uma
+    partição com as mesmas colunas) no saldo de cada conta envolvida, pelas mesmas regras de signed_amount;
+    linhas sem efeito (espelhos, origem igual ao destino) ficam de fora.
+    """
+    counted = tx.c.type.not_in(MIRROR_TRANSACTION_TYPES) & tx.c.origin_account_id.is_distinct_from(tx.c.destination_account_id)
+    return union_all(
+        select(tx.c.destination_account_id.label("account_id"), tx.c.timestamp_utc, tx.c.value.label("amount"))
+        .where(counted, tx.c.destination_account_id.is_not(None), *where),
+        select(tx.c.origin_account_id.label("account_id"), tx.c.timestamp_utc, (-tx.c.value).label("amount"))
+        .where(counted, tx.c.origin_account_id.is_not(None), *where),
+    ).subquery("effects")
+
+def net_amounts_by_account(tx):
+    """SELECT (account_id, net_amount) com o efeito acumulado das linhas de 'tx' no saldo de cada conta."""
+    effects = balance_effects(tx)
+    return select(effects.c.account_id, func.sum(effects.c.amount)).group_by(effects.c.account_id)
+
+def archive_cutoff(db: Session) -> Optional[date]:
+    """Primeiro dia ainda no ledger depois das partições arquivadas (None se nada foi arquivado)."""
+    cutoff = db.execute(select(func.max(models.TransactionArchive.range_end))).scalar()
+    return cutoff.date() if cutoff is not None else None
+
+def unarchived(timestamp):
+    """
+    Condição que deixa de fora as linhas do ledger anteriores ao corte do arquivamento. O efeito delas
+    entra em account_archived_balances quando a partição é registrada em transaction_archives, antes do
+    DETACH: quem parte do saldo arquivado não pode somá-las de novo enquanto a partição segue anexada.
+    """
+    cutoff = select(func.max(models.TransactionArchive.range_end)).scalar_subquery()
+    return timestamp >= func.coalesce(cutoff, datetime.min)
+
+def archived_balance(account_id):
+    """
+    Expressão SQL com o efeito no saldo da conta das linhas do ledger já arquivadas
+    (app/jobs/ledger_partitions.py); zero se nada foi arquivado.
+    """
+    archived = models.AccountArchivedBalance
+    return func.coalesce(
+        select(archived.net_amount).where(archived.account_id == account_id).scalar_subquery(), 0
+    )
+
+
+# --- Saldo numa data ---------------------------------------------------------------------------
+# O job de fechamentos diários (app/jobs/balance_snapshots.py) consolida o ledger dia a dia em
+# account_balance_snapshots e guarda em job_watermarks o último dia consolidado. O saldo numa data
+# parte do último fechamento até ela e só lê do ledger os dias ainda não consolidados.
+
+SNAPSHOT_WATERMARK = "balance_snapshots"
+
+@dataclass(frozen=True)
+class BalanceAt:
+    balance: Decimal
+    # Dia do fechamento usado como ponto de partida (None: nenhum fechamento até a data)
+    snapshot_day: Optional[date]
+
+def balance_as_of(db: Session, account_id: int, day: date) -> BalanceAt:
+    """Saldo da conta ao fim de 'day': último fechamento diário até 'day' mais a cauda do ledger ainda não consolidada."""
+    watermarks, snapshots, tx = models.JobWatermark, models.AccountBalanceSnapshot, models.Transaction
+    consolidated = db.execute(
+        select(watermarks.watermark_date).where(watermarks.name == SNAPSHOT_WATERMARK)
+    ).scalar()
+
+    snapshot = None
+    if consolidated is not None:
+        snapshot = db.execute(
+            select(snapshots.day, snapshots.closing_balance)
+            .where(snapshots.account_id == account_id, snapshots.day <= min(day, consolidated))
+            .order_by(snapshots.day.desc())
+            .limit(1)
+        ).first()
+    # Sem fechamento, o ponto de partida é o efeito das partições já arquivadas, que só vale para dias a
+    # partir do corte do arquivamento: antes dele, as linhas da conta já não estão no ledger
+    if snapshot:
+        balance = Decimal("0.00") + snapshot.closing_balance
+    else:
+        archived = db.execute(
+            select(models.AccountArchivedBalance.net_amount).where(models.AccountArchivedBalance.account_id == account_id)
+        ).scalar()
+        if archived is not None:
+            cutoff = archive_cutoff(db)
+            if cutoff is not None and day < cutoff:
+                raise ArchivedHistory(account_id, cutoff)
+        balance = Decimal("0.00") + (archived or 0)
+
+    if consolidated is None or day > consolidated:
+        filters = [
+            (tx.origin_account_id == account_id) | (tx.destination_account_id == account_id),
+            tx.timestamp_utc < datetime.combine(day + timedelta(days=1), time.min),
+            unarchived(tx.timestamp_utc),
+        ]
+        if consolidated is not None:
+            filters.append(tx.timestamp_utc >= datetime.combine(consolidated + timedelta(days=1), time.min))
+        balance += db.execute(select(func.coalesce(func.sum(signed_amount(account_id)), 0)).where(*filters)).scalar()
+    return BalanceAt(balance, snapshot.day if snapshot else None)
+
+
+# --- Lançamentos -------------------------------------------------------------------------------
+# Todo movimento de dinheiro passa por aqui. O fluxo é sempre:
+#   1. lock_accounts: um único SELECT ... ORDER BY id FOR UPDATE. Os locks são tomados em ordem de
+#      id da conta, então duas transferências cruzadas (A->B e B->A) não entram em deadlock.
+#   2. move_funds / set_balance: um único comando com CTEs que faz o débito condicional
+#      (balance >= valor), o crédito e o INSERT das linhas do ledger, devolvendo os novos saldos.
+# Nenhum saldo é alterado em Python nem carregado como objeto ORM.
+
+class LedgerError(Exception):
+    pass
+
+class AccountNotFound(LedgerError):
+    def __init__(self, owner_id: int):
+        super().__init__(f"Account not found for user {owner_id}")
+        self.owner_id = owner_id
+
+class InsufficientFunds(LedgerError):
+    def __init__(self, account_id: int, amount: Decimal):
+        super().__init__(f"Insufficient funds in account {account_id} for {amount}")
+        self.account_id = account_id
+        self.amount = amount
+
+class ArchivedHistory(LedgerError):
+    # Saldo numa data anterior ao corte do arquivamento sem fechamento diário que a cubra
+    def __init__(self, account_id: int, cutoff: date):
+        super().__init__(f"Ledger history of account {account_id} before {cutoff} is archived")
+        self.account_id = account_id
+        self.cutoff = cutoff
+
+
+@dataclass(frozen=True)
+class LockedAccount:
+    id: int
+    owner_id: int
+    balance: Decimal
+
+@dataclass(frozen=True)
+class Entry:
+    # Uma linha do ledger gravada junto com o movimento (o valor e as contas vêm do movimento)
+    type: models.TransactionType
+    reference_entity_id: Optional[str] = None
+
+@dataclass(frozen=True)
+class Movement:
+    origin_balance: Decimal
+    destination_balance: Decimal
+
+
+def lock_accounts(db: Session, owner_ids: Iterable[int], missing_ok: bool = False) -> Dict[int, LockedAccount]:
+    """
+    Bloqueia as contas dos usuários informados, em ordem de id, e devolve {owner_id: LockedAccount}.
+    Levanta AccountNotFound se algum usuário não tiver conta (a menos que missing_ok seja True).
+    """
+    owner_ids = set(owner_ids)
+    account = models.Account.__table__
+    rows = db.execute(
+        select(account.c.id, account.c.owner_id, account.c.balance)
+        .where(account.c.owner_id.in_(owner_ids))
+        .order_by(account.c.id)
+        .with_for_update()
+    ).all()
+    accounts = {row.owner_id: LockedAccount(row.id, row.owner_id, row.balance) for row in rows}
+    for owner_id in owner_ids:
+        if owner_id not in accounts and not missing_ok:
+            raise AccountNotFound(owner_id)
+    return accounts
+
+def _entries_insert(entries: Sequence[Entry], amount, origin_id, destination_id, source, order_by=None, reference=None):
+    # INSERT ... SELECT das linhas do ledger a partir dos CTEs do movimento: só grava se o débito aconteceu.
+    # 'reference' (expressão SQL) substitui o reference_entity_id das entries quando informado.
+    tx = models.Transaction.__table__
+    rows = [
+        select(
+            func.now(),
+            cast(literal(entry.type, tx.c.type.type), tx.c.type.type),
+            amount,
+            origin_id,
+            destination_id,
+            literal(entry.reference_entity_id, tx.c.reference_entity_id.type) if reference is None else reference,
+        ).select_from(source).order_by(order_by)
+        for entry in entries
+    ]
+    return (
+        insert(tx)
+        .from_select(
+            ["timestamp_utc", "type", "value", "origin_account_id", "destination_account_id", "reference_entity_id"],
+            rows[0] if len(rows) == 1 else union_all(*rows),
+        )
+        .returning(tx.c.id)
+        .cte("entries")
+    )
+
+def move_funds(
+    db: Session, origin_account_id: int, destination_account_id: int, amount: Decimal, entries: Sequence[Entry],
+) -> Movement:
+    """
+    Debita 'amount' da origem (somente se houver saldo), credita o destino e grava 'entries', tudo em um
+    único comando. As contas devem ter sido bloqueadas antes com lock_accounts.
+    Levanta InsufficientFunds se o débito condicional não afetar nenhuma linha.
+    """
+    account = models.Account.__table__
+    same_account = origin_account_id == destination_account_id
+    # Origem igual ao destino: o movimento não altera o saldo (ver row_signed_amount), mas o saldo
+    # ainda precisa cobrir o valor. Um mesmo comando não pode atualizar a mesma linha duas vezes.
+    debit = (
+        update(account)
+        .where(account.c.id == origin_account_id, account.c.balance >= amount)
+        .values(balance=account.c.balance if same_account else account.c.balance - amount)
+        .returning(account.c.id, account.c.balance)
+        .cte("debit")
+    )
+    if same_account:
+        credit, source = debit, debit
+    else:
+        credit = (
+            update(account)
+            .where(account.c.id == destination_account_id, exists(select(debit.c.id)))
+            .values(balance=account.c.balance + amount)
+            .returning(account.c.id, account.c.balance)
+            .cte("credit")
+        )
+        source = debit.join(credit, true())
+    ledger_rows = _entries_insert(
+        entries, literal(amount, models.Transaction.value.type), debit.c.id, credit.c.id, source
+    )
+
+    row = db.execute(
+        select(debit.c.balance.label("origin_balance"), credit.c.balance.label("destination_balance"))
+        .select_from(debit if same_account else debit.outerjoin(credit, true()))
+        .add_cte(ledger_rows)
+    ).first()
+    if row is None:
+        raise InsufficientFunds(origin_account_id, amount)
+    if row.destination_balance is None:
+        raise LedgerError(f"Destination account {destination_account_id} was not credited")
+    return Movement(row.origin_balance, row.destination_balance)
+
+def move_funds_batch(
+    db: Session, origin_account_id: int, credits: Sequence[Tuple[int, Decimal]], entry: Entry,
+    references: Optional[Sequence[Optional[str]]] = None,
+) -> Decimal:
+    """
+    Versão em lote de move_funds: debita da origem a soma de 'credits' [(conta de destino, valor)],
+    credita cada destino (somando itens repetidos) e grava uma linha 'entry' por item, na ordem recebida,
+    em um único comando. 'references', se informado, traz o reference_entity_id de cada item.
+    Devolve o novo saldo da origem.
+    """
+    account = models.Account.__table__
+    amount_type = models.Transaction.value.type
+    total = sum(amount for _, amount in credits)
+    per_account = defaultdict(Decimal)
+    for account_id, amount in credits:
+        per_account[account_id] += amount
+
+    debit = (
+        update(account)
+        .where(account.c.id == origin_account_id, account.c.balance >= total)
+        .values(balance=account.c.balance - total)
+        .returning(account.c.id, account.c.balance)
+        .cte("debit")
+    )
+    # UPDATE ... FROM (VALUES ...): uma linha por conta de destino, já que o Postgres aplica no máximo
+    # uma atualização por linha em cada comando
+    totals = values(
+        column("account_id", Integer), column("amount", amount_type), name="totals"
+    ).data(list(per_account.items()))
+    credit = (
+        update(account)
+        .where(account.c.id == totals.c.account_id, exists(select(debit.c.id)))
+        .values(balance=account.c.balance + totals.c.amount)
+        .returning(account.c.id)
+        .cte("credit")
+    )
+    references = references or [entry.reference_entity_id] * len(credits)
+    items = values(
+        column("position", Integer), column("account_id", Integer), column("amount", amount_type),
+        column("reference_entity_id", models.Transaction.reference_entity_id.type), name="items",
+    ).data([
+        (position, account_id, amount, reference)
+        for position, ((account_id, amount), reference) in enumerate(zip(credits, references))
+    ])
+    ledger_rows = _entries_insert(
+        [entry], items.c.amount, debit.c.id, items.c.account_id, debit.join(items, true()),
+        order_by=items.c.position, reference=items.c.reference_entity_id,
+    )
+
+    row = db.execute(
+        select(debit.c.balance, select(func.count()).select_from(credit).scalar_subquery().label("credited"))
+        .add_cte(ledger_rows)
+    ).first()
+    if row is None:
+        raise InsufficientFunds(origin_account_id, total)
+    if row.credited != len(per_account):
+        raise LedgerError(f"Expected {len(per_account)} credited accounts, got {row.credited}")
+    return row.balance
+
+def transfer(
+    db: Session, origin_owner_id: int, destination_owner_id: int, amount: Decimal, entries: Sequence[Entry],
+) -> Movement:
+    """lock_accounts + move_funds a partir dos ids dos usuários."""
+    accounts = lock_accounts(db, (origin_owner_id, destination_owner_id))
+    return move_funds(db, accounts[origin_owner_id].id, accounts[destination_owner_id].id, amount, entries)
+
+def set_balance(db: Session, owner_id: int, new_balance: Decimal, reference_entity_id: Optional[str] = None) -> LockedAccount:
+    """
+    Ajuste administrativo: define o saldo e grava a diferença no ledger como DEPOSITO ou SAQUE,
+    para que o ledger continue explicando o saldo. Devolve a conta com o saldo anterior.
+    """
+    previous = lock_accounts(db, (owner_id,))[owner_id]
+    delta = new_balance - previous.balance
+    account = models.Account.__table__
+    updated = (
+        update(account)
+        .where(account.c.id == previous.id)
+        .values(balance=new_balance)
+        .returning(account.c.id)
+        .cte("updated")
+    )
+    statement = select(updated.c.id)
+    if delta:
+        entry_type = models.TransactionType.DEPOSITO if delta > 0 else models.TransactionType.SAQUE
+        no_account = literal(None, account.c.id.type)
+        statement = statement.add_cte(_entries_insert(
+            [Entry(entry_type, reference_entity_id)], literal(abs(delta), models.Transaction.value.type),
+            no_account if delta > 0 else updated.c.id,
+            updated.c.id if delta > 0 else no_account,
+            updated,
+        ))
+    db.execute(statement)
+    return previous
@@ -0,0 +1,340 @@
+import bisect
+import heapq
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import insert, literal, select
+from sqlalchemy.orm import Session
+from .. import models
+from . import events, offer_book
+from .config import settings
+
+# Largura das faixas de score mínimo usadas para agrupar as ofertas
+SCORE_BAND_WIDTH = 100
+
+@dataclass(frozen=True)
+class IndexedOffer:
+    # Cópia imutável de uma CreditOffer ATIVA (mesmos campos de schemas.CreditOfferOut)
+    id: int
+    lender_id: int
+    max_amount: Decimal
+    interest_rate: Decimal
+    term_months: int
+    min_credit_score: Optional[int]
+    eligible_sector: Optional[str]
+    data_expiracao: Optional[date]
+    status: models.OfferStatus
+
+    @classmethod
+    def from_model(cls, offer: models.CreditOffer) -> "IndexedOffer":
+        return cls(
+            id=offer.id, lender_id=offer.lender_id, max_amount=offer.max_amount,
+            interest_rate=offer.interest_rate, term_months=offer.term_months,
+            min_credit_score=offer.min_credit_score, eligible_sector=offer.eligible_sector,
+            data_expiracao=offer.data_expiracao, status=offer.status,
+        )
+
+    @property
+    def rank_key(self) -> Tuple[Decimal, int]:
+        # Menor taxa primeiro; em empate, a oferta mais antiga
+        return (self.interest_rate, self.id)
+
+    @property
+    def bucket(self) -> Tuple[int, int]:
+        return (self.term_months, (self.min_credit_score or 0) // SCORE_BAND_WIDTH)
+
+
+class OfferMatchingIndex:
+    """
+    Índice em memória (por processo) das ofertas ATIVAS, agrupadas por prazo e faixa de score mínimo
+    e ordenadas por taxa de juros dentro de cada grupo.
+
+    O índice é carregado na inicialização e atualizado incrementalmente por create_credit_offer e
+    accept_offer. A versão do livro de ofertas (offer_book_version) é conferida no banco no máximo
+    a cada MATCHING_INDEX_SYNC_SECONDS; se outro worker alterou o livro, o índice é recarregado.
+    """
+
+    def __init__(self, sync_interval: float):
+        self.sync_interval = sync_interval
+        self.version: Optional[int] = None
+        self._lock = threading.RLock()
+        self._keys: Dict[Tuple[int, int], List[Tuple[Decimal, int]]] = {}
+        self._offers: Dict[Tuple[int, int], List[IndexedOffer]] = {}
+        self._by_id: Dict[int, IndexedOffer] = {}
+        self._checked_at = 0.0
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def load(self, db: Session):
+        # A versão é lida antes das ofertas: se algo mudar entre as duas leituras, a próxima
+        # conferência encontra uma versão maior e recarrega.
+        version = offer_book.current_version(db)
+        offers = db.query(models.CreditOffer).filter(models.CreditOffer.status == models.OfferStatus.ACTIVE).all()
+        with self._lock:
+            self._keys, self._offers, self._by_id = {}, {}, {}
+            for offer in offers:
+                self._insert(IndexedOffer.from_model(offer))
+            self.version = version
+            self._checked_at = time.monotonic()
+
+    def ensure_fresh(self, db: Session):
+        if self.version is not None and time.monotonic() - self._checked_at < self.sync_interval:
+            return
+        # Versão igual ou anterior (ex.: lida de uma réplica atrasada) não recarrega: o índice nunca regride
+        if self.version is not None and offer_book.current_version(db) <= self.version:
+            self._checked_at = time.monotonic()
+            return
+        self.load(db)
+
+    def add(self, offer: models.CreditOffer, version: int):
+        with self._lock:
+            self._remove(offer.id)
+            if offer.status == models.OfferStatus.ACTIVE:
+                self._insert(IndexedOffer.from_model(offer))
+            self._advance(version)
+
+    def remove(self, offer_id: int, version: int):
+        with self._lock:
+            self._remove(offer_id)
+            self._advance(version)
+
+    def match(
+        self, desired_amount: Decimal, max_interest_rate: Decimal, max_term_months: int,
+        credit_score: int, exclude_lender_id: int, limit: int,
+    ) -> List[IndexedOffer]:
+        """Devolve até 'limit' ofertas compatíveis, da menor para a maior taxa de juros."""
+        max_key = (max_interest_rate, float("inf"))
+        score_band = credit_score // SCORE_BAND_WIDTH
+
+        def candidates(bucket):
+            keys, offers = self._keys[bucket], self._offers[bucket]
+            for i in range(bisect.bisect_right(keys, max_key)):
+                offer = offers[i]
+                if (
+                    offer.max_amount >= desired_amount
+                    and (offer.min_credit_score or 0) <= credit_score
+                    and offer.lender_id != exclude_lender_id
+                ):
+                    yield offer
+
+        with self._lock:
+            streams = [
+                candidates(bucket) for bucket in self._keys
+                if bucket[0] <= max_term_months and bucket[1] <= score_band
+            ]
+            return list(islice(heapq.merge(*streams, key=lambda o: o.rank_key), limit))
+
+    def _advance(self, version: int):
+        # Versões consecutivas: nada mudou em outros workers. Com lacuna, força a conferência no banco.
+        if self.version is not None and version == self.version + 1:
+            self.version = version
+        else:
+            self._checked_at = 0.0
+
+    def _insert(self, offer: IndexedOffer):
+        bucket = offer.bucket
+        keys = self._keys.setdefault(bucket, [])
+        position = bisect.bisect_left(keys, offer.rank_key)
+        keys.insert(position, offer.rank_key)
+        self._offers.setdefault(bucket, []).insert(position, offer)
+        self._by_id[offer.id] = offer
+
+    def _remove(self, offer_id: int):
+        offer = self._by_id.pop(offer_id, None)
+        if offer is None:
+            return
+        bucket = offer.bucket
+        keys = self._keys[bucket]
+        position = bisect.bisect_left(keys, offer.rank_key)
+        del keys[position], self._offers[bucket][position]
+        if not keys:
+            del self._keys[bucket], self._offers[bucket]
+
+
+offer_index = OfferMatchingIndex(sync_interval=settings.MATCHING_INDEX_SYNC_SECONDS)
+
+
+@dataclass(frozen=True)
+class IndexedSearch:
+    # Busca de crédito ATIVA com o score do mutuário, como assinatura de ofertas novas
+    id: int
+    borrower_id: int
+    desired_amount: Decimal
+    max_interest_rate: Decimal
+    desired_term_months: int
+    borrower_score: int
+    expiration_date: Optional[date]
+
+    @property
+    def rank_key(self) -> Tuple[Decimal, int]:
+        # Maior taxa aceita primeiro: as buscas que aceitam uma oferta formam um prefixo do grupo
+        return (-self.max_interest_rate, self.id)
+
+    @property
+    def bucket(self) -> Tuple[int, int]:
+        return (self.desired_term_months, self.borrower_score // SCORE_BAND_WIDTH)
+
+
+class SearchSubscriptionIndex:
+    """
+    Índice em memória (por processo) das buscas de crédito ATIVAS, o inverso de OfferMatchingIndex:
+    dada uma oferta nova, encontra as buscas que ela atende. As buscas são agrupadas por prazo desejado
+    e faixa de score do mutuário e ordenadas pela taxa máxima aceita (decrescente) dentro de cada grupo;
+    a oferta consulta só os grupos com prazo e faixa compatíveis e, em cada um, só o prefixo de buscas
+    que aceitam a sua taxa.
+
+    As buscas só são criadas (nunca alteradas pela API), então o índice é atualizado pelas buscas com id
+    maior que o último carregado. sync deve ser chamado com o livro de ofertas bloqueado
+    (bump_version): create_credit_search toma o bloqueio compartilhado antes de gravar a busca, então
+    nenhuma busca com id menor pode ser confirmada depois da leitura.
+
+    O score do mutuário, porém, pode mudar depois da carga: notify_subscriptions o confere no banco e
+    relê (refresh) as buscas que a oferta deixou de atender, que voltam ao índice com o score atual.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._keys: Dict[Tuple[int, int], List[Tuple[Decimal, int]]] = {}
+        self._searches: Dict[Tuple[int, int], List[IndexedSearch]] = {}
+        self._by_id: Dict[int, IndexedSearch] = {}
+        self.last_id: Optional[int] = None
+
+    def __len__(self):
+        return len(self._by_id)
+
+    @staticmethod
+    def _active_searches():
+        searches, users = models.CreditSearch.__table__, models.User.__table__
+        return (
+            select(
+                searches.c.id, searches.c.borrower_id, searches.c.desired_amount, searches.c.max_interest_rate,
+                searches.c.desired_term_months, users.c.score_credito, searches.c.expiration_date,
+            )
+            .join(users, users.c.id == searches.c.borrower_id)
+            .where(searches.c.status == models.CreditSearchStatus.ACTIVE)
+            .order_by(searches.c.id)
+        )
+
+    def _load(self, rows):
+        for row in rows:
+            self._remove(row.id)
+            self._insert(IndexedSearch(
+                id=row.id, borrower_id=row.borrower_id, desired_amount=row.desired_amount,
+                max_interest_rate=row.max_interest_rate, desired_term_months=row.desired_term_months,
+                borrower_score=row.score_credito or 0, expiration_date=row.expiration_date,
+            ))
+
+    def sync(self, db: Session):
+        query = self._active_searches()
+        with self._lock:
+            if self.last_id is not None:
+                query = query.where(models.CreditSearch.__table__.c.id > self.last_id)
+            rows = db.execute(query).all()
+            self._load(rows)
+            if rows:
+                self.last_id = rows[-1].id
+            elif self.last_id is None:
+                self.last_id = 0
+
+    def refresh(self, db: Session, search_ids):
+        """Relê as buscas 'search_ids': as que deixaram de estar ATIVAS saem do índice, as demais voltam com o score atual."""
+        search_ids = list(search_ids)
+        if not search_ids:
+            return
+        rows = db.execute(self._active_searches().where(models.CreditSearch.__table__.c.id.in_(search_ids))).all()
+        with self._lock:
+            for search_id in search_ids:
+                self._remove(search_id)
+            self._load(rows)
+
+    def match(self, offer: IndexedOffer, today: date) -> List[IndexedSearch]:
+        """Buscas ATIVAS (no índice) atendidas pela oferta: valor, taxa, prazo e score mínimo."""
+        min_key = (-offer.interest_rate, float("inf"))
+        min_score = offer.min_credit_score or 0
+        matches, expired = [], []
+        with self._lock:
+            for bucket, keys in self._keys.items():
+                if bucket[0] < offer.term_months or bucket[1] < min_score // SCORE_BAND_WIDTH:
+                    continue
+                for search in islice(self._searches[bucket], bisect.bisect_right(keys, min_key)):
+                    if search.expiration_date is not None and search.expiration_date < today:
+                        expired.append(search.id)
+                    elif (
+                        search.desired_amount <= offer.max_amount
+                        and search.borrower_score >= min_score
+                        and search.borrower_id != offer.lender_id
+                    ):
+                        matches.append(search)
+            for search_id in expired:
+                self._remove(search_id)
+        return matches
+
+    def _insert(self, search: IndexedSearch):
+        bucket = search.bucket
+        keys = self._keys.setdefault(bucket, [])
+        position = bisect.bisect_left(keys, search.rank_key)
+        keys.insert(position, search.rank_key)
+        self._searches.setdefault(bucket, []).insert(position, search)
+        self._by_id[search.id] = search
+
+    def _remove(self, search_id: int):
+        search = self._by_id.pop(search_id, None)
+        if search is None:
+            return
+        bucket = search.bucket
+        keys = self._keys[bucket]
+        position = bisect.bisect_left(keys, search.rank_key)
+        del keys[position], self._searches[bucket][position]
+        if not keys:
+            del self._keys[bucket], self._searches[bucket]
+
+
+search_index = SearchSubscriptionIndex()
+
+
+def notify_subscriptions(db: Session, offer: models.CreditOffer) -> int:
+    """
+    Registra a oferta recém-criada no feed das buscas ATIVAS que ela atende e publica o evento
+    search.matched para os mutuários. Chamar na transação que cria a oferta, depois de bump_version.
+    Devolve o número de buscas atendidas.
+    """
+    search_index.sync(db)
+    candidates = search_index.match(IndexedOffer.from_model(offer), date.today())
+    if not candidates:
+        return 0
+    searches, feed, users = models.CreditSearch.__table__, models.CreditSearchMatch.__table__, models.User.__table__
+    # Status e score do mutuário são conferidos no banco (o score indexado é o da carga da busca); as
+    # buscas recusadas são relidas: as que deixaram de estar ATIVAS saem do índice e as demais voltam
+    # para a faixa do score atual
+    rows = db.execute(
+        insert(feed).from_select(
+            ["search_id", "offer_id", "borrower_id"],
+            select(searches.c.id, literal(offer.id), searches.c.borrower_id)
+            .join(users, users.c.id == searches.c.borrower_id)
+            .where(searches.c.id.in_([search.id for search in candidates]))
+            .where(searches.c.status == models.CreditSearchStatus.ACTIVE)
+            .where(users.c.score_credito >= (offer.min_credit_score or 0))
+            .order_by(searches.c.id),
+        ).returning(feed.c.search_id, feed.c.borrower_id)
+    ).all()
+    matched = {row.search_id for row in rows}
+    search_index.refresh(db, (search.id for search in candidates if search.id not in matched))
+    if not rows:
+        return 0
+
+    recipients: Dict[str, List[int]] = {}
+    for row in rows:
+        recipients.setdefault(str(row.borrower_id), []).append(row.search_id)
+    events.publish(db, [(None, events.SEARCH_MATCHED, {
+        "offer": {
+            "id": offer.id, "max_amount": offer.max_amount, "interest_rate": offer.interest_rate,
+            "term_months": offer.term_months,
+        },
+        "recipients": recipients,
+    })])
+    return len(rows)
@@ -0,0 +1,250 @@
+import bisect
+import threading
+import time
+from typing import Dict, List, Sequence, Tuple
+from . import database
+
+# Métricas em memória do processo (cada worker do uvicorn tem as suas, como /internal/pool), expostas em
+# /metrics no formato texto do Prometheus. Sem dependências externas: contadores, gauges e histogramas
+# simples, com um lock por métrica (o custo por requisição fica em poucos microssegundos, ver
+# benchmarks/metrics_middleware.py).
+
+# Buckets padrão de latência do cliente oficial do Prometheus (segundos)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+# O Starlette acrescenta "; charset=utf-8" aos tipos text/*
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in values]
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in values]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Por conjunto de labels: [contagem por bucket (não acumulada) + overflow, soma]
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        lines = self.header()
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """'collector' é chamado a cada coleta e devolve métricas montadas na hora (ex.: estado do pool)."""
+        self._collectors.append(collector)
+        return collector
+
+    def expose(self) -> str:
+        metrics = list(self._metrics)
+        for collector in self._collectors:
+            metrics.extend(collector())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Duração das requisições HTTP (até o último byte da resposta).",
+    ("method", "route", "status"),
+))
+http_requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "Requisições HTTP em andamento neste worker."
+))
+
+# Contadores de negócio (incrementados pelos endpoints depois do commit)
+transfers = registry.register(Counter(
+    "quark_transfers_total", "Transferências P2P concluídas.", ("kind",)
+))
+loans_accepted = registry.register(Counter(
+    "quark_loans_accepted_total", "Empréstimos contratados (ofertas aceitas)."
+))
+installments_paid = registry.register(Counter(
+    "quark_installments_paid_total", "Parcelas pagas."
+))
+amount_moved = registry.register(Counter(
+    "quark_amount_moved_total", "Valor movimentado entre carteiras (R$).", ("operation",)
+))
+
+def record_movement(operation: str, amount):
+    amount_moved.inc(operation, amount=float(amount))
+
+# Eventos em tempo real (app/core/events.py)
+event_stream_connections = registry.register(Gauge(
+    "quark_event_stream_connections", "Conexões SSE/WebSocket de eventos abertas neste worker."
+))
+events_delivered = registry.register(Counter(
+    "quark_events_delivered_total", "Eventos entregues às conexões deste worker."
+))
+events_dropped_connections = registry.register(Counter(
+    "quark_event_stream_overflows_total", "Conexões encerradas por acumular eventos não lidos."
+))
+
+
+@registry.register_collector
+def _pool_metrics():
+    # Estado dos pools de conexões no momento da coleta (mesma fonte de /internal/pool)
+    gauges = {
+        "size": Gauge("db_pool_size", "Tamanho base do pool de conexões.", ("engine",)),
+        "checked_out": Gauge("db_pool_checked_out", "Conexões em uso.", ("engine",)),
+        "overflow": Gauge("db_pool_overflow", "Conexões abertas além do tamanho base.", ("engine",)),
+    }
+    counters = {
+        "checkouts": Counter("db_pool_checkouts_total", "Checkouts de conexão.", ("engine",)),
+        "timeouts": Counter("db_pool_timeouts_total", "Timeouts aguardando uma conexão livre.", ("engine",)),
+        "wait_seconds_total": Counter("db_pool_wait_seconds_total", "Tempo total de espera no checkout.", ("engine",)),
+    }
+    for name, stats in database.pool_stats.items():
+        snapshot = stats.snapshot()
+        gauges["size"].set(snapshot["pool_size"], name)
+        gauges["checked_out"].set(snapshot["checked_out"], name)
+        gauges["overflow"].set(snapshot["overflow"], name)
+        for key, counter in counters.items():
+            counter.inc(name, amount=snapshot[key])
+    return list(gauges.values()) + list(counters.values())
+
+
+@registry.register_collector
+def _replica_metrics():
+    healthy = Gauge("db_replica_healthy", "Réplica de leitura disponível (1) ou fora do rodízio (0).", ("replica",))
+    lag = Gauge("db_replica_lag_seconds", "Atraso de replicação medido na última verificação.", ("replica",))
+    for replica in database.replicas.replicas:
+        healthy.set(int(replica.healthy), replica.name)
+        if replica.lag_seconds is not None:
+            lag.set(replica.lag_seconds, replica.name)
+    return [healthy, lag]
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI puro (sem BaseHTTPMiddleware): mede cada requisição HTTP e registra a latência por
+    método, template da rota (ex.: /api/v1/loan/{loan_id}/installments) e status.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec()
+            # O roteador grava a rota encontrada no próprio scope
+            route = scope.get("route")
+            http_request_duration.observe(
+                time.perf_counter() - start,
+                scope["method"], getattr(route, "path", "unmatched"), str(status),
+            )
@@ -0,0 +1,34 @@
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+from .. import models
+
+OFFER_BOOK_ROW_ID = 1
+
+def bump_version(db: Session) -> int:
+    """
+    Incrementa a versão do livro de ofertas dentro da transação corrente e devolve o novo valor.
+    Deve ser chamada por toda operação que altera o conjunto de ofertas ATIVAS.
+    """
+    return db.execute(
+        update(models.OfferBookVersion)
+        .where(models.OfferBookVersion.id == OFFER_BOOK_ROW_ID)
+        .values(version=models.OfferBookVersion.version + 1)
+        .returning(models.OfferBookVersion.version)
+    ).scalar_one()
+
+def current_version(db: Session) -> int:
+    return db.execute(
+        select(models.OfferBookVersion.version).where(models.OfferBookVersion.id == OFFER_BOOK_ROW_ID)
+    ).scalar_one()
+
+def share_lock(db: Session):
+    """
+    Bloqueio compartilhado da linha do livro de ofertas até o fim da transação: espera as transações que
+    já incrementaram a versão e impede novos incrementos até o commit. Usado ao criar buscas de crédito,
+    para que a oferta criada em seguida veja a busca (ver matching.notify_subscriptions).
+    """
+    db.execute(
+        select(models.OfferBookVersion.id)
+        .where(models.OfferBookVersion.id == OFFER_BOOK_ROW_ID)
+        .with_for_update(read=True)
+    )
@@ -0,0 +1,132 @@
+import threading
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from .. import models, schemas
+from . import responses
+from .config import settings
+
+# Cache da lista de ofertas ATIVAS (GET /marketplace/offers). A lista é a mesma para todos os usuários,
+# exceto pelas ofertas do próprio usuário, que são retiradas na hora de montar a resposta. Cada oferta
+# fica serializada (JSON) junto com o seu credor, e a lista inteira é identificada pela versão do livro
+# de ofertas (offer_book.bump_version, chamada por create_credit_offer e accept_offer): uma versão nova
+# simplesmente não encontra a lista anterior.
+# - Camada local: a lista da versão mais recente, por processo.
+# - Camada compartilhada opcional (OFFERS_CACHE_REDIS_URL, extra "redis"): uma lista montada por um
+#   worker serve aos demais. Falhas do Redis não derrubam a rota: a lista é montada a partir do banco.
+
+
+@dataclass(frozen=True)
+class OfferList:
+    version: int
+    # (lender_id, JSON da oferta), em ordem de id
+    entries: Tuple[Tuple[int, bytes], ...]
+
+    def render(self, exclude_lender_id: int) -> bytes:
+        """Corpo JSON da lista sem as ofertas de 'exclude_lender_id' (o mesmo do caminho sem cache)."""
+        return b"[" + b",".join(body for lender_id, body in self.entries if lender_id != exclude_lender_id) + b"]"
+
+    def dumps(self) -> bytes:
+        # Uma oferta por linha: "<lender_id> <json>" (o JSON compacto não contém quebras de linha)
+        return b"\n".join(b"%d %s" % entry for entry in self.entries)
+
+    @classmethod
+    def loads(cls, version: int, data: bytes) -> "OfferList":
+        entries = []
+        for line in data.split(b"\n") if data else ():
+            lender_id, _, body = line.partition(b" ")
+            entries.append((int(lender_id), body))
+        return cls(version, tuple(entries))
+
+
+def load_offer_list(db: Session, version: int) -> OfferList:
+    fields = responses.schema_fields(schemas.CreditOfferOut)
+    columns = models.CreditOffer.__table__.c
+    rows = db.execute(
+        select(*(columns[field] for field in fields))
+        .where(columns.status == models.OfferStatus.ACTIVE)
+        .order_by(columns.id)
+    ).all()
+    return OfferList(version, tuple(
+        (row.lender_id, responses.encode(item)) for row, item in zip(rows, responses.as_dicts(rows, fields))
+    ))
+
+
+class RedisOfferStore:
+    """Camada compartilhada: uma chave por versão, com TTL (versões antigas expiram sozinhas)."""
+
+    KEY_PREFIX = "quark:offers:active:"
+
+    def __init__(self, url: str, ttl_seconds: int):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("OFFERS_CACHE_REDIS_URL exige o pacote 'redis' (extra 'redis' do projeto)") from e
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, version: int) -> Optional[OfferList]:
+        try:
+            data = self.client.get(f"{self.KEY_PREFIX}{version}")
+        except Exception as e:
+            print(f"Erro ao ler o cache de ofertas: {e}")
+            return None
+        return None if data is None else OfferList.loads(version, data)
+
+    def put(self, offers: OfferList):
+        try:
+            self.client.set(f"{self.KEY_PREFIX}{offers.version}", offers.dumps(), ex=self.ttl_seconds)
+        except Exception as e:
+            print(f"Erro ao gravar o cache de ofertas: {e}")
+
+
+class OffersCache:
+    def __init__(self, shared: Optional[RedisOfferStore] = None):
+        self.shared = shared
+        self._latest: Optional[OfferList] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def get(self, db: Session, version: int) -> OfferList:
+        """Lista de ofertas ATIVAS da versão 'version' (lida pelo chamador no mesmo banco)."""
+        latest = self._latest
+        if latest is not None and latest.version == version:
+            self.hits += 1
+            return latest
+        offers = self.shared.get(version) if self.shared is not None else None
+        if offers is not None:
+            self.shared_hits += 1
+        else:
+            # Sem lock durante a consulta: no modo assíncrono ela roda no event loop
+            self.misses += 1
+            offers = load_offer_list(db, version)
+            if self.shared is not None:
+                self.shared.put(offers)
+        with self._lock:
+            # Uma réplica atrasada pode devolver uma versão anterior: a camada local nunca regride
+            if self._latest is None or offers.version >= self._latest.version:
+                self._latest = offers
+        return offers
+
+    def stats(self) -> dict:
+        return {
+            "version": None if self._latest is None else self._latest.version,
+            "offers": 0 if self._latest is None else len(self._latest.entries),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+        }
+
+
+def etag(version: int, user_id: int) -> str:
+    # A resposta depende da versão do livro e do usuário (as ofertas dele ficam de fora)
+    return f'"offers-{version}-{user_id}"'
+
+
+offers_cache = OffersCache(
+    RedisOfferStore(settings.OFFERS_CACHE_REDIS_URL, settings.OFFERS_CACHE_TTL_SECONDS)
+    if settings.OFFERS_CACHE_REDIS_URL else None
+)
@@ -0,0 +1,27 @@
+import base64
+from typing import List, Optional
+from fastapi import HTTPException, Response
+
+# Cabeçalho usado para devolver o cursor da próxima página sem alterar o corpo (lista) das respostas
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(*values) -> str:
+    """
+    Gera um cursor opaco (keyset) a partir dos valores da última linha da página.
+    """
+    raw = "|".join(v.isoformat() if hasattr(v, "isoformat") else str(v) for v in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> List[str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
+    if len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
+    return values
+
+def set_next_cursor(response: Response, cursor: Optional[str]):
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
@@ -0,0 +1,163 @@
+from collections import defaultdict
+from decimal import Decimal
+from typing import List
+from sqlalchemy import Date, cast, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.selectable import CTE
+from .. import models
+from .amortization import Schedule
+
+# Agregados da carteira dos credores (lender_portfolios) e fluxo de caixa esperado por mês
+# (lender_cashflows), mantidos incrementalmente na mesma transação que altera empréstimos e parcelas:
+# - accept_offer: record_loan soma o empréstimo e o seu cronograma;
+# - pay_installment: payment_updates desconta as parcelas pagas;
+# - varredura de inadimplência: overdue_update soma as parcelas que entraram em ATRASO e default_update
+#   move o principal em aberto dos empréstimos que entraram em DEFAULT para defaulted_principal.
+# Todas as escritas entram como CTEs do comando que já é executado, sem idas extras ao banco.
+# Para backfills e correções: python -m app.jobs.rebuild_portfolios.
+#
+# Ordem de locks: accept e pay alteram a carteira do credor já com a conta dele bloqueada
+# (ledger.lock_accounts), então as escritas de um mesmo credor ficam serializadas pela conta.
+
+def month_of(value):
+    """Primeiro dia do mês (expressão SQL) de uma coluna de data."""
+    return cast(func.date_trunc("month", value), Date)
+
+def _bump():
+    portfolios = models.LenderPortfolio.__table__
+    return {"version": portfolios.c.version + 1, "updated_at": func.now()}
+
+def record_loan(db: Session, lender_id: int, amount: Decimal, schedule: Schedule):
+    """Soma um empréstimo recém-criado à carteira do credor e o seu cronograma ao fluxo de caixa."""
+    portfolios, cashflows = models.LenderPortfolio.__table__, models.LenderCashflow.__table__
+    portfolio = insert(portfolios).values(
+        lender_id=lender_id, version=1, loans_count=1, principal_lent=amount, outstanding_principal=amount,
+        defaulted_principal=0, amount_received=0, interest_earned=0, overdue_installments=0, overdue_amount=0, updated_at=func.now(),
+    )
+    portfolio = portfolio.on_conflict_do_update(
+        index_elements=[portfolios.c.lender_id],
+        set_={
+            "loans_count": portfolios.c.loans_count + 1,
+            "principal_lent": portfolios.c.principal_lent + amount,
+            "outstanding_principal": portfolios.c.outstanding_principal + amount,
+            **_bump(),
+        },
+    ).returning(portfolios.c.lender_id).cte("portfolio")
+
+    months = defaultdict(lambda: [Decimal(0)] * 3)
+    for row in schedule.rows():
+        totals = months[row["due_date"].replace(day=1)]
+        totals[0] += row["amount"]
+        totals[1] += row["principal_amount"]
+        totals[2] += row["interest_amount"]
+    cashflow = insert(cashflows).values([
+        {
+            "lender_id": lender_id, "month": month, "expected_amount": expected,
+            "expected_principal": principal, "expected_interest": interest,
+        }
+        for month, (expected, principal, interest) in sorted(months.items())
+    ])
+    db.execute(
+        cashflow.on_conflict_do_update(
+            index_elements=[cashflows.c.lender_id, cashflows.c.month],
+            set_={
+                "expected_amount": cashflows.c.expected_amount + cashflow.excluded.expected_amount,
+                "expected_principal": cashflows.c.expected_principal + cashflow.excluded.expected_principal,
+                "expected_interest": cashflows.c.expected_interest + cashflow.excluded.expected_interest,
+            },
+        ).add_cte(portfolio)
+    )
+
+def payment_updates(lender_id: int, paid: CTE, defaulted: bool = False) -> List[CTE]:
+    """
+    CTEs que descontam da carteira as parcelas pagas. 'paid' é o UPDATE ... RETURNING das parcelas,
+    com due_date, amount, principal_amount, interest_amount, valor_pago e previous_status
+    (status antes do pagamento, lido com a parcela bloqueada). 'defaulted': o empréstimo está em
+    DEFAULT, e o principal pago sai de defaulted_principal.
+    """
+    portfolios, cashflows = models.LenderPortfolio.__table__, models.LenderCashflow.__table__
+    was_overdue = paid.c.previous_status == models.InstallmentStatus.OVERDUE
+
+    def total(expression):
+        return select(expression).select_from(paid).scalar_subquery()
+
+    principal, received = total(func.sum(paid.c.principal_amount)), total(func.sum(paid.c.valor_pago))
+    principal_column = portfolios.c.defaulted_principal if defaulted else portfolios.c.outstanding_principal
+    portfolio = (
+        update(portfolios)
+        .where(portfolios.c.lender_id == lender_id)
+        .values(
+            **{principal_column.name: principal_column - principal},
+            amount_received=portfolios.c.amount_received + received,
+            # Na quitação antecipada valor_pago é só o principal: os juros futuros não entram como ganho
+            interest_earned=portfolios.c.interest_earned + received - principal,
+            overdue_installments=portfolios.c.overdue_installments - total(func.count().filter(was_overdue)),
+            overdue_amount=portfolios.c.overdue_amount - total(func.coalesce(func.sum(paid.c.amount).filter(was_overdue), 0)),
+            **_bump(),
+        )
+        .returning(portfolios.c.lender_id)
+        .cte("portfolio")
+    )
+
+    # Parcelas pagas deixam de ser esperadas no mês do seu vencimento
+    month = month_of(paid.c.due_date)
+    per_month = select(
+        month.label("month"),
+        func.sum(paid.c.amount).label("amount"),
+        func.sum(paid.c.principal_amount).label("principal"),
+        func.sum(paid.c.interest_amount).label("interest"),
+    ).group_by(month).subquery("paid_months")
+    cashflow = (
+        update(cashflows)
+        .where(cashflows.c.lender_id == lender_id, cashflows.c.month == per_month.c.month)
+        .values(
+            expected_amount=cashflows.c.expected_amount - per_month.c.amount,
+            expected_principal=cashflows.c.expected_principal - per_month.c.principal,
+            expected_interest=cashflows.c.expected_interest - per_month.c.interest,
+        )
+        .returning(cashflows.c.month)
+        .cte("cashflow")
+    )
+    return [portfolio, cashflow]
+
+def overdue_update(overdue: CTE) -> CTE:
+    """CTE que soma às carteiras as parcelas que passaram para ATRASO ('overdue': loan_id e amount)."""
+    portfolios, loans = models.LenderPortfolio.__table__, models.Loan.__table__
+    per_lender = (
+        select(loans.c.lender_id, func.count().label("installments"), func.sum(overdue.c.amount).label("amount"))
+        .select_from(overdue.join(loans, loans.c.id == overdue.c.loan_id))
+        .group_by(loans.c.lender_id)
+        .subquery("overdue_per_lender")
+    )
+    return (
+        update(portfolios)
+        .where(portfolios.c.lender_id == per_lender.c.lender_id)
+        .values(
+            overdue_installments=portfolios.c.overdue_installments + per_lender.c.installments,
+            overdue_amount=portfolios.c.overdue_amount + per_lender.c.amount,
+            **_bump(),
+        )
+        .returning(portfolios.c.lender_id)
+        .cte("portfolio")
+    )
+
+def default_update(defaulted: CTE) -> CTE:
+    """CTE que move para defaulted_principal o principal em aberto dos empréstimos que entraram em DEFAULT ('defaulted': linhas de loans)."""
+    portfolios = models.LenderPortfolio.__table__
+    per_lender = (
+        select(defaulted.c.lender_id, func.sum(defaulted.c.outstanding_balance).label("principal"))
+        .group_by(defaulted.c.lender_id)
+        .subquery("defaulted_per_lender")
+    )
+    return (
+        update(portfolios)
+        .where(portfolios.c.lender_id == per_lender.c.lender_id)
+        .values(
+            outstanding_principal=portfolios.c.outstanding_principal - per_lender.c.principal,
+            defaulted_principal=portfolios.c.defaulted_principal + per_lender.c.principal,
+            **_bump(),
+        )
+        .returning(portfolios.c.lender_id)
+        .cte("portfolio")
+    )
@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import make_transient_to_detached
+from .. import models
+from .config import settings
+
+
+class PrincipalCache:
+    """
+    Cache LRU com TTL dos usuários autenticados, indexado pelo 'sub' do token (email).
+
+    Guarda cópias destacadas (detached) de models.User; get_current_user as reanexa à sessão da
+    requisição com Session.merge(load=False), sem SELECT. A invalidação explícita vale para o
+    worker local; nos demais a entrada expira após PRINCIPAL_CACHE_TTL_SECONDS.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, subject: str) -> Optional[models.User]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[subject]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(subject)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, subject: str, user: models.User):
+        snapshot = _detached_copy(user)
+        with self._lock:
+            self._entries[subject] = (time.monotonic() + self.ttl_seconds, snapshot)
+            self._entries.move_to_end(subject)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, subject: str):
+        with self._lock:
+            if self._entries.pop(subject, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def _detached_copy(user: models.User) -> models.User:
+    # Copia apenas as colunas: a cópia não pertence a nenhuma sessão e pode ser compartilhada entre threads
+    columns = {attr.key: getattr(user, attr.key) for attr in sa_inspect(models.User).column_attrs}
+    copy = models.User(**columns)
+    make_transient_to_detached(copy)
+    return copy
+
+
+principal_cache = PrincipalCache(
+    max_size=settings.PRINCIPAL_CACHE_MAX_SIZE, ttl_seconds=settings.PRINCIPAL_CACHE_TTL_SECONDS
+)
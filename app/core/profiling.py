@@ -0,0 +1,162 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import event
+from .config import settings
+
+# Perfil das consultas SQL de cada requisição: listeners before/after_cursor_execute nos engines
+# (ligados em database.py) contam as consultas, somam o tempo no banco e guardam as mais lentas do
+# perfil ativo no contexto da requisição (QueryProfilerMiddleware). O contexto chega ao thread pool
+# (endpoints síncronos) e ao greenlet do AsyncSession (modo assíncrono).
+# - Consultas acima de DB_SLOW_QUERY_MS são registradas no log, dentro ou fora de requisições.
+# - O mesmo SQL executado DB_N_PLUS_ONE_THRESHOLD vezes ou mais numa requisição (só os parâmetros mudam,
+#   ex.: carga lazy de Loan.installments por empréstimo) é sinalizado como N+1.
+# - Fora de produção, a resposta traz X-DB-Queries, X-DB-Time (ms) e, havendo N+1, X-DB-N-Plus-One.
+
+SLOWEST_PER_REQUEST = 5
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _compact(statement: str, limit: int = 500) -> str:
+    statement = _WHITESPACE.sub(" ", statement).strip()
+    return statement if len(statement) <= limit else statement[:limit] + "..."
+
+
+class QueryProfile:
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        # SQL -> [execuções, tempo total]
+        self.statements: Dict[str, List] = {}
+        # (tempo, SQL) das consultas mais lentas, da mais lenta para a mais rápida
+        self.slowest: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, seconds: float):
+        with self._lock:
+            self.queries += 1
+            self.seconds += seconds
+            entry = self.statements.get(statement)
+            if entry is None:
+                entry = self.statements[statement] = [0, 0.0]
+            entry[0] += 1
+            entry[1] += seconds
+            if len(self.slowest) < SLOWEST_PER_REQUEST or seconds > self.slowest[-1][0]:
+                self.slowest.append((seconds, statement))
+                self.slowest.sort(key=lambda item: item[0], reverse=True)
+                del self.slowest[SLOWEST_PER_REQUEST:]
+
+    def repeated(self, threshold: Optional[int] = None) -> List[Tuple[str, int, float]]:
+        """(SQL, execuções, tempo total) dos comandos repetidos ao menos 'threshold' vezes (suspeitos de N+1)."""
+        threshold = threshold or settings.DB_N_PLUS_ONE_THRESHOLD
+        with self._lock:
+            items = [(statement, count, seconds) for statement, (count, seconds) in self.statements.items()]
+        return sorted(
+            (item for item in items if item[1] >= threshold), key=lambda item: item[1], reverse=True
+        )
+
+    def report(self) -> str:
+        lines = [f"{self.queries} consultas, {self.seconds * 1000:.2f} ms no banco"]
+        for statement, count, seconds in self.repeated():
+            lines.append(f"  N+1 ({count}x, {seconds * 1000:.2f} ms): {_compact(statement)}")
+        for seconds, statement in self.slowest:
+            lines.append(f"  {seconds * 1000:.2f} ms: {_compact(statement)}")
+        return "\n".join(lines)
+
+
+_current: ContextVar[Optional[QueryProfile]] = ContextVar("query_profile", default=None)
+# Perfis globais (todas as threads), usados por assert_max_queries
+_watchers: List[QueryProfile] = []
+
+
+def current_profile() -> Optional[QueryProfile]:
+    return _current.get()
+
+@contextmanager
+def profile():
+    """Perfila as consultas executadas no contexto atual (e nos threads/greenlets que herdam o contexto)."""
+    query_profile = QueryProfile()
+    token = _current.set(query_profile)
+    try:
+        yield query_profile
+    finally:
+        _current.reset(token)
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """
+    Auxiliar de testes: falha com AssertionError se o bloco executar mais de 'limit' consultas. Conta as
+    consultas de qualquer thread, então também cobre requisições feitas pelo TestClient:
+
+        with profiling.assert_max_queries(3):
+            client.get("/api/v1/loan/my-loans", headers=headers)
+    """
+    query_profile = QueryProfile()
+    _watchers.append(query_profile)
+    try:
+        yield query_profile
+    finally:
+        _watchers.remove(query_profile)
+    if query_profile.queries > limit:
+        raise AssertionError(f"Esperado no máximo {limit} consultas: {query_profile.report()}")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._profiling_start = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_profiling_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    query_profile = _current.get()
+    if query_profile is not None:
+        query_profile.record(statement, elapsed)
+    for watcher in _watchers:
+        watcher.record(statement, elapsed)
+    if settings.DB_SLOW_QUERY_MS and elapsed * 1000 >= settings.DB_SLOW_QUERY_MS:
+        print(f"Consulta lenta ({elapsed * 1000:.1f} ms): {_compact(statement)}")
+
+def attach(sync_engine):
+    if not settings.DB_PROFILING_ENABLED:
+        return
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class QueryProfilerMiddleware:
+    """
+    Middleware ASGI puro: abre um perfil de consultas por requisição HTTP, sinaliza N+1 no log e, fora
+    de produção, devolve a contagem e o tempo no banco nos cabeçalhos da resposta.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.headers = settings.ENVIRONMENT != "production"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        with profile() as query_profile:
+            async def send_wrapper(message):
+                # Os cabeçalhos saem antes do corpo: contam as consultas feitas até a resposta começar
+                if self.headers and message["type"] == "http.response.start":
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-db-queries", str(query_profile.queries).encode()))
+                    headers.append((b"x-db-time", f"{query_profile.seconds * 1000:.2f}".encode()))
+                    repeated = query_profile.repeated()
+                    if repeated:
+                        headers.append((b"x-db-n-plus-one", str(len(repeated)).encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+        if query_profile.repeated():
+            route = getattr(scope.get("route"), "path", scope["path"])
+            print(f"Possível N+1 em {scope['method']} {route}: {query_profile.report()}")
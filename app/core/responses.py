@@ -0,0 +1,56 @@
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Type
+import orjson
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+# Caminho rápido das listagens grandes (settings.FAST_LIST_SERIALIZATION): os endpoints selecionam só as
+# colunas do schema como linhas Core, montam os dicionários diretamente (sem hidratar objetos ORM nem
+# validar cada linha com o pydantic, já que a saída do banco é confiável) e codificam com orjson.
+# O corpo é idêntico byte a byte ao do caminho padrão (jsonable_encoder + json.dumps compacto):
+# Decimal vira float (ou int, sem casas decimais), date/datetime viram ISO 8601 e enums viram o seu valor.
+
+def _default(value):
+    if isinstance(value, Decimal):
+        # Mesma regra do decimal_encoder do FastAPI: sem casas decimais vira int, senão float
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return encode(content)
+
+
+def schema_fields(schema: Type[BaseModel]) -> List[str]:
+    """Campos do schema na ordem de declaração (a mesma ordem das chaves no JSON do caminho padrão)."""
+    return list(schema.__fields__)
+
+def as_dicts(rows: Iterable, fields: List[str]) -> List[Dict[str, Any]]:
+    """Converte linhas Core (ou quaisquer objetos com esses atributos) em dicionários na ordem de 'fields'."""
+    return [{field: getattr(row, field) for field in fields} for row in rows]
+
+def list_response(items: List[Dict[str, Any]], response: Optional[Response] = None) -> FastJSONResponse:
+    """
+    Resposta JSON de uma lista já montada. Como a Response devolvida substitui a injetada no endpoint,
+    os cabeçalhos definidos nela (ex.: X-Next-Cursor) são copiados.
+    """
+    headers = None
+    if response is not None:
+        headers = {key: value for key, value in response.headers.items() if key != "content-length"}
+    return FastJSONResponse(items, headers=headers)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Compara o cabeçalho If-None-Match com o ETag atual (comparação fraca, aceita '*' e listas)."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
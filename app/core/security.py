@@ -3,20 +3,38 @@ from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from .. import models, schemas
 from .config import settings
-from .database import get_db
+from .database import SessionLocal, get_db, get_async_db
+from .principal_cache import principal_cache
+from . import hashing
+from .hashing import HashingPoolFull, hashing_pool
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
+# Conexões de eventos: o token também pode vir na query string (EventSource e WebSocket não enviam cabeçalhos)
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login", auto_error=False)
+
+def _run_hashing(fn, *args):
+    try:
+        return hashing_pool.run(fn, *args)
+    except HashingPoolFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service is busy, please retry.",
+            headers={"Retry-After": str(settings.PASSWORD_HASH_RETRY_AFTER_SECONDS)},
+        )
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return verify_and_update_password(plain_password, hashed_password)[0]
+
+def verify_and_update_password(plain_password, hashed_password):
+    """Verifica a senha no pool de hashing; devolve (ok, novo_hash ou None)."""
+    return _run_hashing(hashing.verify_and_update, plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return _run_hashing(hashing.hash_password, password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -28,21 +46,92 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
+def principal_claims(user: models.User) -> dict:
+    # Claims do token de acesso; com JWT_PRINCIPAL_CLAIMS, id e KYC seguem assinados no próprio token
+    claims = {"sub": user.email}
+    if settings.JWT_PRINCIPAL_CLAIMS:
+        claims.update({"uid": user.id, "kyc": user.kyc_status.value})
+    return claims
+
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def _decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
-    
+        raise _credentials_exception()
+    if payload.get("sub") is None:
+        raise _credentials_exception()
+    return payload
+
+def _load_user(db: Session, email: str):
+    # Usuário em cache: reanexado à sessão sem consultar o banco
+    if settings.PRINCIPAL_CACHE_ENABLED:
+        cached = principal_cache.get(email)
+        if cached is not None:
+            return db.merge(cached, load=False)
+
     user = db.query(models.User).filter(models.User.email == email).first()
     if user is None:
-        raise credentials_exception
-    return user
\ No newline at end of file
+        raise _credentials_exception()
+    if settings.PRINCIPAL_CACHE_ENABLED:
+        principal_cache.put(email, user)
+    return user
+
+def _authenticate(db: Session, token: str):
+    return _load_user(db, _decode_token(token)["sub"])
+
+def _principal(db: Session, token: str) -> schemas.Principal:
+    payload = _decode_token(token)
+    if payload.get("uid") is not None and payload.get("kyc") is not None:
+        return schemas.Principal(id=payload["uid"], email=payload["sub"], kyc_status=payload["kyc"])
+    user = _load_user(db, payload["sub"])
+    return schemas.Principal(id=user.id, email=user.email, kyc_status=user.kyc_status)
+
+def invalidate_user(email: str):
+    """Descarta o usuário do cache local; chamar sempre que os dados do usuário mudarem."""
+    principal_cache.invalidate(email)
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    return _authenticate(db, token)
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    # Mesma resolução do modo síncrono, executada sobre a sessão assíncrona da requisição
+    return await db.run_sync(_authenticate, token)
+
+def get_current_principal(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> schemas.Principal:
+    """
+    Identidade resumida (id, email, KYC) para rotas somente leitura. Com claims no token não acessa
+    o banco; sem elas, usa o mesmo caminho (e cache) de get_current_user.
+    """
+    return _principal(db, token)
+
+async def get_current_principal_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> schemas.Principal:
+    payload = _decode_token(token)
+    if payload.get("uid") is not None and payload.get("kyc") is not None:
+        return schemas.Principal(id=payload["uid"], email=payload["sub"], kyc_status=payload["kyc"])
+    return await db.run_sync(_principal, token)
+
+def principal_from_token(token: Optional[str]) -> schemas.Principal:
+    """
+    Identidade de conexões longas (eventos): sem sessão presa à requisição, usa uma sessão curta só
+    quando o token não traz as claims do usuário.
+    """
+    if not token:
+        raise _credentials_exception()
+    db = SessionLocal()
+    try:
+        return _principal(db, token)
+    finally:
+        db.close()
+
+def get_admin_principal(principal: schemas.Principal = Depends(get_current_principal)) -> schemas.Principal:
+    """Rotas operacionais (/internal): mesmo critério das rotas de /admin (só o usuário 1)."""
+    if principal.id != 1:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+    return principal
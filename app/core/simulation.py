@@ -0,0 +1,236 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Hashable, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import BigInteger, Integer, cast, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.util.concurrency import await_only, in_greenlet
+from .. import models
+from .amortization import from_cents
+from .config import settings
+
+# Simulação da carteira de um credor: as parcelas em aberto dos empréstimos ATIVOS viram uma matriz
+# empréstimo x mês (em centavos) e todo o cálculo é vetorizado com NumPy.
+# - Mês 0 é o mês corrente; parcelas em atraso entram no mês 0.
+# - Cada empréstimo tem um risco mensal de default constante (hazard), derivado do score_credito do
+#   mutuário. Com default no mês k, as parcelas a partir de k não são pagas; 'recovery_rate' é a fração
+#   recuperada do que deixou de ser pago.
+# - O fluxo esperado pondera cada parcela pela probabilidade de o empréstimo ainda estar adimplente.
+# - Monte Carlo: o mês de default de cada empréstimo em cada cenário é sorteado diretamente da
+#   distribuição geométrica; o valor recebido até o default vem da soma acumulada por empréstimo.
+
+# PD anual = MAX_ANNUAL_DEFAULT / (1 + exp((score - SCORE_MIDPOINT) / SCORE_SCALE)):
+# ~50% para score 0, 25% para 500, ~0,3% para 1000
+MAX_ANNUAL_DEFAULT = 0.5
+SCORE_MIDPOINT = 500.0
+SCORE_SCALE = 100.0
+# Elementos (cenários x empréstimos) sorteados por bloco do Monte Carlo: limita a memória do cálculo
+MONTE_CARLO_BLOCK = 4_000_000
+PERCENTILES = (1, 5, 50, 95, 99)
+
+
+def monthly_default_hazard(scores: np.ndarray) -> np.ndarray:
+    annual = MAX_ANNUAL_DEFAULT / (1 + np.exp((np.asarray(scores, dtype=np.float64) - SCORE_MIDPOINT) / SCORE_SCALE))
+    return -np.expm1(np.log1p(-annual) / 12)
+
+
+@dataclass(frozen=True)
+class LoanBook:
+    start_month: date
+    # Fluxo em aberto por empréstimo e mês, em centavos: shape (empréstimos, meses)
+    cashflows: np.ndarray
+    # Principal em aberto (exposição) e score do mutuário, por empréstimo
+    principal: np.ndarray
+    scores: np.ndarray
+
+    @property
+    def loans(self) -> int:
+        return self.cashflows.shape[0]
+
+    @property
+    def months(self) -> int:
+        return self.cashflows.shape[1]
+
+
+def load_book(db: Session, lender_id: int, today: Optional[date] = None) -> LoanBook:
+    """Carrega em uma única consulta as parcelas em aberto dos empréstimos ATIVOS do credor."""
+    start_month = (today or date.today()).replace(day=1)
+    loans, installments, users = models.Loan.__table__, models.Installment.__table__, models.User.__table__
+    month_number = cast(
+        func.extract("year", installments.c.due_date) * 12 + func.extract("month", installments.c.due_date), Integer
+    )
+    rows = db.execute(
+        select(
+            installments.c.loan_id,
+            month_number - (start_month.year * 12 + start_month.month),
+            cast(installments.c.amount * 100, BigInteger),
+            cast(installments.c.principal_amount * 100, BigInteger),
+            users.c.score_credito,
+        )
+        .select_from(
+            installments.join(loans, loans.c.id == installments.c.loan_id).join(users, users.c.id == loans.c.borrower_id)
+        )
+        .where(
+            loans.c.lender_id == lender_id,
+            loans.c.status == models.LoanStatus.ACTIVE,
+            installments.c.status.is_distinct_from(models.InstallmentStatus.PAID),
+        )
+    ).all()
+    if not rows:
+        empty = np.zeros(0, dtype=np.float64)
+        return LoanBook(start_month, np.zeros((0, 1), dtype=np.float64), empty, empty)
+
+    loan_ids, months, amounts, principal, scores = (np.asarray(column) for column in zip(*rows))
+    loan_ids, loan_index = np.unique(loan_ids, return_inverse=True)
+    months = np.maximum(months.astype(np.int64), 0)
+    width = int(months.max()) + 1
+    cashflows = np.bincount(
+        loan_index * width + months, weights=amounts.astype(np.float64), minlength=len(loan_ids) * width
+    ).reshape(len(loan_ids), width)
+    loan_principal = np.bincount(loan_index, weights=principal.astype(np.float64), minlength=len(loan_ids))
+    loan_scores = np.zeros(len(loan_ids), dtype=np.float64)
+    loan_scores[loan_index] = scores.astype(np.float64)
+    return LoanBook(start_month, cashflows, loan_principal, loan_scores)
+
+
+def annual_irr(cashflows: np.ndarray, present_value: float, iterations: int = 100) -> np.ndarray:
+    """
+    TIR anual de cada linha de 'cashflows' (shape (séries, meses), fluxo do mês m a m meses de hoje)
+    contra o valor presente informado, por bisseção vetorizada na taxa mensal.
+    """
+    cashflows = np.atleast_2d(cashflows)
+    if present_value <= 0 or cashflows.shape[1] == 0:
+        return np.full(cashflows.shape[0], np.nan)
+    periods = np.arange(cashflows.shape[1])
+    low = np.full(cashflows.shape[0], -0.99)
+    high = np.full(cashflows.shape[0], 1.0)
+    for _ in range(iterations):
+        rate = (low + high) / 2
+        npv = (cashflows / (1 + rate[:, None]) ** periods).sum(axis=1) - present_value
+        # VPL positivo: a taxa ainda é baixa
+        low = np.where(npv > 0, rate, low)
+        high = np.where(npv > 0, high, rate)
+    return (1 + (low + high) / 2) ** 12 - 1
+
+
+@dataclass(frozen=True)
+class SimulationResult:
+    book: LoanBook
+    paths: int
+    exposure: float
+    scheduled_total: float
+    scheduled_by_month: np.ndarray
+    expected_by_month: np.ndarray
+    scheduled_irr: Optional[float]
+    expected_irr: Optional[float]
+    # Valor recebido (centavos) em cada cenário
+    received: np.ndarray
+
+    @property
+    def expected_loss(self) -> float:
+        return self.scheduled_total - float(self.received.mean())
+
+    def cashflow(self) -> List[Tuple[date, float, float]]:
+        """(mês, valor contratado, valor esperado) dos meses com parcelas em aberto, em centavos."""
+        months = (np.datetime64(self.book.start_month, "M") + np.arange(self.book.months)).astype("datetime64[D]")
+        return [
+            (month, scheduled, expected)
+            for month, scheduled, expected in zip(
+                months.tolist(), self.scheduled_by_month.tolist(), self.expected_by_month.tolist()
+            )
+            if scheduled > 0
+        ]
+
+    def return_stats(self) -> Dict[str, float]:
+        """Média, desvio, percentis e probabilidade de perda do retorno total (recebido / principal - 1)."""
+        returns = self.received / self.exposure - 1 if self.exposure > 0 else np.zeros_like(self.received)
+        stats = {"mean": float(returns.mean()), "std": float(returns.std())}
+        stats.update(zip((f"p{p}" for p in PERCENTILES), np.percentile(returns, PERCENTILES).tolist()))
+        stats["probability_of_loss"] = float((returns < 0).mean())
+        return stats
+
+
+def simulate(book: LoanBook, paths: int, recovery_rate: float = 0.0, seed=None) -> SimulationResult:
+    """Fluxo contratado e esperado por mês, TIRs e 'paths' cenários de default. 'seed' vai para default_rng."""
+    hazard = monthly_default_hazard(book.scores)
+    months = book.months
+    survival = (1 - hazard)[:, None] ** np.arange(1, months + 1)
+    scheduled_by_month = book.cashflows.sum(axis=0)
+    expected_by_month = (book.cashflows * (survival + recovery_rate * (1 - survival))).sum(axis=0)
+    exposure = float(book.principal.sum())
+    irr = annual_irr(np.vstack([scheduled_by_month, expected_by_month]), exposure)
+
+    # received_before[i, k]: quanto o empréstimo i paga antes de um default no mês k (k = months: sem default)
+    received_before = np.zeros((book.loans, months + 1))
+    np.cumsum(book.cashflows, axis=1, out=received_before[:, 1:])
+    flat = received_before.ravel()
+    offsets = np.arange(book.loans) * (months + 1)
+    scheduled_total = float(scheduled_by_month.sum())
+    log_survival = np.log1p(-hazard).astype(np.float32)
+
+    rng = np.random.default_rng(seed)
+    received = np.empty(paths)
+    block = max(1, MONTE_CARLO_BLOCK // max(book.loans, 1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for start in range(0, paths, block):
+            count = min(block, paths - start)
+            # Mês do default ~ geométrica: P(default_month >= k) = (1 - hazard) ** k
+            default_month = np.log(rng.random((count, book.loans), dtype=np.float32)) / log_survival
+            np.clip(default_month, 0, months, out=default_month)
+            paid = flat[default_month.astype(np.int64) + offsets].sum(axis=1)
+            received[start:start + count] = paid + recovery_rate * (scheduled_total - paid)
+
+    return SimulationResult(
+        book=book, paths=paths, exposure=exposure, scheduled_total=scheduled_total,
+        scheduled_by_month=scheduled_by_month, expected_by_month=expected_by_month,
+        scheduled_irr=None if np.isnan(irr[0]) else float(irr[0]),
+        expected_irr=None if np.isnan(irr[1]) else float(irr[1]),
+        received=received,
+    )
+
+
+class SimulationCache:
+    """Cache LRU (por processo) de resultados; a chave inclui a versão da carteira (lender_portfolios.version)."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: "OrderedDict[Hashable, object]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+simulation_cache = SimulationCache(max_size=settings.PORTFOLIO_SIMULATION_CACHE_SIZE)
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="portfolio-simulation")
+
+def run(fn, *args):
+    """
+    Executa um cálculo pesado. No modo assíncrono (AsyncSession.run_sync) o corpo do endpoint roda no
+    event loop, então o cálculo vai para uma thread dedicada; no modo síncrono já estamos no thread pool.
+    """
+    if in_greenlet():
+        return await_only(asyncio.wrap_future(_executor.submit(fn, *args)))
+    return fn(*args)
+
+
+def money(cents: float) -> Decimal:
+    return from_cents(int(round(cents)))
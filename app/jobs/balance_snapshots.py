@@ -0,0 +1,161 @@
+"""
+Fechamentos diários de saldo (account_balance_snapshots).
+
+Para cada conta e cada dia com movimento no ledger: total de créditos, total de débitos e saldo ao fim do
+dia, pelas regras de ledger.signed_amount. O job é incremental: a marca d'água (job_watermarks) guarda o
+último dia consolidado e cada execução só lê as linhas do ledger dos dias seguintes (a leitura por
+timestamp_utc alcança só as partições desses dias). O saldo de fechamento continua do último fechamento
+anterior da conta ou, na primeira vez, do saldo das partições já arquivadas.
+
+Um dia só é consolidado BALANCE_SNAPSHOT_GRACE_MINUTES depois de terminar, e a marca d'água avança no
+mesmo commit dos fechamentos de cada lote de dias. Reprocessar um dia (ex.: --since) sobrescreve os
+seus fechamentos.
+
+Uso: python -m app.jobs.balance_snapshots [--until AAAA-MM-DD] [--since AAAA-MM-DD] [--days-per-batch N]
+"""
+import argparse
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Optional
+from sqlalchemy import Date, case, cast, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Connection
+from .. import models
+from ..core import ledger
+from ..core.config import settings
+from ..core.database import engine
+from .overdue_sweeper import PeriodicSweeper, _set_watermark, _watermark
+
+# Chave do pg_try_advisory_lock: uma consolidação por vez entre todos os workers e o CLI
+ADVISORY_LOCK_KEY = 7_310_013
+
+
+@dataclass
+class SnapshotResult:
+    days: int = 0
+    snapshots: int = 0
+    # Último dia consolidado depois da execução
+    consolidated: Optional[date] = None
+    # True quando outra consolidação já estava em andamento
+    skipped: bool = False
+
+
+def _roll_up(conn: Connection, first: date, last: date) -> int:
+    """Grava os fechamentos dos dias [first, last] num único comando. Devolve o número de fechamentos."""
+    tx = models.Transaction.__table__
+    snapshots, archived = models.AccountBalanceSnapshot.__table__, models.AccountArchivedBalance.__table__
+    effects = ledger.balance_effects(
+        tx,
+        tx.c.timestamp_utc >= datetime.combine(first, datetime.min.time()),
+        tx.c.timestamp_utc < datetime.combine(last + timedelta(days=1), datetime.min.time()),
+        ledger.unarchived(tx.c.timestamp_utc),
+    )
+    day = cast(effects.c.timestamp_utc, Date)
+    daily = (
+        select(
+            effects.c.account_id,
+            day.label("day"),
+            func.sum(case((effects.c.amount > 0, effects.c.amount), else_=0)).label("credit_total"),
+            func.sum(case((effects.c.amount < 0, -effects.c.amount), else_=0)).label("debit_total"),
+            func.sum(effects.c.amount).label("net_amount"),
+        )
+        .group_by(effects.c.account_id, day)
+        .cte("daily")
+    )
+    previous = (
+        select(snapshots.c.closing_balance)
+        .where(snapshots.c.account_id == daily.c.account_id, snapshots.c.day < first)
+        .order_by(snapshots.c.day.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    carried = select(archived.c.net_amount).where(archived.c.account_id == daily.c.account_id).scalar_subquery()
+    closing = func.coalesce(previous, carried, 0) + func.sum(daily.c.net_amount).over(
+        partition_by=daily.c.account_id, order_by=daily.c.day,
+    )
+    rows = select(daily.c.account_id, daily.c.day, daily.c.credit_total, daily.c.debit_total, closing)
+    upsert = insert(snapshots).from_select(["account_id", "day", "credit_total", "debit_total", "closing_balance"], rows)
+    return conn.execute(upsert.on_conflict_do_update(
+        index_elements=[snapshots.c.account_id, snapshots.c.day],
+        set_={
+            "credit_total": upsert.excluded.credit_total,
+            "debit_total": upsert.excluded.debit_total,
+            "closing_balance": upsert.excluded.closing_balance,
+        },
+    )).rowcount
+
+def run(until: Optional[date] = None, since: Optional[date] = None, days_per_batch: Optional[int] = None) -> SnapshotResult:
+    """
+    Consolida os dias seguintes à marca d'água até 'until' (padrão: o último dia encerrado há mais de
+    BALANCE_SNAPSHOT_GRACE_MINUTES). 'since' força o reprocessamento a partir de um dia.
+    """
+    days_per_batch = days_per_batch or settings.BALANCE_SNAPSHOT_DAYS_PER_BATCH
+    tx = models.Transaction.__table__
+
+    # Conexão dedicada: o advisory lock é de sessão e precisa sobreviver aos commits de cada lote
+    with engine.connect() as conn:
+        if not conn.execute(select(func.pg_try_advisory_lock(ADVISORY_LOCK_KEY))).scalar():
+            conn.rollback()
+            return SnapshotResult(skipped=True)
+        try:
+            if until is None:
+                # Relógio do banco, o mesmo que preenche timestamp_utc
+                now = conn.execute(select(func.localtimestamp())).scalar()
+                until = (now - timedelta(minutes=settings.BALANCE_SNAPSHOT_GRACE_MINUTES)).date() - timedelta(days=1)
+            consolidated = _watermark(conn, ledger.SNAPSHOT_WATERMARK)
+            if since is not None:
+                first = since
+            elif consolidated is not None:
+                first = consolidated + timedelta(days=1)
+            else:
+                # Primeira execução: desde a linha mais antiga ainda no ledger
+                oldest = conn.execute(select(func.min(tx.c.timestamp_utc))).scalar()
+                first = oldest.date() if oldest else until + timedelta(days=1)
+
+            result = SnapshotResult(consolidated=consolidated)
+            while first <= until:
+                last = min(until, first + timedelta(days=days_per_batch - 1))
+                result.snapshots += _roll_up(conn, first, last)
+                # Os fechamentos e a nova marca d'água entram no mesmo commit
+                _set_watermark(conn, ledger.SNAPSHOT_WATERMARK, last)
+                result.days += (last - first).days + 1
+                result.consolidated = last
+                first = last + timedelta(days=1)
+            if result.consolidated is None:
+                # Ledger vazio: nada a consolidar até 'until'
+                _set_watermark(conn, ledger.SNAPSHOT_WATERMARK, until)
+                result.consolidated = until
+            return result
+        finally:
+            conn.rollback()
+            conn.execute(select(func.pg_advisory_unlock(ADVISORY_LOCK_KEY)))
+            conn.commit()
+
+
+periodic_snapshots = PeriodicSweeper(
+    interval=settings.BALANCE_SNAPSHOT_INTERVAL_SECONDS, job=run, name="balance-snapshots",
+    label="consolidação dos fechamentos diários",
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Consolida os fechamentos diários de saldo das contas.")
+    parser.add_argument("--until", type=date.fromisoformat, default=None, help="Último dia a consolidar (AAAA-MM-DD)")
+    parser.add_argument("--since", type=date.fromisoformat, default=None, help="Reprocessa a partir deste dia (AAAA-MM-DD)")
+    parser.add_argument("--days-per-batch", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    started = time.monotonic()
+    result = run(until=args.until, since=args.since, days_per_batch=args.days_per_batch)
+    if result.skipped:
+        print("Outra consolidação já está em andamento; nada a fazer.")
+        return
+    print(
+        f"Dias consolidados: {result.days}; fechamentos gravados: {result.snapshots}; "
+        f"marca d'água: {result.consolidated} ({time.monotonic() - started:.2f}s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Manutenção das partições mensais do ledger (transactions, particionada por RANGE de timestamp_utc).
+
+ensure: cria as partições do mês corrente até --months-ahead meses à frente. Cada partição é criada
+como tabela avulsa e anexada com ATTACH PARTITION, que no ledger toma só SHARE UPDATE EXCLUSIVE (leituras
+e escritas seguem). Por causa da partição DEFAULT, porém, o ATTACH toma ACCESS EXCLUSIVE em
+transactions_default e a varre para confirmar que nenhuma linha dela pertence ao novo mês: as escritas
+que cairiam na DEFAULT esperam, e a varredura é curta enquanto ela ficar vazia. Linhas que tenham caído
+na DEFAULT (meses que ainda não existiam) são movidas para a partição do mês antes do ATTACH.
+
+archive: arquiva as partições mais antigas, inteiramente anteriores a --older-than-months meses, da
+mais antiga para a mais nova, em três passos, cada um retomado pela execução seguinte se interrompido:
+1. Com a partição ainda anexada (e só ela travada contra escritas), numa transação própria, o efeito
+   das suas linhas no saldo de cada conta é somado em account_archived_balances e a partição é
+   registrada em transaction_archives com o número de linhas. A partir daí o corte do arquivamento
+   inclui o mês e as consultas que partem do saldo arquivado ignoram as linhas dele
+   (ledger.unarchived), então o saldo não é contado duas vezes até o DETACH.
+2. DETACH PARTITION numa transação curta com lock_timeout: o ACCESS EXCLUSIVE no ledger dura só a
+   alteração do catálogo. (DETACH ... CONCURRENTLY não é permitido com uma partição DEFAULT.)
+3. A partição é exportada para <dir>/<partição>.csv.gz, o arquivo é registrado em transaction_archives
+   (SHA-256) e a tabela é removida (--keep-tables a mantém desanexada).
+
+Uso:
+    python -m app.jobs.ledger_partitions ensure [--months-ahead N]
+    python -m app.jobs.ledger_partitions archive [--older-than-months N] [--dir DIR] [--keep-tables]
+"""
+import argparse
+import gzip
+import hashlib
+import os
+import re
+import time
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import List, Optional
+from sqlalchemy import column, func, select, table, text, update
+from sqlalchemy.dialects.postgresql import insert
+from .. import models
+from ..core import ledger
+from ..core.config import settings
+from ..core.database import engine
+
+PARENT = models.Transaction.__tablename__
+DEFAULT_PARTITION = f"{PARENT}_default"
+PARTITION_NAME = re.compile(rf"^{PARENT}_p(\d{{4}})_(\d{{2}})$")
+_BOUNDS = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def is_partition_name(name: str) -> bool:
+    """Tabelas gerenciadas por este job (ignoradas pelo autogenerate do Alembic)."""
+    return name == DEFAULT_PARTITION or PARTITION_NAME.match(name) is not None
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month: date) -> str:
+    return f"{PARENT}_p{month:%Y_%m}"
+
+
+@dataclass(frozen=True)
+class Partition:
+    name: str
+    start: datetime
+    end: datetime
+
+
+def list_partitions(conn) -> List[Partition]:
+    """Partições mensais anexadas ao ledger, da mais antiga para a mais nova (sem a DEFAULT)."""
+    rows = conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = CAST(:parent AS regclass)"
+    ), {"parent": PARENT}).all()
+    partitions = []
+    for name, bound in rows:
+        match = _BOUNDS.search(bound)
+        if match:
+            partitions.append(Partition(name, datetime.fromisoformat(match.group(1)), datetime.fromisoformat(match.group(2))))
+    return sorted(partitions, key=lambda partition: partition.start)
+
+
+def ensure(months_ahead: Optional[int] = None, today: Optional[date] = None) -> List[str]:
+    """Cria as partições que faltam do mês corrente até 'months_ahead' meses à frente. Devolve as criadas."""
+    months_ahead = settings.LEDGER_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    current = (today or date.today()).replace(day=1)
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        start, end = datetime.combine(month, datetime.min.time()), datetime.combine(add_months(month, 1), datetime.min.time())
+        name = partition_name(month)
+        with engine.begin() as conn:
+            if any(partition.name == name for partition in list_partitions(conn)):
+                continue
+            bounds = {"start": start, "end": end}
+            conn.execute(text(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+            # Linhas do mês que caíram na DEFAULT vão para a nova partição antes do ATTACH
+            conn.execute(text(
+                f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE timestamp_utc >= :start AND timestamp_utc < :end "
+                f"RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+            ), bounds)
+            # O CHECK equivalente ao intervalo dispensa a varredura de validação do ATTACH
+            conn.execute(text(
+                f"ALTER TABLE {name} ADD CONSTRAINT {name}_range "
+                f"CHECK (timestamp_utc >= '{start}' AND timestamp_utc < '{end}')"
+            ))
+            conn.execute(text(f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"))
+            conn.execute(text(f"ALTER TABLE {name} DROP CONSTRAINT {name}_range"))
+        created.append(name)
+    return created
+
+
+def _stage(partition: Partition) -> int:
+    """Soma o efeito da partição (ainda anexada) nos saldos arquivados e a registra. Devolve o número de linhas."""
+    archives, balances = models.TransactionArchive.__table__, models.AccountArchivedBalance.__table__
+    with engine.begin() as conn:
+        # Trava só a partição (o mês já encerrado) contra escritas enquanto é somada; o ledger segue livre
+        conn.execute(text(f"LOCK TABLE {partition.name} IN SHARE MODE"))
+        rows = table(partition.name, *(column(c.name, c.type) for c in models.Transaction.__table__.c))
+        # O registro em transaction_archives (chave: nome da partição) marca a soma como feita
+        row_count = conn.execute(select(func.count()).select_from(rows)).scalar()
+        conn.execute(insert(archives).values(
+            partition_name=partition.name, range_start=partition.start, range_end=partition.end, row_count=row_count,
+        ))
+        totals = ledger.net_amounts_by_account(rows)
+        upsert = insert(balances).from_select(["account_id", "net_amount"], totals)
+        conn.execute(upsert.on_conflict_do_update(
+            index_elements=[balances.c.account_id],
+            set_={"net_amount": balances.c.net_amount + upsert.excluded.net_amount},
+        ))
+    return row_count
+
+
+def _detach(name: str):
+    archives = models.TransactionArchive.__table__
+    with engine.begin() as conn:
+        conn.execute(text("SELECT set_config('lock_timeout', :timeout, true)"), {
+            "timeout": f"{int(settings.LEDGER_DETACH_LOCK_TIMEOUT_SECONDS * 1000)}ms",
+        })
+        if any(partition.name == name for partition in list_partitions(conn)):
+            conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+        conn.execute(update(archives).where(archives.c.partition_name == name).values(detached_at=func.now()))
+
+
+def _export(name: str, directory: str, keep_table: bool) -> str:
+    archives = models.TransactionArchive.__table__
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.csv.gz")
+    partial = path + ".partial"
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cursor, gzip.open(partial, "wb") as output:
+            cursor.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", output)
+        raw.commit()
+    finally:
+        raw.close()
+    digest = hashlib.sha256()
+    with open(partial, "rb") as written:
+        for chunk in iter(lambda: written.read(1 << 20), b""):
+            digest.update(chunk)
+    os.replace(partial, path)
+    with engine.begin() as conn:
+        conn.execute(
+            update(archives).where(archives.c.partition_name == name)
+            .values(file_path=path, sha256=digest.hexdigest(), exported_at=func.now())
+        )
+        if not keep_table:
+            conn.execute(text(f"DROP TABLE {name}"))
+    return path
+
+
+def archive(
+    older_than_months: Optional[int] = None, directory: Optional[str] = None, keep_tables: bool = False,
+    today: Optional[date] = None,
+) -> List[str]:
+    """Arquiva (soma, desanexa e exporta) as partições anteriores ao corte. Devolve os arquivos gerados."""
+    older_than_months = settings.LEDGER_ARCHIVE_AFTER_MONTHS if older_than_months is None else older_than_months
+    directory = directory or settings.LEDGER_ARCHIVE_DIR
+    cutoff = datetime.combine(add_months((today or date.today()).replace(day=1), -older_than_months), datetime.min.time())
+    archives = models.TransactionArchive.__table__
+
+    with engine.connect() as conn:
+        staged = set(conn.execute(select(archives.c.partition_name)).scalars())
+        eligible = [partition for partition in list_partitions(conn) if partition.end <= cutoff]
+    for partition in eligible:
+        if partition.name not in staged:
+            row_count = _stage(partition)
+            print(f"Partição {partition.name} somada aos saldos arquivados ({row_count} linhas)")
+
+    # Desanexa as partições já somadas (inclui as de execuções interrompidas antes do DETACH)
+    with engine.connect() as conn:
+        attached = conn.execute(
+            select(archives.c.partition_name).where(archives.c.detached_at.is_(None)).order_by(archives.c.range_start)
+        ).scalars().all()
+    for name in attached:
+        _detach(name)
+        print(f"Partição {name} desanexada")
+
+    # Exporta tudo o que foi desanexado e ainda não tem arquivo (inclui execuções interrompidas)
+    with engine.connect() as conn:
+        pending = conn.execute(
+            select(archives.c.partition_name)
+            .where(archives.c.detached_at.is_not(None), archives.c.exported_at.is_(None))
+            .order_by(archives.c.range_start)
+        ).scalars().all()
+    return [_export(name, directory, keep_tables) for name in pending]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manutenção das partições mensais do ledger.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ensure_parser = commands.add_parser("ensure", help="Cria as partições dos próximos meses")
+    ensure_parser.add_argument("--months-ahead", type=int, default=None)
+    archive_parser = commands.add_parser("archive", help="Desanexa e exporta as partições antigas")
+    archive_parser.add_argument("--older-than-months", type=int, default=None)
+    archive_parser.add_argument("--dir", dest="directory", default=None, help="Diretório dos arquivos .csv.gz")
+    archive_parser.add_argument("--keep-tables", action="store_true", help="Mantém as tabelas desanexadas")
+    args = parser.parse_args(argv)
+
+    started = time.monotonic()
+    if args.command == "ensure":
+        created = ensure(args.months_ahead)
+        print(f"Partições criadas: {', '.join(created) or 'nenhuma'} ({time.monotonic() - started:.2f}s)")
+    else:
+        files = archive(args.older_than_months, args.directory, args.keep_tables)
+        print(f"Partições arquivadas: {len(files)} ({time.monotonic() - started:.2f}s)")
+        for path in files:
+            print(f"  {path}")
+
+
+if __name__ == "__main__":
+    main()
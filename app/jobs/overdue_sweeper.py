@@ -0,0 +1,186 @@
+"""
+Varredura de inadimplência.
+
+- Parcelas PENDENTES com vencimento anterior a hoje passam para ATRASO (InstallmentStatus.OVERDUE).
+- Empréstimos ATIVOS cuja próxima parcela em aberto (Loan.next_due_date) venceu há mais de
+  LOAN_DEFAULT_GRACE_DAYS dias passam para DEFAULT.
+- Os agregados das carteiras dos credores (lender_portfolios: atraso, principal em DEFAULT e versão) são
+  atualizados no mesmo comando.
+
+Cada etapa atualiza lotes de OVERDUE_SWEEP_BATCH_SIZE linhas com SELECT ... FOR UPDATE SKIP LOCKED e
+commit por lote: linhas bloqueadas por um pagamento em andamento são puladas, sem esperar. A marca
+d'água (job_watermarks) guarda a última data de corte processada; cada execução só olha o intervalo
+(marca d'água, corte] e só avança a marca se nenhuma linha do intervalo ficou para trás.
+
+Uso: python -m app.jobs.overdue_sweeper [--today AAAA-MM-DD] [--batch-size N] [--grace-days D]
+"""
+import argparse
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Callable, Optional
+from sqlalchemy import exists, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql.selectable import CTE
+from .. import models
+from ..core import portfolio
+from ..core.config import settings
+from ..core.database import engine
+
+INSTALLMENTS_JOB = "overdue_installments"
+LOANS_JOB = "default_loans"
+# Chave do pg_try_advisory_lock: uma única varredura por vez entre todos os workers e o CLI
+ADVISORY_LOCK_KEY = 7_310_012
+
+
+@dataclass
+class SweepResult:
+    installments_overdue: int = 0
+    loans_defaulted: int = 0
+    # True quando outra varredura já estava em andamento
+    skipped: bool = False
+
+
+def _watermark(conn: Connection, name: str) -> Optional[date]:
+    watermarks = models.JobWatermark.__table__
+    return conn.execute(select(watermarks.c.watermark_date).where(watermarks.c.name == name)).scalar()
+
+def _set_watermark(conn: Connection, name: str, value: date):
+    watermarks = models.JobWatermark.__table__
+    statement = insert(watermarks).values(name=name, watermark_date=value, updated_at=func.now())
+    conn.execute(statement.on_conflict_do_update(
+        index_elements=[watermarks.c.name],
+        set_={"watermark_date": value, "updated_at": func.now()},
+    ))
+    conn.commit()
+
+def _sweep(
+    conn: Connection, name: str, table, date_column, pending, new_status, cutoff: date, batch_size: int,
+    on_update: Optional[Callable[[CTE], CTE]] = None,
+) -> int:
+    """
+    Atualiza em lotes as linhas 'pending' com date_column no intervalo (marca d'água, cutoff].
+    'on_update', se informado, recebe as linhas atualizadas de cada lote (UPDATE ... RETURNING) e devolve
+    um CTE executado no mesmo comando (ex.: agregados que dependem das linhas alteradas).
+    """
+    since = _watermark(conn, name)
+    if since is not None and since >= cutoff:
+        return 0
+    in_window = [pending, date_column <= cutoff]
+    if since is not None:
+        in_window.append(date_column > since)
+
+    total = 0
+    while True:
+        batch = (
+            select(table.c.id).where(*in_window)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .cte("batch")
+        )
+        statement = update(table).where(table.c.id == batch.c.id).values(status=new_status)
+        if on_update is None:
+            updated = conn.execute(statement).rowcount
+        else:
+            rows = statement.returning(*table.c).cte("updated")
+            updated = conn.execute(select(func.count()).select_from(rows).add_cte(on_update(rows))).scalar()
+        conn.commit()
+        total += updated
+        if updated < batch_size:
+            break
+
+    # Linhas puladas por estarem bloqueadas continuam no intervalo: a marca d'água só avança sem pendências
+    if not conn.execute(select(exists().where(*in_window))).scalar():
+        _set_watermark(conn, name, cutoff)
+    return total
+
+def sweep(today: Optional[date] = None, batch_size: Optional[int] = None, grace_days: Optional[int] = None) -> SweepResult:
+    today = today or date.today()
+    batch_size = batch_size or settings.OVERDUE_SWEEP_BATCH_SIZE
+    grace_days = settings.LOAN_DEFAULT_GRACE_DAYS if grace_days is None else grace_days
+    installments, loans = models.Installment.__table__, models.Loan.__table__
+
+    # Conexão dedicada: o advisory lock é de sessão e precisa sobreviver aos commits de cada lote
+    with engine.connect() as conn:
+        if not conn.execute(select(func.pg_try_advisory_lock(ADVISORY_LOCK_KEY))).scalar():
+            conn.rollback()
+            return SweepResult(skipped=True)
+        try:
+            result = SweepResult()
+            result.installments_overdue = _sweep(
+                conn, INSTALLMENTS_JOB, installments, installments.c.due_date,
+                installments.c.status == models.InstallmentStatus.PENDING, models.InstallmentStatus.OVERDUE,
+                cutoff=today - timedelta(days=1), batch_size=batch_size, on_update=portfolio.overdue_update,
+            )
+            result.loans_defaulted = _sweep(
+                conn, LOANS_JOB, loans, loans.c.next_due_date,
+                loans.c.status == models.LoanStatus.ACTIVE, models.LoanStatus.DEFAULT,
+                cutoff=today - timedelta(days=grace_days + 1), batch_size=batch_size, on_update=portfolio.default_update,
+            )
+            return result
+        finally:
+            conn.rollback()
+            conn.execute(select(func.pg_advisory_unlock(ADVISORY_LOCK_KEY)))
+            conn.commit()
+
+
+class PeriodicSweeper:
+    """Executa 'job' (por padrão, sweep()) em uma thread daemon a cada 'interval' segundos (a primeira execução é imediata)."""
+
+    def __init__(self, interval: float, job: Callable = sweep, name: str = "overdue-sweeper", label: str = "varredura de inadimplência"):
+        self.interval = interval
+        self.job = job
+        self.name = name
+        self.label = label
+        self.last_result = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.last_result = self.job()
+            except Exception as e:
+                print(f"Erro na {self.label}: {e}")
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+
+periodic_sweeper = PeriodicSweeper(interval=settings.OVERDUE_SWEEP_INTERVAL_SECONDS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Marca parcelas em atraso e empréstimos em default.")
+    parser.add_argument("--today", type=date.fromisoformat, default=None, help="Data de referência (AAAA-MM-DD)")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--grace-days", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    started = time.monotonic()
+    result = sweep(today=args.today, batch_size=args.batch_size, grace_days=args.grace_days)
+    if result.skipped:
+        print("Outra varredura já está em andamento; nada a fazer.")
+        return
+    print(
+        f"Parcelas em atraso: {result.installments_overdue}; empréstimos em default: {result.loans_defaulted} "
+        f"({time.monotonic() - started:.2f}s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
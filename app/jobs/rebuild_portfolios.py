@@ -0,0 +1,119 @@
+"""
+Recalcula os agregados das carteiras dos credores (lender_portfolios e lender_cashflows) a partir de
+loans e installments. Em operação normal os agregados são mantidos incrementalmente
+(app/core/portfolio.py); este comando serve para backfills e para corrigir divergências.
+
+As duas tabelas ficam bloqueadas para escrita (SHARE ROW EXCLUSIVE) durante o recálculo: aceites,
+pagamentos e a varredura de inadimplência concorrentes esperam e aplicam os seus incrementos sobre os
+valores recalculados. Leituras (GET /loan/portfolio) não são bloqueadas. A versão de cada carteira
+recalculada é incrementada.
+
+Uso: python -m app.jobs.rebuild_portfolios [--lender-id ID ...]
+"""
+import argparse
+import time
+from typing import Optional, Sequence
+from sqlalchemy import exists, func, not_, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from .. import models
+from ..core.database import engine
+from ..core.portfolio import month_of
+
+
+def rebuild(lender_ids: Optional[Sequence[int]] = None) -> int:
+    """Recalcula as carteiras de 'lender_ids' (todas, se None). Devolve o número de carteiras gravadas."""
+    portfolios, cashflows = models.LenderPortfolio.__table__, models.LenderCashflow.__table__
+    loans, installments = models.Loan.__table__, models.Installment.__table__
+    paid = installments.c.status == models.InstallmentStatus.PAID
+    overdue = installments.c.status == models.InstallmentStatus.OVERDUE
+    in_default = func.coalesce(loans.c.status == models.LoanStatus.DEFAULT, False)
+
+    per_loan = (
+        select(
+            installments.c.loan_id,
+            func.sum(installments.c.valor_pago).filter(paid).label("received"),
+            func.sum(installments.c.valor_pago - installments.c.principal_amount).filter(paid).label("interest"),
+            func.count().filter(overdue).label("overdue_installments"),
+            func.sum(installments.c.amount).filter(overdue).label("overdue_amount"),
+        )
+        .group_by(installments.c.loan_id)
+        .subquery("per_loan")
+    )
+    totals = (
+        select(
+            loans.c.lender_id,
+            func.count().label("loans_count"),
+            func.sum(loans.c.amount).label("principal_lent"),
+            func.coalesce(func.sum(loans.c.outstanding_balance).filter(~in_default), 0).label("outstanding_principal"),
+            func.coalesce(func.sum(loans.c.outstanding_balance).filter(in_default), 0).label("defaulted_principal"),
+            func.coalesce(func.sum(per_loan.c.received), 0).label("amount_received"),
+            func.coalesce(func.sum(per_loan.c.interest), 0).label("interest_earned"),
+            func.coalesce(func.sum(per_loan.c.overdue_installments), 0).label("overdue_installments"),
+            func.coalesce(func.sum(per_loan.c.overdue_amount), 0).label("overdue_amount"),
+            func.now().label("updated_at"),
+        )
+        .select_from(loans.outerjoin(per_loan, per_loan.c.loan_id == loans.c.id))
+        .group_by(loans.c.lender_id)
+    )
+    month = month_of(installments.c.due_date)
+    expected = (
+        select(
+            loans.c.lender_id, month.label("month"), func.sum(installments.c.amount),
+            func.sum(installments.c.principal_amount), func.sum(installments.c.interest_amount),
+        )
+        .select_from(installments.join(loans, loans.c.id == installments.c.loan_id))
+        .where(installments.c.status.is_distinct_from(models.InstallmentStatus.PAID))
+        .group_by(loans.c.lender_id, month)
+    )
+    # Carteiras existentes de credores sem nenhum empréstimo (ex.: dados removidos) voltam a zero
+    orphans = update(portfolios).where(not_(exists().where(loans.c.lender_id == portfolios.c.lender_id))).values(
+        loans_count=0, principal_lent=0, outstanding_principal=0, defaulted_principal=0, amount_received=0,
+        interest_earned=0, overdue_installments=0, overdue_amount=0, version=portfolios.c.version + 1,
+        updated_at=func.now(),
+    )
+    clear_cashflows = cashflows.delete()
+    if lender_ids is not None:
+        totals = totals.where(loans.c.lender_id.in_(lender_ids))
+        expected = expected.where(loans.c.lender_id.in_(lender_ids))
+        orphans = orphans.where(portfolios.c.lender_id.in_(lender_ids))
+        clear_cashflows = clear_cashflows.where(cashflows.c.lender_id.in_(lender_ids))
+
+    columns = [
+        "lender_id", "loans_count", "principal_lent", "outstanding_principal", "defaulted_principal", "amount_received",
+        "interest_earned", "overdue_installments", "overdue_amount", "updated_at",
+    ]
+    upsert = insert(portfolios).from_select(columns, totals)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[portfolios.c.lender_id],
+        set_={
+            **{name: upsert.excluded[name] for name in columns[1:]},
+            "version": portfolios.c.version + 1,
+        },
+    )
+
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"LOCK TABLE {portfolios.name}, {cashflows.name} IN SHARE ROW EXCLUSIVE MODE"
+        ))
+        written = conn.execute(upsert).rowcount
+        written += conn.execute(orphans).rowcount
+        conn.execute(clear_cashflows)
+        conn.execute(insert(cashflows).from_select(
+            ["lender_id", "month", "expected_amount", "expected_principal", "expected_interest"], expected,
+        ))
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recalcula os agregados das carteiras dos credores.")
+    parser.add_argument("--lender-id", type=int, action="append", dest="lender_ids", default=None,
+                        help="Credor a recalcular (pode ser repetido); sem a opção, recalcula todos")
+    args = parser.parse_args(argv)
+
+    started = time.monotonic()
+    written = rebuild(args.lender_ids)
+    print(f"Carteiras recalculadas: {written} ({time.monotonic() - started:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""
+Conciliação saldo x ledger: verifica que Account.balance de cada conta é igual ao efeito acumulado das
+suas linhas do ledger, pelas regras de ledger.signed_amount (a linha P2P_DEBITO credita o destino pela
+coluna de destino; o P2P_CREDITO que accept_offer grava junto com o EMPRESTIMO_CONCEDIDO é espelho e
+não conta; origem igual ao destino não altera saldo).
+
+O saldo do ledger é calculado como em ledger.balance_as_of: último fechamento diário da conta até a marca
+d'água dos fechamentos (app/jobs/balance_snapshots.py) ou, sem fechamento, o saldo das partições
+arquivadas, mais as linhas do ledger posteriores à marca d'água. --full ignora os fechamentos e soma o
+ledger inteiro de cada conta.
+
+Incremental: cada execução concluída grava um checkpoint, e a seguinte só verifica as contas tocadas por
+linhas do ledger a partir dele, mais as contas divergentes da execução anterior. O checkpoint é o menor
+entre o horário do banco e o início da transação aberta mais antiga: toda linha do ledger anterior a ele
+já estava commitada quando a verificação começou. Uma alteração de saldo sem linha no ledger não toca a
+conta; rode --full periodicamente para cobrir esse caso.
+
+As contas são divididas em faixas de id (--range-size) verificadas em paralelo por --workers processos;
+cada faixa é lida numa única transação REPEATABLE READ, em que saldo e ledger são do mesmo instante. As
+divergências vão para um CSV em --report-dir assim que cada faixa termina e para
+ledger_reconciliation_mismatches; o progresso fica em ledger_reconciliations (GET /internal/reconciliation
+e métricas quark_reconciliation_* em /metrics, lidas do banco no máximo a cada
+RECONCILE_METRICS_REFRESH_SECONDS).
+
+Uso: python -m app.jobs.reconcile_ledger [--full] [--workers N] [--range-size N] [--report-dir DIR]
+Termina com código 1 se houver divergências.
+"""
+import argparse
+import bisect
+import csv
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import List, Optional, Sequence, Tuple
+from sqlalchemy import func, insert, select, text, union, update
+from sqlalchemy.engine import Connection
+from .. import models
+from ..core import ledger, metrics
+from ..core.config import settings
+from ..core.database import engine
+
+# Chave do pg_try_advisory_lock: uma conciliação por vez
+ADVISORY_LOCK_KEY = 7_310_014
+REPORT_FIELDS = ["account_id", "owner_id", "balance", "ledger_balance", "difference"]
+PROGRESS_INTERVAL_SECONDS = 5.0
+
+# Horário do banco limitado pelo início da transação aberta mais antiga (as linhas que ela gravar terão
+# timestamp_utc >= xact_start). Convertido para timestamp sem fuso, como o default de timestamp_utc.
+CHECKPOINT_SQL = text("""
+    SELECT CAST(LEAST(now(), (
+        SELECT min(xact_start) FROM pg_stat_activity
+        WHERE datname = current_database() AND backend_type = 'client backend' AND pid <> pg_backend_pid()
+    )) AS timestamp)
+""")
+
+
+@dataclass
+class RangeResult:
+    start: int
+    end: int
+    checked: int
+    # (account_id, owner_id, balance, ledger_balance)
+    mismatches: List[Tuple[int, int, Decimal, Decimal]]
+
+
+@dataclass
+class ReconcileResult:
+    reconciliation_id: Optional[int] = None
+    accounts_checked: int = 0
+    mismatches: int = 0
+    report_path: Optional[str] = None
+    seconds: float = 0.0
+    # True quando outra conciliação já estava em andamento
+    skipped: bool = False
+
+
+def check_range(start: int, end: int, since: Optional[datetime], flagged: Sequence[int], full: bool) -> RangeResult:
+    """
+    Verifica as contas com id em [start, end): todas, se 'since' for None, ou só as tocadas por linhas do
+    ledger a partir de 'since' e as de 'flagged'. Roda nos processos do pool (cada um com o seu engine).
+    """
+    accounts, tx = models.Account.__table__, models.Transaction.__table__
+    snapshots, archived = models.AccountBalanceSnapshot.__table__, models.AccountArchivedBalance.__table__
+    watermarks = models.JobWatermark.__table__
+
+    conditions = [accounts.c.id >= start, accounts.c.id < end]
+    if since is not None:
+        touched = union(
+            select(tx.c.origin_account_id).where(
+                tx.c.timestamp_utc >= since, tx.c.origin_account_id >= start, tx.c.origin_account_id < end,
+            ),
+            select(tx.c.destination_account_id).where(
+                tx.c.timestamp_utc >= since, tx.c.destination_account_id >= start, tx.c.destination_account_id < end,
+            ),
+        )
+        conditions.append(accounts.c.id.in_(touched) | accounts.c.id.in_(list(flagged)))
+    checked = select(accounts.c.id, accounts.c.owner_id, accounts.c.balance).where(*conditions).cte("checked")
+
+    # Saldo e ledger do mesmo instante; o snapshot também vê os fechamentos e a marca d'água juntos
+    with engine.connect().execution_options(isolation_level="REPEATABLE READ", postgresql_readonly=True) as conn:
+        consolidated = None
+        if not full:
+            consolidated = conn.execute(
+                select(watermarks.c.watermark_date).where(watermarks.c.name == ledger.SNAPSHOT_WATERMARK)
+            ).scalar()
+
+        carried = select(archived.c.net_amount).where(archived.c.account_id == checked.c.id).scalar_subquery()
+        if consolidated is None:
+            base = func.coalesce(carried, 0)
+            tail = ledger.balance_effects(tx, ledger.unarchived(tx.c.timestamp_utc))
+        else:
+            latest = (
+                select(snapshots.c.closing_balance)
+                .where(snapshots.c.account_id == checked.c.id, snapshots.c.day <= consolidated)
+                .order_by(snapshots.c.day.desc())
+                .limit(1)
+                .scalar_subquery()
+            )
+            base = func.coalesce(latest, carried, 0)
+            tail = ledger.balance_effects(
+                tx, tx.c.timestamp_utc >= datetime.combine(consolidated + timedelta(days=1), datetime.min.time()),
+                ledger.unarchived(tx.c.timestamp_utc),
+            )
+        # O filtro de faixa chega aos dois ramos do UNION ALL (índices por conta de origem e de destino)
+        tail_sums = (
+            select(tail.c.account_id, func.sum(tail.c.amount).label("amount"))
+            .where(tail.c.account_id >= start, tail.c.account_id < end)
+            .group_by(tail.c.account_id)
+            .subquery("tail_sums")
+        )
+        ledger_balance = (base + func.coalesce(tail_sums.c.amount, 0)).label("ledger_balance")
+        mismatches = conn.execute(
+            select(checked.c.id, checked.c.owner_id, checked.c.balance, ledger_balance)
+            .select_from(checked.outerjoin(tail_sums, tail_sums.c.account_id == checked.c.id))
+            .where(checked.c.balance != ledger_balance)
+            .order_by(checked.c.id)
+        ).all()
+        count = conn.execute(select(func.count()).select_from(checked)).scalar()
+        conn.rollback()
+    return RangeResult(start, end, count, [tuple(row) for row in mismatches])
+
+
+def _previous_run(conn: Connection):
+    runs = models.LedgerReconciliation.__table__
+    return conn.execute(
+        select(runs.c.id, runs.c.checkpoint)
+        .where(runs.c.status == models.ReconciliationStatus.DONE)
+        .order_by(runs.c.id.desc())
+        .limit(1)
+    ).first()
+
+def _ranges(conn: Connection, range_size: int) -> List[Tuple[int, int]]:
+    accounts = models.Account.__table__
+    first, last = conn.execute(select(func.min(accounts.c.id), func.max(accounts.c.id))).one()
+    if first is None:
+        return []
+    return [(start, min(start + range_size, last + 1)) for start in range(first, last + 1, range_size)]
+
+
+def reconcile(
+    full: bool = False, workers: Optional[int] = None, range_size: Optional[int] = None,
+    report_dir: Optional[str] = None,
+) -> ReconcileResult:
+    workers = settings.RECONCILE_WORKERS if workers is None else workers
+    range_size = range_size or settings.RECONCILE_RANGE_SIZE
+    report_dir = report_dir or settings.RECONCILE_REPORT_DIR
+    runs, mismatch_rows = models.LedgerReconciliation.__table__, models.LedgerReconciliationMismatch.__table__
+    started = time.monotonic()
+
+    # Conexão dedicada: o advisory lock é de sessão e precisa sobreviver aos commits de progresso
+    with engine.connect() as conn:
+        if not conn.execute(select(func.pg_try_advisory_lock(ADVISORY_LOCK_KEY))).scalar():
+            conn.rollback()
+            return ReconcileResult(skipped=True)
+        run_id = None
+        try:
+            previous = _previous_run(conn)
+            since, flagged = None, []
+            if previous is not None and not full:
+                since = previous.checkpoint
+                flagged = conn.execute(
+                    select(mismatch_rows.c.account_id)
+                    .where(mismatch_rows.c.reconciliation_id == previous.id)
+                    .order_by(mismatch_rows.c.account_id)
+                ).scalars().all()
+            # Antes de qualquer faixa: cada uma abre o seu snapshot depois deste ponto
+            checkpoint = conn.execute(CHECKPOINT_SQL).scalar()
+            ranges = _ranges(conn, range_size)
+            run_id = conn.execute(
+                insert(runs).values(
+                    status=models.ReconciliationStatus.RUNNING, full=full, since=since, checkpoint=checkpoint,
+                    ranges_total=len(ranges), ranges_done=0, accounts_checked=0, mismatches=0,
+                ).returning(runs.c.id)
+            ).scalar()
+            os.makedirs(report_dir, exist_ok=True)
+            report_path = os.path.join(report_dir, f"reconciliation-{run_id}.csv")
+            conn.execute(update(runs).where(runs.c.id == run_id).values(report_path=report_path))
+            conn.commit()
+
+            result = ReconcileResult(reconciliation_id=run_id, report_path=report_path)
+            tasks = []
+            for start, end in ranges:
+                in_range = flagged[bisect.bisect_left(flagged, start):bisect.bisect_left(flagged, end)]
+                tasks.append((start, end, since, in_range, full))
+
+            with open(report_path, "w", newline="") as report:
+                writer = csv.writer(report)
+                writer.writerow(REPORT_FIELDS)
+                report.flush()
+                last_print = time.monotonic()
+                for done, checked_range in enumerate(_run_tasks(tasks, workers), start=1):
+                    for account_id, owner_id, balance, ledger_balance in checked_range.mismatches:
+                        writer.writerow([account_id, owner_id, balance, ledger_balance, balance - ledger_balance])
+                    report.flush()
+                    if checked_range.mismatches:
+                        conn.execute(insert(mismatch_rows), [
+                            {"reconciliation_id": run_id, "account_id": account_id, "balance": balance, "ledger_balance": ledger_balance}
+                            for account_id, _, balance, ledger_balance in checked_range.mismatches
+                        ])
+                    result.accounts_checked += checked_range.checked
+                    result.mismatches += len(checked_range.mismatches)
+                    conn.execute(update(runs).where(runs.c.id == run_id).values(
+                        ranges_done=done, accounts_checked=result.accounts_checked, mismatches=result.mismatches,
+                    ))
+                    conn.commit()
+                    if time.monotonic() - last_print >= PROGRESS_INTERVAL_SECONDS or done == len(tasks):
+                        last_print = time.monotonic()
+                        elapsed = last_print - started
+                        print(
+                            f"Conciliação {run_id}: {done}/{len(tasks)} faixas, {result.accounts_checked} contas "
+                            f"({result.accounts_checked / elapsed:.0f} contas/s), {result.mismatches} divergências"
+                        )
+
+            conn.execute(update(runs).where(runs.c.id == run_id).values(
+                status=models.ReconciliationStatus.DONE, finished_at=func.now(),
+            ))
+            conn.commit()
+            result.seconds = time.monotonic() - started
+            return result
+        except BaseException:
+            conn.rollback()
+            if run_id is not None:
+                conn.execute(update(runs).where(runs.c.id == run_id).values(
+                    status=models.ReconciliationStatus.FAILED, finished_at=func.now(),
+                ))
+                conn.commit()
+            raise
+        finally:
+            conn.rollback()
+            conn.execute(select(func.pg_advisory_unlock(ADVISORY_LOCK_KEY)))
+            conn.commit()
+
+def _run_tasks(tasks, workers: int):
+    """RangeResult de cada faixa, na ordem em que terminam."""
+    if workers <= 1:
+        for task in tasks:
+            yield check_range(*task)
+        return
+    # spawn: os processos não herdam as conexões abertas deste processo
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(check_range, *task) for task in tasks]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def status(conn: Connection) -> Optional[dict]:
+    """Progresso e vazão da conciliação mais recente (None se nunca rodou)."""
+    runs = models.LedgerReconciliation.__table__
+    row = conn.execute(
+        select(runs, func.coalesce(runs.c.finished_at, func.localtimestamp()).label("until"))
+        .order_by(runs.c.id.desc())
+        .limit(1)
+    ).first()
+    if row is None:
+        return None
+    elapsed = (row.until - row.started_at).total_seconds()
+    return {
+        "id": row.id,
+        "status": row.status.value,
+        "full": row.full,
+        "since": row.since,
+        "checkpoint": row.checkpoint,
+        "ranges_total": row.ranges_total,
+        "ranges_done": row.ranges_done,
+        "accounts_checked": row.accounts_checked,
+        "accounts_per_second": row.accounts_checked / elapsed if elapsed > 0 else None,
+        "mismatches": row.mismatches,
+        "report_path": row.report_path,
+        "started_at": row.started_at,
+        "finished_at": row.finished_at,
+    }
+
+
+class _StatusCache:
+    """
+    Progresso da conciliação mais recente para as métricas: o job roda em outro processo, então é lido do
+    banco, mas no máximo a cada 'interval' segundos e com statement_timeout curto. Entre leituras, ou se a
+    leitura falhar, as coletas repetem o último valor lido.
+    """
+
+    def __init__(self, interval: float, timeout_ms: int):
+        self.interval = interval
+        self.timeout_ms = timeout_ms
+        self.current: Optional[dict] = None
+        self._read_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[dict]:
+        # Uma leitura por vez: coletas simultâneas não esperam, usam o valor anterior
+        if time.monotonic() - self._read_at >= self.interval and self._lock.acquire(blocking=False):
+            try:
+                self._read_at = time.monotonic()
+                with engine.connect() as conn:
+                    conn.execute(text("SELECT set_config('statement_timeout', :timeout, true)"), {"timeout": str(self.timeout_ms)})
+                    self.current = status(conn)
+            except Exception as e:
+                print(f"Erro ao ler o progresso da conciliação: {e}")
+            finally:
+                self._lock.release()
+        return self.current
+
+
+status_cache = _StatusCache(settings.RECONCILE_METRICS_REFRESH_SECONDS, settings.RECONCILE_METRICS_TIMEOUT_MS)
+
+
+@metrics.registry.register_collector
+def _reconciliation_metrics():
+    current = status_cache.get()
+    if current is None:
+        return []
+    gauges = [
+        (metrics.Gauge("quark_reconciliation_running", "Conciliação saldo x ledger em andamento (1) ou não (0)."),
+         int(current["status"] == models.ReconciliationStatus.RUNNING.value)),
+        (metrics.Gauge("quark_reconciliation_ranges_total", "Faixas de contas da conciliação mais recente."),
+         current["ranges_total"]),
+        (metrics.Gauge("quark_reconciliation_ranges_done", "Faixas de contas já verificadas."), current["ranges_done"]),
+        (metrics.Gauge("quark_reconciliation_accounts_checked", "Contas verificadas."), current["accounts_checked"]),
+        (metrics.Gauge("quark_reconciliation_accounts_per_second", "Vazão da conciliação (contas/s)."),
+         current["accounts_per_second"] or 0),
+        (metrics.Gauge("quark_reconciliation_mismatches", "Contas com saldo divergente do ledger."), current["mismatches"]),
+    ]
+    for gauge, value in gauges:
+        gauge.set(value)
+    return [gauge for gauge, _ in gauges]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concilia o saldo de cada conta com o seu ledger.")
+    parser.add_argument("--full", action="store_true", help="Verifica todas as contas, sem fechamentos diários")
+    parser.add_argument("--workers", type=int, default=None, help="Processos em paralelo (1 = no próprio processo)")
+    parser.add_argument("--range-size", type=int, default=None, help="Contas (faixa de ids) por tarefa")
+    parser.add_argument("--report-dir", default=None, help="Diretório do relatório CSV de divergências")
+    args = parser.parse_args(argv)
+
+    result = reconcile(full=args.full, workers=args.workers, range_size=args.range_size, report_dir=args.report_dir)
+    if result.skipped:
+        print("Outra conciliação já está em andamento; nada a fazer.")
+        return
+    print(
+        f"Conciliação {result.reconciliation_id}: {result.accounts_checked} contas verificadas, "
+        f"{result.mismatches} divergências ({result.seconds:.2f}s). Relatório: {result.report_path}"
+    )
+    if result.mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
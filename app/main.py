@@ -1,22 +1,102 @@
+import anyio.to_thread
 from fastapi import FastAPI
 # IMPORTANTE: Adicionar 'user' na lista de imports
-from .api.v1 import auth, wallet, marketplace, loans, admin, user
-from .core.database import Base, engine
+from .api.v1 import auth, wallet, marketplace, loans, admin, user, internal, events
+from .core.database import Base, engine, SessionLocal, replicas
 from .core.config import settings
+from .core import matching, async_bridge, hashing, metrics, profiling
+from .core import events as event_stream
+from .jobs import balance_snapshots, overdue_sweeper
 
 app = FastAPI(title="Quark Platform API")
 
+if settings.DB_PROFILING_ENABLED:
+    app.add_middleware(profiling.QueryProfilerMiddleware)
+if settings.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
+def _router(module):
+    # No modo assíncrono (DB_ASYNC_MODE) os endpoints são servidos com AsyncSession, fora do thread pool
+    return async_bridge.asyncify_router(module.router) if settings.DB_ASYNC_MODE else module.router
+
 # Incluir o novo router de usuário
-app.include_router(auth.router, prefix="/api/v1/auth", tags=["Authentication"])
-app.include_router(user.router, prefix="/api/v1/user", tags=["User"])
-app.include_router(wallet.router, prefix="/api/v1/wallet", tags=["Wallet"])
-app.include_router(marketplace.router, prefix="/api/v1/marketplace", tags=["Marketplace"])
-app.include_router(loans.router, prefix="/api/v1", tags=["Loans"])
+app.include_router(_router(auth), prefix="/api/v1/auth", tags=["Authentication"])
+app.include_router(_router(user), prefix="/api/v1/user", tags=["User"])
+app.include_router(_router(wallet), prefix="/api/v1/wallet", tags=["Wallet"])
+app.include_router(_router(marketplace), prefix="/api/v1/marketplace", tags=["Marketplace"])
+app.include_router(_router(loans), prefix="/api/v1", tags=["Loans"])
+if settings.EVENTS_ENABLED:
+    # Endpoints de streaming já são assíncronos: servidos igualmente nos dois modos
+    app.include_router(events.router, prefix="/api/v1/events", tags=["Events"])
+# Endpoints operacionais (métricas do processo), fora do prefixo público e da documentação
+app.include_router(internal.router, prefix="/internal", tags=["Internal"], include_in_schema=False)
+if settings.METRICS_ENABLED and (settings.METRICS_SCRAPE_TOKEN or settings.ENVIRONMENT == "development"):
+    app.include_router(internal.metrics_router, tags=["Internal"], include_in_schema=False)
 
 if settings.ENVIRONMENT == "development":
-    app.include_router(admin.router, prefix="/api/v1/admin", tags=["Admin (Development Only)"])
+    app.include_router(_router(admin), prefix="/api/v1/admin", tags=["Admin (Development Only)"])
     print("--- Admin endpoints loaded (DEVELOPMENT MODE) ---")
 
+@app.on_event("startup")
+def load_matching_index():
+    # Carrega o índice de ofertas ATIVAS; se o banco não estiver disponível, o índice é carregado na primeira consulta
+    db = SessionLocal()
+    try:
+        matching.offer_index.load(db)
+    except Exception as e:
+        print(f"Erro ao carregar o índice de matching: {e}")
+    finally:
+        db.close()
+
+@app.on_event("startup")
+async def limit_hashing_admission():
+    # No modo síncrono quem espera o hash segura um thread do pool do anyio (40 por padrão): a fila do
+    # pool de hashing não pode tomar esse pool das demais rotas
+    if not settings.DB_ASYNC_MODE:
+        threads = anyio.to_thread.current_default_thread_limiter().total_tokens
+        hashing.hashing_pool.limit_threads(int(threads * settings.PASSWORD_HASH_THREADPOOL_SHARE))
+
+@app.on_event("startup")
+def start_overdue_sweeper():
+    # Execução periódica da varredura de inadimplência (um advisory lock garante uma varredura por vez)
+    overdue_sweeper.periodic_sweeper.start()
+
+@app.on_event("startup")
+def start_balance_snapshots():
+    # Consolidação periódica dos fechamentos diários de saldo (também protegida por advisory lock)
+    balance_snapshots.periodic_snapshots.start()
+
+@app.on_event("startup")
+def start_replica_health_checks():
+    # Verificação periódica de saúde e atraso das réplicas de leitura (sem réplicas, nada a fazer)
+    replicas.start()
+
+@app.on_event("startup")
+def start_event_dispatcher():
+    # Entrega dos eventos do outbox às conexões SSE/WebSocket deste worker (LISTEN + consulta periódica)
+    if settings.EVENTS_ENABLED:
+        event_stream.dispatcher.start()
+
+@app.on_event("shutdown")
+def stop_hashing_pool():
+    hashing.hashing_pool.shutdown()
+
+@app.on_event("shutdown")
+def stop_overdue_sweeper():
+    overdue_sweeper.periodic_sweeper.stop()
+
+@app.on_event("shutdown")
+def stop_balance_snapshots():
+    balance_snapshots.periodic_snapshots.stop()
+
+@app.on_event("shutdown")
+def stop_event_dispatcher():
+    event_stream.dispatcher.stop()
+
+@app.on_event("shutdown")
+def stop_replica_health_checks():
+    replicas.stop()
+
 @app.get("/")
 def read_root():
     return {"Project": "Quark API", "Status": "Running"}
\ No newline at end of file
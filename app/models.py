@@ -1,8 +1,9 @@
 # app/models.py (CORRIGIDO E COMPLEMENTADO)
 
-from sqlalchemy import Column, Integer, String, DateTime, Enum as SQLAlchemyEnum, Numeric, ForeignKey, Date
+from sqlalchemy import Column, Integer, BigInteger, Boolean, String, DateTime, Enum as SQLAlchemyEnum, Numeric, ForeignKey, Date, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from .core.database import Base
 import enum
 from datetime import date # Importado date para default em Loan
@@ -16,6 +17,8 @@ class LoanStatus(str, enum.Enum): ACTIVE="ATIVO"; PAID="PAGO"; DEFAULT="DEFAULT"
 class OfferStatus(str, enum.Enum): ACTIVE="ACTIVE"; PAUSED="PAUSADA"; COMMITTED="COMPROMETIDA" # [cite: 66]
 class CreditSearchStatus(str, enum.Enum): ACTIVE="ATIVA"; NEGOTIATING="NEGOCIANDO"; CANCELED="CANCELADA" # [cite: 75]
 class InstallmentStatus(str, enum.Enum): PENDING="PENDENTE"; PAID="PAGO"; OVERDUE="ATRASO"; PARCIAL="PARCIAL" # [cite: 95]
+class AmortizationSystem(str, enum.Enum): SIMPLE="SIMPLES"; PRICE="PRICE"; SAC="SAC"
+class ReconciliationStatus(str, enum.Enum): RUNNING="EXECUTANDO"; DONE="CONCLUIDA"; FAILED="FALHOU"
 class TransactionType(str, enum.Enum):
     P2P_DEBITO="P2P_DEBITO"
     P2P_CREDITO="P2P_CREDITO"
@@ -60,8 +63,10 @@ class Account(Base):
 class Transaction(Base):
     __tablename__ = "transactions"
     # Adicionada referência de entidade conforme escopo [cite: 53]
-    id = Column(Integer, primary_key=True, index=True)
-    timestamp_utc = Column(DateTime, default=func.now(), nullable=False)
+    # Particionada por mês de timestamp_utc (app/jobs/ledger_partitions.py): a chave primária da tabela
+    # inclui a chave de partição; para o ORM a identidade continua sendo só o id.
+    id = Column(BigInteger, primary_key=True, index=True)
+    timestamp_utc = Column(DateTime, default=func.now(), primary_key=True, nullable=False)
     type = Column(SQLAlchemyEnum(TransactionType), nullable=False)
     value = Column(Numeric(15, 2), nullable=False)
     origin_account_id = Column(Integer, ForeignKey("accounts.id"))
@@ -71,6 +76,14 @@ class Transaction(Base):
     origin_account = relationship("Account", foreign_keys=[origin_account_id], back_populates="transactions_sent")
     destination_account = relationship("Account", foreign_keys=[destination_account_id], back_populates="transactions_received")
 
+    # Índices compostos para a paginação keyset do histórico (conta + tempo)
+    __table_args__ = (
+        Index("ix_transactions_origin_account_id_timestamp_utc", "origin_account_id", "timestamp_utc"),
+        Index("ix_transactions_destination_account_id_timestamp_utc", "destination_account_id", "timestamp_utc"),
+        {"postgresql_partition_by": "RANGE (timestamp_utc)"},
+    )
+    __mapper_args__ = {"primary_key": [id]}
+
 class CreditOffer(Base):
     __tablename__ = "credit_offers"
     id = Column(Integer, primary_key=True, index=True)
@@ -84,6 +97,13 @@ class CreditOffer(Base):
     eligible_sector = Column(String, nullable=True) 
     data_expiracao = Column(Date, nullable=True) 
     
+class OfferBookVersion(Base):
+    # Linha única com a versão do livro de ofertas ATIVAS. É incrementada na mesma transação
+    # que cria ou compromete uma oferta, para que caches em memória detectem mudanças de outros workers.
+    __tablename__ = "offer_book_version"
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, default=0, nullable=False)
+
 class CreditSearch(Base): 
     __tablename__ = "credit_searches"
     id = Column(Integer, primary_key=True, index=True)
@@ -108,8 +128,24 @@ class Loan(Base):
     term_months = Column(Integer, nullable=False)
     data_contrato = Column(Date, default=date.today(), nullable=False) # [cite: 85]
     status = Column(SQLAlchemyEnum(LoanStatus), default=LoanStatus.ACTIVE)
+    # Sistema de amortização do cronograma (ver app/core/amortization.py)
+    amortization_system = Column(SQLAlchemyEnum(AmortizationSystem), default=AmortizationSystem.SIMPLE, nullable=False)
+    # Contadores de progresso mantidos pelo pagamento de parcelas (evitam COUNT/SUM sobre installments).
+    # outstanding_balance é o saldo devedor (principal ainda não pago); next_* ficam nulos após a quitação.
+    installments_paid = Column(Integer, default=0, nullable=False)
+    outstanding_balance = Column(Numeric(15, 2), nullable=False)
+    next_installment_number = Column(Integer, nullable=True)
+    next_due_date = Column(Date, nullable=True)
     
-    installments = relationship("Installment", back_populates="loan")
+    installments = relationship("Installment", back_populates="loan", order_by="Installment.installment_number")
+
+    __table_args__ = (
+        # Índice parcial usado pela varredura de inadimplência (app/jobs/overdue_sweeper.py)
+        Index("ix_loans_active_next_due_date", "next_due_date", postgresql_where=text("status = 'ACTIVE'")),
+        # Listagem paginada (keyset em id) dos empréstimos do mutuário e do credor
+        Index("ix_loans_borrower_id_id", "borrower_id", "id"),
+        Index("ix_loans_lender_id_id", "lender_id", "id"),
+    )
 
 class Installment(Base):
     __tablename__ = "installments"
@@ -118,10 +154,140 @@ class Installment(Base):
     installment_number = Column(Integer, nullable=False)
     due_date = Column(Date, nullable=False)
     amount = Column(Numeric(15, 2), nullable=False)
+    # Decomposição da parcela: amount = principal_amount + interest_amount
+    principal_amount = Column(Numeric(15, 2), nullable=False)
+    interest_amount = Column(Numeric(15, 2), nullable=False)
     status = Column(SQLAlchemyEnum(InstallmentStatus), default=InstallmentStatus.PENDING)
     
     # ATRIBUTOS COMPLEMENTARES ADICIONADOS [cite: 93-94]
     valor_pago = Column(Numeric(15, 2), default=0.00, nullable=False) 
     data_pagamento = Column(DateTime, nullable=True)
 
-    loan = relationship("Loan", back_populates="installments")
\ No newline at end of file
+    loan = relationship("Loan", back_populates="installments")
+
+    __table_args__ = (
+        # Índice parcial usado pela varredura de inadimplência: só as parcelas PENDENTES, por vencimento
+        Index("ix_installments_pending_due_date", "due_date", postgresql_where=text("status = 'PENDING'")),
+        # Parcelas de um empréstimo em ordem (selectinload, pagamento e agregados por empréstimo)
+        Index("ix_installments_loan_id_installment_number", "loan_id", "installment_number"),
+    )
+
+class LenderPortfolio(Base):
+    # Agregados da carteira de cada credor, mantidos incrementalmente (ver app/core/portfolio.py)
+    __tablename__ = "lender_portfolios"
+    lender_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    # Incrementada a cada alteração dos agregados (chave de cache das análises da carteira)
+    version = Column(BigInteger, default=1, nullable=False)
+    loans_count = Column(Integer, default=0, nullable=False)
+    principal_lent = Column(Numeric(15, 2), default=0, nullable=False)
+    # Principal em aberto dos empréstimos em dia ou em atraso; o dos empréstimos em DEFAULT fica à parte
+    outstanding_principal = Column(Numeric(15, 2), default=0, nullable=False)
+    defaulted_principal = Column(Numeric(15, 2), default=0, nullable=False)
+    amount_received = Column(Numeric(15, 2), default=0, nullable=False)
+    interest_earned = Column(Numeric(15, 2), default=0, nullable=False)
+    overdue_installments = Column(Integer, default=0, nullable=False)
+    overdue_amount = Column(Numeric(15, 2), default=0, nullable=False)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+
+class LenderCashflow(Base):
+    # Fluxo de caixa esperado do credor por mês de vencimento (parcelas ainda não pagas)
+    __tablename__ = "lender_cashflows"
+    lender_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    month = Column(Date, primary_key=True)
+    expected_amount = Column(Numeric(15, 2), default=0, nullable=False)
+    expected_principal = Column(Numeric(15, 2), default=0, nullable=False)
+    expected_interest = Column(Numeric(15, 2), default=0, nullable=False)
+
+class JobWatermark(Base):
+    # Marca d'água dos jobs em lote: até onde (data de corte) o job já processou com sucesso
+    __tablename__ = "job_watermarks"
+    name = Column(String, primary_key=True)
+    watermark_date = Column(Date, nullable=True)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+
+class TransactionArchive(Base):
+    # Partições mensais do ledger já desanexadas e exportadas (app/jobs/ledger_partitions.py archive)
+    __tablename__ = "transaction_archives"
+    partition_name = Column(String, primary_key=True)
+    range_start = Column(DateTime, nullable=False)
+    range_end = Column(DateTime, nullable=False)
+    row_count = Column(BigInteger, nullable=False)
+    # Arquivo CSV compactado (gzip) e o seu SHA-256; nulos enquanto a exportação não termina
+    file_path = Column(String, nullable=True)
+    sha256 = Column(String, nullable=True)
+    # Nulo entre a soma dos saldos (a partição ainda anexada) e o DETACH
+    detached_at = Column(DateTime, nullable=True)
+    exported_at = Column(DateTime, nullable=True)
+
+class AccountArchivedBalance(Base):
+    # Efeito acumulado no saldo (regras de ledger.signed_amount) das linhas do ledger já arquivadas
+    __tablename__ = "account_archived_balances"
+    account_id = Column(Integer, ForeignKey("accounts.id"), primary_key=True)
+    net_amount = Column(Numeric(15, 2), default=0, nullable=False)
+
+class AccountBalanceSnapshot(Base):
+    # Fechamento diário por conta (app/jobs/balance_snapshots.py): créditos e débitos do dia e saldo ao
+    # fim do dia, só para os dias com movimento. O saldo numa data é o do último fechamento até ela.
+    __tablename__ = "account_balance_snapshots"
+    account_id = Column(Integer, ForeignKey("accounts.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    credit_total = Column(Numeric(15, 2), default=0, nullable=False)
+    debit_total = Column(Numeric(15, 2), default=0, nullable=False)
+    closing_balance = Column(Numeric(15, 2), nullable=False)
+
+class LedgerReconciliation(Base):
+    # Execuções da conciliação saldo x ledger (app/jobs/reconcile_ledger.py), com o progresso corrente
+    __tablename__ = "ledger_reconciliations"
+    id = Column(Integer, primary_key=True)
+    status = Column(SQLAlchemyEnum(ReconciliationStatus), default=ReconciliationStatus.RUNNING, nullable=False)
+    full = Column(Boolean, default=False, nullable=False)
+    # Contas verificadas: as tocadas por linhas do ledger com timestamp_utc >= since (todas se nulo)
+    since = Column(DateTime, nullable=True)
+    # Toda linha do ledger anterior ao checkpoint estava visível para a verificação (próximo 'since')
+    checkpoint = Column(DateTime, nullable=False)
+    ranges_total = Column(Integer, default=0, nullable=False)
+    ranges_done = Column(Integer, default=0, nullable=False)
+    accounts_checked = Column(BigInteger, default=0, nullable=False)
+    mismatches = Column(Integer, default=0, nullable=False)
+    report_path = Column(String, nullable=True)
+    started_at = Column(DateTime, default=func.now(), nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+
+class LedgerReconciliationMismatch(Base):
+    # Contas cujo saldo diverge do ledger numa execução; são verificadas de novo na execução seguinte
+    __tablename__ = "ledger_reconciliation_mismatches"
+    reconciliation_id = Column(Integer, ForeignKey("ledger_reconciliations.id", ondelete="CASCADE"), primary_key=True)
+    account_id = Column(Integer, ForeignKey("accounts.id"), primary_key=True)
+    balance = Column(Numeric(15, 2), nullable=False)
+    ledger_balance = Column(Numeric(15, 2), nullable=False)
+
+class OutboxEvent(Base):
+    # Outbox transacional dos eventos enviados aos clientes conectados (app/core/events.py), gravado na
+    # mesma transação da operação que o origina. user_id nulo: evento para todos os usuários.
+    __tablename__ = "outbox_events"
+    id = Column(BigInteger, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    type = Column(String, nullable=False)
+    payload = Column(JSONB, nullable=False)
+    created_at = Column(DateTime, default=func.now(), index=True, nullable=False)
+
+    __table_args__ = (
+        # Eventos de um usuário (ou os gerais, user_id nulo) depois de um id: entrega e retomada
+        Index("ix_outbox_events_user_id_id", "user_id", "id"),
+    )
+
+class CreditSearchMatch(Base):
+    # Feed das buscas ATIVAS tratadas como assinaturas: cada oferta nova compatível com a busca
+    # (app/core/matching.py, notify_subscriptions), gravada na mesma transação que cria a oferta.
+    __tablename__ = "credit_search_matches"
+    id = Column(BigInteger, primary_key=True)
+    search_id = Column(Integer, ForeignKey("credit_searches.id"), nullable=False)
+    offer_id = Column(Integer, ForeignKey("credit_offers.id"), nullable=False)
+    borrower_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_credit_search_matches_search_id_offer_id", "search_id", "offer_id", unique=True),
+        # Feed do mutuário em ordem de id (paginação por cursor)
+        Index("ix_credit_search_matches_borrower_id_id", "borrower_id", "id"),
+    )
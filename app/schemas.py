@@ -5,7 +5,7 @@ from datetime import date, datetime
 # Importa todos os Enums atualizados, incluindo EntityType
 from .models import (
     KYCStatus, AccountStatus, LoanStatus, InstallmentStatus, OfferStatus, 
-    TransactionType, CreditSearchStatus, EntityType
+    TransactionType, CreditSearchStatus, EntityType, AmortizationSystem
 )
 
 # ----------------------------------------------------------------------
@@ -41,6 +41,12 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     email: Optional[str] = None
 
+class Principal(BaseModel):
+    # Identidade mínima do usuário autenticado (claims do token ou cache), usada pelas rotas de leitura
+    id: int
+    email: str
+    kyc_status: KYCStatus
+
 # ----------------------------------------------------------------------
 # SCHEMAS DE CARTEIRA E TRANSAÇÕES
 # ----------------------------------------------------------------------
@@ -51,6 +57,12 @@ class AccountOut(BaseModel):
     class Config:
         orm_mode = True
 
+class BalanceAsOfOut(BaseModel):
+    as_of: date
+    balance: Decimal
+    # Fechamento diário usado como ponto de partida (nulo se não houver nenhum até a data)
+    snapshot_date: Optional[date] = None
+
 class TransactionOut(BaseModel):
     id: int
     timestamp_utc: datetime
@@ -67,6 +79,29 @@ class TransferRequest(BaseModel):
     destination_user_id: int
     amount: Decimal = Field(..., gt=0)
 
+class BatchTransferItem(BaseModel):
+    destination_user_id: int
+    amount: Decimal = Field(..., gt=0)
+
+class BatchTransferRequest(BaseModel):
+    items: List[BatchTransferItem] = Field(..., min_items=1)
+    # ALL_OR_NOTHING: qualquer item inválido rejeita o lote inteiro; BEST_EFFORT: executa os itens válidos
+    mode: str = Field("ALL_OR_NOTHING", regex="^(ALL_OR_NOTHING|BEST_EFFORT)$")
+
+class BatchTransferItemResult(BaseModel):
+    index: int
+    destination_user_id: int
+    amount: Decimal
+    status: str = Field(..., description="OK, FAILED ou SKIPPED (não executado porque o lote foi rejeitado)")
+    detail: Optional[str] = None
+
+class BatchTransferResult(BaseModel):
+    mode: str
+    committed: bool
+    transferred_count: int
+    transferred_amount: Decimal
+    items: List[BatchTransferItemResult]
+
 # ----------------------------------------------------------------------
 # SCHEMAS DO MARKETPLACE (EXPANDIDO)
 # ----------------------------------------------------------------------
@@ -100,8 +135,16 @@ class CreditSearchOut(CreditSearchCreate):
     class Config:
         orm_mode = True
 
+class SearchMatchOut(BaseModel):
+    # Oferta nova compatível com uma busca ATIVA (feed das assinaturas)
+    id: int
+    search_id: int
+    matched_at: datetime
+    offer: CreditOfferOut
+
 class AcceptOfferRequest(BaseModel):
     amount: Decimal = Field(..., gt=0)
+    amortization_system: AmortizationSystem = AmortizationSystem.SIMPLE
 
 # ----------------------------------------------------------------------
 # SCHEMAS DE EMPRÉSTIMO E PARCELAS (EXPANDIDO)
@@ -110,6 +153,8 @@ class InstallmentOut(BaseModel):
     installment_number: int
     due_date: date
     amount: Decimal
+    principal_amount: Decimal
+    interest_amount: Decimal
     status: InstallmentStatus
     valor_pago: Decimal # ADICIONADO (escopo)
     data_pagamento: Optional[datetime] # ADICIONADO (escopo)
@@ -125,6 +170,11 @@ class LoanOut(BaseModel):
     interest_rate: Decimal
     term_months: int
     status: LoanStatus
+    amortization_system: AmortizationSystem
+    installments_paid: int
+    outstanding_balance: Decimal
+    next_installment_number: Optional[int]
+    next_due_date: Optional[date]
     # CAMPOS COMPLEMENTARES ADICIONADOS
     search_id_fk: Optional[int]
     data_contrato: date
@@ -134,6 +184,129 @@ class LoanOut(BaseModel):
     class Config:
         orm_mode = True
         
+class InstallmentPaymentRequest(BaseModel):
+    # Quantidade de parcelas a pagar, a partir da próxima em aberto
+    count: int = Field(1, ge=1)
+    # Quita o saldo devedor (principal restante) de uma vez, sem os juros das parcelas futuras
+    prepay_full: bool = False
+
+class InstallmentPaymentOut(BaseModel):
+    message: str
+    installments_paid: List[int]
+    amount_paid: Decimal
+    outstanding_balance: Decimal
+    loan_status: LoanStatus
+
+class LoanSimulationRequest(BaseModel):
+    # Limites das colunas Numeric(15,2) (valor) e Numeric(5,4) (taxa) de loans
+    amount: Decimal = Field(..., gt=0, le=Decimal("9999999999999.99"))
+    interest_rate: Decimal = Field(..., ge=0, lt=10, description="Taxa de juros anual (ex.: 0.12 = 12% a.a.)")
+    term_months: int = Field(..., ge=1, le=600)
+    amortization_system: AmortizationSystem = AmortizationSystem.SIMPLE
+    start_date: Optional[date] = None
+
+class SimulatedInstallment(BaseModel):
+    installment_number: int
+    due_date: date
+    amount: Decimal
+    principal_amount: Decimal
+    interest_amount: Decimal
+    balance: Decimal
+
+class LoanSimulationOut(BaseModel):
+    amount: Decimal
+    interest_rate: Decimal
+    term_months: int
+    amortization_system: AmortizationSystem
+    total_amount: Decimal
+    total_interest: Decimal
+    installments: List[SimulatedInstallment]
+
+class LoanSummaryOut(BaseModel):
+    # Cabeçalho do empréstimo com os contadores de progresso, sem a lista de parcelas (view=summary)
+    id: int
+    borrower_id: int
+    lender_id: int
+    amount: Decimal
+    interest_rate: Decimal
+    term_months: int
+    status: LoanStatus
+    amortization_system: AmortizationSystem
+    data_contrato: date
+    installments_paid: int
+    overdue_installments: int
+    outstanding_balance: Decimal
+    next_installment_number: Optional[int]
+    next_due_date: Optional[date]
+
+    class Config:
+        orm_mode = True
+
+class PortfolioCashflowOut(BaseModel):
+    month: date
+    expected_amount: Decimal
+    expected_principal: Decimal
+    expected_interest: Decimal
+
+    class Config:
+        orm_mode = True
+
+class LenderPortfolioOut(BaseModel):
+    # Agregados da carteira do credor (lender_portfolios); 'version' muda a cada alteração
+    lender_id: int
+    version: int
+    loans_count: int
+    principal_lent: Decimal
+    outstanding_principal: Decimal
+    # Principal em aberto dos empréstimos em DEFAULT (fora de outstanding_principal)
+    defaulted_principal: Decimal
+    amount_received: Decimal
+    interest_earned: Decimal
+    overdue_installments: int
+    overdue_amount: Decimal
+    # Parcelas ainda não pagas, por mês de vencimento (inclui meses passados com parcelas em atraso)
+    cashflow: List[PortfolioCashflowOut]
+
+class PortfolioSimulationRequest(BaseModel):
+    paths: int = Field(10000, ge=1)
+    # Fração recuperada do saldo não pago em caso de default
+    recovery_rate: Decimal = Field(Decimal(0), ge=0, le=1)
+    # Semente do gerador aleatório; se omitida, o resultado é determinístico por versão da carteira
+    seed: Optional[int] = Field(None, ge=0)
+
+class SimulatedCashflowMonth(BaseModel):
+    month: date
+    scheduled_amount: Decimal
+    # Valor esperado considerando a probabilidade de default de cada empréstimo
+    expected_amount: Decimal
+
+class SimulatedReturns(BaseModel):
+    # Retorno total (valor recebido / principal em aberto - 1) nos cenários de Monte Carlo
+    mean: float
+    std: float
+    p1: float
+    p5: float
+    p50: float
+    p95: float
+    p99: float
+    probability_of_loss: float
+
+class PortfolioSimulationOut(BaseModel):
+    lender_id: int
+    version: int
+    paths: int
+    recovery_rate: Decimal
+    loans: int
+    outstanding_principal: Decimal
+    scheduled_amount: Decimal
+    expected_amount: Decimal
+    expected_loss: Decimal
+    # TIRs anuais do fluxo contratado e do fluxo esperado (nulas sem empréstimos em aberto)
+    scheduled_irr: Optional[float]
+    expected_irr: Optional[float]
+    cashflow: List[SimulatedCashflowMonth]
+    returns: SimulatedReturns
+
 class AdminSetBalanceRequest(BaseModel):
     user_id: int
     new_balance: Decimal = Field(..., ge=0)
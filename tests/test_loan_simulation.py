@@ -0,0 +1,38 @@
+from decimal import Decimal
+import pytest
+from fastapi.testclient import TestClient
+from app import models
+from app.core import amortization
+from app.main import app
+
+# Sem o contexto do TestClient os eventos de startup (jobs, dispatcher) não rodam: a simulação não usa o banco
+client = TestClient(app)
+
+AMOUNT_TOO_LARGE = {"amount": "1e20", "interest_rate": "0.1", "term_months": 12, "amortization_system": "SAC"}
+RATE_TOO_LARGE = {"amount": "1000", "interest_rate": "50", "term_months": 600, "amortization_system": "PRICE"}
+
+
+@pytest.mark.parametrize("payload", [AMOUNT_TOO_LARGE, RATE_TOO_LARGE])
+def test_simulate_rejects_out_of_range_parameters(payload):
+    response = client.post("/api/v1/loan/simulate", json=payload)
+    assert response.status_code == 422
+
+def test_simulate_accepts_the_largest_storable_parameters():
+    payload = {"amount": "9999999999999.99", "interest_rate": "9.9999", "term_months": 600, "amortization_system": "SAC"}
+    response = client.post("/api/v1/loan/simulate", json=payload)
+    assert response.status_code == 200
+    assert len(response.json()["installments"]) == 600
+
+@pytest.mark.parametrize("amount, rate, system", [
+    ("1e20", "0.1", models.AmortizationSystem.SAC),
+    ("1000", "50", models.AmortizationSystem.PRICE),
+])
+def test_build_schedule_reports_overflow(amount, rate, system):
+    with pytest.raises(amortization.ScheduleOverflow):
+        amortization.build_schedule(Decimal(amount), Decimal(rate), 600, system)
+
+def test_simulate_maps_schedule_overflow_to_422():
+    # PRICE no limite do schema estoura a forma fechada do saldo devedor
+    payload = {"amount": "9999999999999.99", "interest_rate": "9.9999", "term_months": 600, "amortization_system": "PRICE"}
+    response = client.post("/api/v1/loan/simulate", json=payload)
+    assert response.status_code == 422
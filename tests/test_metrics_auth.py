@@ -0,0 +1,21 @@
+import pytest
+from fastapi import HTTPException
+from app.api.v1 import internal
+from app.core.config import settings
+
+
+@pytest.fixture
+def scrape_token(monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_SCRAPE_TOKEN", "s3cret")
+    return "s3cret"
+
+
+@pytest.mark.parametrize("authorization", [None, "", "Bearer wrong", "Basic s3cret", "s3cret"])
+def test_scrape_without_the_token_is_rejected(scrape_token, authorization):
+    with pytest.raises(HTTPException) as error:
+        internal.require_scrape_token(authorization)
+    assert error.value.status_code == 401
+    assert error.value.headers["WWW-Authenticate"] == "Bearer"
+
+def test_scrape_with_the_token_is_accepted(scrape_token):
+    internal.require_scrape_token(f"Bearer {scrape_token}")
@@ -0,0 +1,25 @@
+import pytest
+from fastapi import HTTPException
+from app.core import hashing, security
+from app.core.config import settings
+
+
+def test_full_hashing_queue_returns_503_with_retry_after(monkeypatch):
+    pool = hashing.HashingPool(workers=1, queue_size=0)
+    monkeypatch.setattr(security, "hashing_pool", pool)
+    # Ocupa o único slot, como uma requisição ainda esperando o hash
+    assert pool._slots.acquire(blocking=False)
+    try:
+        with pytest.raises(HTTPException) as error:
+            security.get_password_hash("secret")
+    finally:
+        pool._slots.release()
+    assert error.value.status_code == 503
+    assert error.value.headers["Retry-After"] == str(settings.PASSWORD_HASH_RETRY_AFTER_SECONDS)
+
+def test_admission_is_limited_by_the_thread_pool():
+    pool = hashing.HashingPool(workers=2, queue_size=32)
+    pool.limit_threads(10)
+    assert pool.capacity == 10
+    taken = [pool._slots.acquire(blocking=False) for _ in range(11)]
+    assert taken == [True] * 10 + [False]
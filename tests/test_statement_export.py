@@ -0,0 +1,52 @@
+import csv
+import io
+import json
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+from app import models
+from app.api.v1 import wallet
+from app.core import ledger
+
+ACCOUNT_ID = 2
+
+
+def _row(type, origin, destination, value):
+    return SimpleNamespace(
+        type=type, origin_account_id=origin, destination_account_id=destination, value=Decimal(value),
+    )
+
+def _statement():
+    # Desembolso de empréstimo: EMPRESTIMO_CONCEDIDO credita a conta e o P2P_CREDITO é o espelho sem efeito
+    rows = [
+        _row(models.TransactionType.EMPRESTIMO_CONCEDIDO, 1, ACCOUNT_ID, "500.00"),
+        _row(models.TransactionType.P2P_CREDITO, 1, ACCOUNT_ID, "500.00"),
+        _row(models.TransactionType.P2P_DEBITO, ACCOUNT_ID, 3, "176.52"),
+    ]
+    balance = Decimal("0.00")
+    for index, row in enumerate(rows, start=1):
+        amount = ledger.row_signed_amount(row, ACCOUNT_ID)
+        balance += amount
+        yield {
+            "id": index, "timestamp_utc": datetime(2026, 1, 1), "type": row.type.value, "value": row.value,
+            "amount": amount, "balance": balance, "origin_account_id": row.origin_account_id,
+            "destination_account_id": row.destination_account_id, "reference_entity_id": None,
+        }
+
+
+def test_mirror_row_amount_is_a_two_decimal_zero():
+    mirror = _row(models.TransactionType.P2P_CREDITO, 1, ACCOUNT_ID, "500.00")
+    self_transfer = _row(models.TransactionType.P2P_DEBITO, ACCOUNT_ID, ACCOUNT_ID, "10.00")
+    unrelated = _row(models.TransactionType.P2P_DEBITO, 1, 3, "10.00")
+    for row in (mirror, self_transfer, unrelated):
+        amount = ledger.row_signed_amount(row, ACCOUNT_ID)
+        assert isinstance(amount, Decimal) and str(amount) == "0.00"
+
+def test_ndjson_export_formats_every_amount_alike():
+    lines = [json.loads(line) for line in wallet._ndjson_stream(_statement())]
+    assert [line["amount"] for line in lines] == ["500.00", "0.00", "-176.52"]
+    assert [line["balance"] for line in lines] == ["500.00", "500.00", "323.48"]
+
+def test_csv_export_formats_every_amount_alike():
+    body = "".join(wallet._csv_stream(_statement()))
+    assert [row["amount"] for row in csv.DictReader(io.StringIO(body))] == ["500.00", "0.00", "-176.52"]